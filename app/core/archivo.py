@@ -0,0 +1,164 @@
+import glob
+import gzip
+import json
+import os
+from collections import defaultdict
+from datetime import timedelta
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from app.core.historial import instantaneas_para_archivar
+from app.core.models import RegistroAccion
+
+
+CAMPOS_ARCHIVO = (
+    'id', 'centro_id', 'fecha', 'accion', 'modelo', 'objeto_id', 'objeto_repr', 'cambios',
+    'usuario_id', 'usuario__nombre', 'usuario__apellidos',
+)
+TAMANO_BLOQUE = 5000
+# Bloque escrito en los ficheros y aún no borrado de la BD (ver _recuperar_bloque)
+DIARIO = '.bloque_en_curso.json'
+
+
+def directorio_archivo():
+    """Carpeta de los ficheros archivados (AUDITORIA_ARCHIVO_DIR en settings)."""
+    base = getattr(settings, 'BASE_DIR', os.getcwd())
+    return getattr(settings, 'AUDITORIA_ARCHIVO_DIR', os.path.join(base, 'archivo_auditoria'))
+
+
+def nombre_fichero(directorio, centro_id, fecha):
+    return os.path.join(directorio, f'registros_{centro_id}_{fecha:%Y-%m}.jsonl.gz')
+
+
+def _escribir_diario(directorio, ficheros, ids):
+    """Anota el tamaño de los ficheros antes de añadir un bloque y sus ids."""
+    ruta = os.path.join(directorio, DIARIO)
+    with open(ruta, 'w', encoding='utf-8') as diario:
+        json.dump({'ficheros': ficheros, 'ids': ids}, diario)
+        diario.flush()
+        os.fsync(diario.fileno())
+
+
+def _recuperar_bloque(directorio):
+    """
+    Si quedó un bloque a medias (escrito en los ficheros pero con el DELETE
+    sin confirmar porque falló o el proceso se cortó), lo quita de los
+    ficheros devolviéndolos a su tamaño anterior: sus filas siguen en la BD y
+    se volverán a archivar. Si el DELETE sí se confirmó, no hay nada que hacer.
+    """
+    ruta = os.path.join(directorio, DIARIO)
+    if not os.path.exists(ruta):
+        return
+    with open(ruta, encoding='utf-8') as diario:
+        datos = json.load(diario)
+    if RegistroAccion.objects.filter(pk__in=datos['ids']).exists():
+        for fichero, tamano in datos['ficheros'].items():
+            if not os.path.exists(fichero):
+                continue
+            if tamano:
+                with open(fichero, 'r+b') as f:
+                    f.truncate(tamano)
+            else:
+                os.remove(fichero)
+    os.remove(ruta)
+
+
+def archivar_registros(dias=365, centro=None, directorio=None, borrar=True):
+    """
+    Mueve los RegistroAccion con más de `dias` días a ficheros JSONL
+    comprimidos, uno por centro y mes. Se leen en bloques por id (seek, sin
+    OFFSET); cada bloque se añade a sus ficheros como un miembro gzip nuevo
+    (gzip los lee seguidos) y solo entonces se borra de la BD. Antes de
+    escribir se anota el tamaño de los ficheros, así que un bloque cuyo
+    DELETE no llegó a confirmarse se quita de los ficheros (al fallar o en la
+    siguiente ejecución): si el proceso se corta, basta con volver a lanzarlo
+    y ningún registro queda archivado dos veces. Antes de borrar un bloque se
+    guarda la instantánea de cada objeto en su última revisión del bloque,
+    para que su historial se pueda seguir reconstruyendo. Devuelve
+    {fichero: filas}.
+    """
+    directorio = directorio or directorio_archivo()
+    os.makedirs(directorio, exist_ok=True)
+    _recuperar_bloque(directorio)
+    limite = timezone.now() - timedelta(days=dias)
+
+    registros = RegistroAccion.objects.filter(fecha__lt=limite)
+    if centro:
+        registros = registros.filter(centro=centro)
+
+    resumen = {}
+    ultimo_id = 0
+    while True:
+        bloque = list(registros.filter(id__gt=ultimo_id).order_by('id').values(*CAMPOS_ARCHIVO)[:TAMANO_BLOQUE])
+        if not bloque:
+            break
+        ultimo_id = bloque[-1]['id']
+
+        por_fichero = defaultdict(list)
+        for fila in bloque:
+            por_fichero[nombre_fichero(directorio, fila['centro_id'], timezone.localtime(fila['fecha']))].append(fila)
+
+        ids = [fila['id'] for fila in bloque]
+        if borrar:
+            # El estado de cada objeto se guarda antes de perder sus revisiones
+            instantaneas_para_archivar(bloque)
+            _escribir_diario(
+                directorio,
+                {ruta: os.path.getsize(ruta) if os.path.exists(ruta) else 0 for ruta in por_fichero},
+                ids,
+            )
+
+        for ruta, filas in por_fichero.items():
+            with gzip.open(ruta, 'at', encoding='utf-8') as fichero:
+                fichero.writelines(
+                    json.dumps(fila, cls=DjangoJSONEncoder, ensure_ascii=False) + '\n' for fila in filas
+                )
+            resumen[ruta] = resumen.get(ruta, 0) + len(filas)
+
+        if borrar:
+            try:
+                with transaction.atomic():
+                    RegistroAccion.objects.filter(pk__in=ids).delete()
+            except Exception:
+                _recuperar_bloque(directorio)
+                raise
+            os.remove(os.path.join(directorio, DIARIO))
+
+    return resumen
+
+
+def buscar_en_archivo(directorio=None, centro_id=None, modelo=None, objeto_id=None, usuario_id=None,
+                      accion=None, desde=None, hasta=None, texto=None):
+    """
+    Búsqueda offline en los ficheros archivados. Solo abre los meses que
+    pueden contener resultados (por el nombre del fichero) y los lee en
+    streaming. Genera los registros como diccionarios.
+    """
+    directorio = directorio or directorio_archivo()
+    patron = f'registros_{centro_id if centro_id else "*"}_*.jsonl.gz'
+    texto = texto.lower() if texto else None
+
+    for ruta in sorted(glob.glob(os.path.join(directorio, patron))):
+        mes = os.path.basename(ruta).rsplit('_', 1)[1][:7]
+        if (desde and mes < f'{desde:%Y-%m}') or (hasta and mes > f'{hasta:%Y-%m}'):
+            continue
+
+        with gzip.open(ruta, 'rt', encoding='utf-8') as fichero:
+            for linea in fichero:
+                registro = json.loads(linea)
+                if modelo and registro['modelo'] != modelo:
+                    continue
+                if objeto_id and registro['objeto_id'] != objeto_id:
+                    continue
+                if usuario_id and registro['usuario_id'] != usuario_id:
+                    continue
+                if accion and registro['accion'] != accion:
+                    continue
+                fecha = parse_datetime(registro['fecha'])
+                if (desde and timezone.localdate(fecha) < desde) or (hasta and timezone.localdate(fecha) > hasta):
+                    continue
+                if texto and texto not in linea.lower():
+                    continue
+                yield registro
@@ -0,0 +1,313 @@
+import random
+from collections import Counter
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from datetime import date, datetime
+from decimal import Decimal
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from django.db.models.fields.files import FieldFile
+from django.db.models.signals import post_init, post_save, post_delete
+from app.core.middleware.usuario_actual import get_usuario_actual
+
+
+# Estado de la petición o tarea en curso: registros pendientes de volcar y
+# recuento del lote abierto. Son contextvars, no thread-locals, para que
+# funcionen igual en vistas asíncronas y se puedan copiar a otros hilos.
+_pendientes = ContextVar('auditoria_pendientes', default=None)
+_lote = ContextVar('auditoria_lote', default=None)
+
+
+def convertir_valor(valor):
+    """Convierte valores no serializables en tipos manejables para JSON."""
+    if isinstance(valor, Decimal):
+        return float(valor)
+    if isinstance(valor, (date, datetime)):
+        return valor.isoformat()
+    if isinstance(valor, FieldFile):  # Archivos / imágenes
+        return valor.name or None
+    return valor
+
+
+######################################################################################
+##########################   SEGUIMIENTO DE CAMPOS   #################################
+######################################################################################
+
+
+def valores_cargados(instance):
+    """
+    Valores actuales de los campos editables que ya están en la instancia
+    (clave: nombre del campo; las FK con su id). Los campos diferidos y los
+    asignados con expresiones F() se omiten: leerlos costaría una consulta.
+    """
+    valores = {}
+    for campo in instance._meta.concrete_fields:
+        if not campo.editable or campo.attname not in instance.__dict__:
+            continue
+        valor = instance.__dict__[campo.attname]
+        if hasattr(valor, 'resolve_expression'):
+            continue
+        if isinstance(valor, FieldFile):
+            valor = valor.name
+        valores[campo.name] = valor
+    return valores
+
+
+def capturar_valores(sender, instance, **kwargs):
+    """Receptor de post_init: guarda una foto de los valores tal y como se cargaron."""
+    instance._valores_cargados = valores_cargados(instance)
+
+
+def cambios_desde_carga(instance, excluir=()):
+    """Diff {campo: {antes, despues}} solo de los campos que han cambiado, sin tocar la BD."""
+    antes = getattr(instance, '_valores_cargados', {})
+    cambios = {}
+    for campo, nuevo in valores_cargados(instance).items():
+        if campo in excluir or campo not in antes:
+            continue
+        viejo = antes[campo]
+        if viejo != nuevo:
+            cambios[campo] = {"antes": convertir_valor(viejo), "despues": convertir_valor(nuevo)}
+    return cambios
+
+
+######################################################################################
+###########################   BUFFER DE REGISTROS   ##################################
+######################################################################################
+
+
+def perfil_actual():
+    """
+    UserProfile (con su centro) del usuario actual. En una petición es el que
+    ya resolvió el middleware (user.userprofile en caché); fuera de ella se
+    consulta una vez y queda en la caché del propio usuario.
+    """
+    user = get_usuario_actual()
+    if not user or not getattr(user, 'is_authenticated', False):
+        return None
+    return getattr(user, 'userprofile', None)
+
+
+def encolar_registro(registro):
+    """
+    Programa un RegistroAccion sin guardar. Solo llega al buffer cuando la
+    transacción en curso se confirma (o en el acto si no hay ninguna), así que
+    los cambios deshechos por un rollback nunca quedan auditados.
+    """
+    transaction.on_commit(lambda: _registro_confirmado(registro))
+
+
+def _registro_confirmado(registro):
+    pendientes = _pendientes.get()
+    if pendientes is None:
+        # Fuera de una petición o de buffer_auditoria(): se guarda directamente
+        guardar_registros([registro])
+    else:
+        pendientes.append(registro)
+
+
+def guardar_registros(registros):
+    from app.core.models import RegistroAccion
+    RegistroAccion.objects.bulk_create(registros)
+
+
+@contextmanager
+def buffer_auditoria():
+    """
+    Agrupa los registros confirmados dentro del bloque y los guarda al salir
+    con un único bulk_create. El middleware envuelve cada petición con él;
+    comandos y scripts pueden usarlo igual.
+    """
+    token = _pendientes.set([])
+    try:
+        yield
+    finally:
+        pendientes = _pendientes.get()
+        _pendientes.reset(token)
+        if pendientes:
+            guardar_registros(pendientes)
+
+
+@asynccontextmanager
+async def buffer_auditoria_async():
+    """buffer_auditoria() para código asíncrono: el guardado final va a un hilo."""
+    token = _pendientes.set([])
+    try:
+        yield
+    finally:
+        pendientes = _pendientes.get()
+        _pendientes.reset(token)
+        if pendientes:
+            await sync_to_async(guardar_registros)(pendientes)
+
+
+######################################################################################
+#############################   REGISTRO DE MODELOS   ################################
+######################################################################################
+
+
+# Campos que nunca se guardan en el diff
+EXCLUIR_SIEMPRE = ("observaciones", "fecha_creacion", "id")
+
+
+class ConfigAuditoria:
+    """
+    Opciones de auditoría de un modelo:
+      - excluir: campos que no se guardan en los cambios (ruido o datos sensibles)
+      - muestreo: fracción (0-1) de las modificaciones que se registran; las
+        altas y bajas se registran siempre
+      - omitir_en_lote: dentro de auditoria_en_lote() sus filas solo se cuentan
+    """
+
+    def __init__(self, excluir=(), muestreo=1.0, omitir_en_lote=True):
+        self.excluir = set(EXCLUIR_SIEMPRE) | set(excluir)
+        self.muestreo = muestreo
+        self.omitir_en_lote = omitir_en_lote
+
+
+REGISTRO = {}
+
+
+def auditar(modelo, **opciones):
+    """Da de alta un modelo en la auditoría con un único despachador genérico."""
+    REGISTRO[modelo] = ConfigAuditoria(**opciones)
+    etiqueta = modelo._meta.label_lower
+    post_init.connect(capturar_valores, sender=modelo, dispatch_uid=f'auditoria_init_{etiqueta}')
+    post_save.connect(_al_guardar, sender=modelo, dispatch_uid=f'auditoria_save_{etiqueta}')
+    post_delete.connect(_al_borrar, sender=modelo, dispatch_uid=f'auditoria_delete_{etiqueta}')
+
+
+def _al_guardar(sender, instance, created, raw=False, **kwargs):
+    if raw or getattr(instance, "_skip_signal", False):
+        return
+    registrar_accion(instance, 'crear' if created else 'modificar')
+
+
+def _al_borrar(sender, instance, **kwargs):
+    registrar_accion(instance, 'eliminar')
+
+
+def registrar_accion(instance, accion):
+    """
+    Crea un registro de acción para cualquier modelo auditado.
+    Si es modificación, guarda solo los campos cambiados (antes/después),
+    comparando con los valores capturados al cargar la instancia.
+    """
+    config = REGISTRO.get(type(instance)) or ConfigAuditoria()
+    modelo = instance.__class__.__name__
+
+    lote = _lote.get()
+    if lote is not None and config.omitir_en_lote:
+        lote[(modelo, accion)] += 1
+        capturar_valores(type(instance), instance)
+        return
+
+    if accion == "modificar" and config.muestreo < 1 and random.random() >= config.muestreo:
+        capturar_valores(type(instance), instance)
+        return
+
+    usuario = perfil_actual()
+    centro = usuario.centro if usuario else None
+
+    cambios = None
+    if accion == "modificar":
+        cambios = cambios_desde_carga(instance, excluir=config.excluir)
+    elif accion == "crear":
+        excluir = config.excluir | {"centro"}
+        cambios = {
+            campo: {"antes": None, "despues": convertir_valor(valor)}
+            for campo, valor in valores_cargados(instance).items()
+            if campo not in excluir
+        }
+
+    if accion != "eliminar":
+        # Lo guardado pasa a ser la referencia del siguiente save()
+        capturar_valores(type(instance), instance)
+
+    if usuario and centro:
+        from app.core.models import RegistroAccion
+        # Se guarda al confirmar la transacción, junto al resto de la petición
+        encolar_registro(RegistroAccion(
+            usuario=usuario,
+            centro=centro,
+            accion=accion,
+            modelo=modelo,
+            objeto_id=instance.pk,
+            objeto_repr=str(instance),
+            cambios=cambios,
+        ))
+    else:
+        print(f"[WARN] RegistroAccion no creado: usuario o centro ausente para {instance}")
+
+
+@contextmanager
+def auditoria_en_lote(descripcion, modelo='Lote', objeto_id=0, centro=None):
+    """
+    Suspende el registro fila a fila de los modelos con omitir_en_lote
+    (descuento de stock en producción, importaciones...) y, al salir, deja un
+    único RegistroAccion 'lote' con el recuento por modelo y acción.
+    Anidado dentro de otro lote, cuenta en el exterior. `centro` permite
+    anotar el resumen en otro centro que el del usuario (importaciones del
+    superadministrador).
+    """
+    if _lote.get() is not None:
+        yield
+        return
+
+    contador = Counter()
+    token = _lote.set(contador)
+    try:
+        yield
+    finally:
+        _lote.reset(token)
+        usuario = perfil_actual()
+        centro = centro or (usuario.centro if usuario else None)
+        if contador and centro:
+            resumen = {}
+            for (nombre, accion), veces in sorted(contador.items()):
+                resumen.setdefault(nombre, {})[accion] = veces
+
+            from app.core.models import RegistroAccion
+            encolar_registro(RegistroAccion(
+                usuario=usuario,
+                centro=centro,
+                accion='lote',
+                modelo=modelo,
+                objeto_id=objeto_id,
+                objeto_repr=descripcion,
+                cambios=resumen,
+            ))
+
+
+@contextmanager
+def parte_de_lote():
+    """
+    Dentro de un lote abierto, lo contado en el bloque solo se suma al lote si
+    el bloque termina sin error: una transacción deshecha (una etiqueta que no
+    se pudo producir) no aparece en el resumen.
+    """
+    exterior = _lote.get()
+    if exterior is None:
+        yield
+        return
+
+    contador = Counter()
+    token = _lote.set(contador)
+    try:
+        yield
+    finally:
+        _lote.reset(token)
+    exterior.update(contador)
+
+
+def contar_en_lote(modelo, accion, veces=1):
+    """
+    Suma al lote abierto filas escritas sin señales (bulk_create,
+    bulk_update, update()). Devuelve False si no hay ningún lote abierto.
+    """
+    lote = _lote.get()
+    if lote is None:
+        return False
+    if veces:
+        lote[(modelo, accion)] += veces
+    return True
@@ -0,0 +1,180 @@
+from django.db.models import Q
+from app.core.models import RegistroAccion, InstantaneaRegistro
+
+
+# Cada cuántas revisiones reconstruidas se guarda una instantánea completa
+INSTANTANEA_CADA = 50
+# Revisiones que se muestran en el panel de las fichas
+REVISIONES_PANEL = 20
+# Acciones que describen un objeto (los 'lote' son resúmenes, no diffs)
+ACCIONES_OBJETO = ("crear", "modificar", "eliminar")
+
+
+def historial_objeto(centro, modelo, objeto_id):
+    """Revisiones de un objeto, de la más reciente a la más antigua (índice registro_objeto_idx)."""
+    return (
+        RegistroAccion.objects
+        .filter(centro=centro, modelo=modelo, objeto_id=objeto_id, accion__in=ACCIONES_OBJETO)
+        .order_by("-fecha", "-id")
+    )
+
+
+def lotes_del_modelo(centro, modelo, desde=None, hasta=None):
+    """
+    Resúmenes 'lote' del centro que incluyen filas de `modelo`. Dentro de
+    auditoria_en_lote() los modelos con omitir_en_lote solo se cuentan, así
+    que esos cambios no están en el historial de cada objeto.
+    """
+    lotes = RegistroAccion.objects.filter(centro=centro, accion="lote", cambios__has_key=modelo)
+    if desde:
+        lotes = lotes.filter(fecha__gte=desde)
+    if hasta:
+        lotes = lotes.filter(fecha__lte=hasta)
+    return lotes
+
+
+def _omite_en_lote(modelo):
+    from app.core.auditoria import REGISTRO
+    return any(clase.__name__ == modelo and config.omitir_en_lote for clase, config in REGISTRO.items())
+
+
+def panel_historial(centro, objeto, limite=REVISIONES_PANEL):
+    """Contexto del panel de historial (core/_historial_objeto.html) para una ficha."""
+    modelo = objeto.__class__.__name__
+    revisiones = historial_objeto(centro, modelo, objeto.pk).select_related("usuario")
+    primera = revisiones.order_by("fecha", "id").values_list("fecha", flat=True).first()
+    ultimo_lote = None
+    if _omite_en_lote(modelo):
+        ultimo_lote = lotes_del_modelo(centro, modelo, desde=primera).order_by("-fecha").first()
+    return {
+        "modelo": modelo,
+        "objeto_id": objeto.pk,
+        "revisiones": list(revisiones[:limite]),
+        "total": revisiones.count(),
+        "ultimo_lote": ultimo_lote,
+    }
+
+
+def historial_para(request, objeto):
+    """
+    Panel de historial para la ficha de `objeto`, o None si el usuario no
+    puede ver el registro de acciones de su centro.
+    """
+    from app.super.permissions import tiene_permiso
+    perfil = getattr(request.user, "userprofile", None)
+    if not perfil or not perfil.centro or not tiene_permiso(perfil, "RegistroAccion", "read"):
+        return None
+    return panel_historial(perfil.centro, objeto)
+
+
+def _posteriores(consulta, fecha, registro_id, campo_id="id"):
+    """Filtra las filas con clave (fecha, id) estrictamente posterior a la dada."""
+    return consulta.filter(Q(fecha__gt=fecha) | Q(fecha=fecha, **{f"{campo_id}__gt": registro_id}))
+
+
+def _hasta(consulta, fecha, registro_id, campo_id="id"):
+    """Filtra las filas con clave (fecha, id) anterior o igual a la dada."""
+    return consulta.filter(Q(fecha__lt=fecha) | Q(fecha=fecha, **{f"{campo_id}__lte": registro_id}))
+
+
+def aplicar_revision(estado, accion, cambios):
+    """Aplica una revisión al estado {campo: valor}. Devuelve (estado, eliminado)."""
+    if accion == "crear":
+        return {campo: cambio.get("despues") for campo, cambio in (cambios or {}).items()}, False
+    if accion == "eliminar":
+        return estado, True
+    nuevo = dict(estado)
+    for campo, cambio in (cambios or {}).items():
+        nuevo[campo] = cambio.get("despues")
+    return nuevo, False
+
+
+def estado_en(centro, modelo, objeto_id, registro_id=None, instantanea_final=False):
+    """
+    Reconstruye el estado del objeto tras la revisión `registro_id` (o tras la
+    última) plegando los diffs de `cambios` en orden. Parte de la instantánea
+    más cercana anterior y, mientras pliega, guarda una nueva cada
+    INSTANTANEA_CADA revisiones: la primera consulta de un objeto con miles de
+    revisiones las recorre una vez y las siguientes pliegan como mucho
+    INSTANTANEA_CADA. Las revisiones nunca cambian, así que las instantáneas
+    no caducan. Con `instantanea_final` guarda también la del propio objetivo
+    (antes de archivar sus revisiones).
+
+    Solo es completo si el pliegue parte de una instantánea o de la revisión
+    'crear'; si no (alta archivada sin instantánea, objeto anterior a la
+    auditoría) el estado tiene únicamente los campos modificados y no se
+    guarda ninguna instantánea.
+
+    Devuelve {"registro", "estado", "eliminado", "plegadas", "completo"} o
+    None si la revisión no existe.
+    """
+    revisiones = historial_objeto(centro, modelo, objeto_id)
+    objetivo = revisiones.filter(pk=registro_id).first() if registro_id else revisiones.first()
+    if objetivo is None:
+        return None
+
+    instantanea = (
+        _hasta(
+            InstantaneaRegistro.objects.filter(centro=centro, modelo=modelo, objeto_id=objeto_id),
+            objetivo.fecha, objetivo.pk, campo_id="registro_id",
+        )
+        .order_by("-fecha", "-registro_id")
+        .first()
+    )
+
+    pendientes = _hasta(revisiones, objetivo.fecha, objetivo.pk)
+    if instantanea:
+        estado, eliminado = instantanea.estado, instantanea.eliminado
+        pendientes = _posteriores(pendientes, instantanea.fecha, instantanea.registro_id)
+    else:
+        estado, eliminado = {}, False
+
+    centro_id = getattr(centro, "pk", centro)
+    completo = instantanea is not None
+    nuevas = []
+    plegadas = 0
+    filas = pendientes.order_by("fecha", "id").values_list("id", "fecha", "accion", "cambios")
+    for pk, fecha, accion, cambios in filas.iterator(chunk_size=INSTANTANEA_CADA * 10):
+        if plegadas == 0 and accion == "crear":
+            completo = True
+        estado, eliminado = aplicar_revision(estado, accion, cambios)
+        plegadas += 1
+        if plegadas % INSTANTANEA_CADA == 0 or (instantanea_final and pk == objetivo.pk):
+            nuevas.append(InstantaneaRegistro(
+                centro_id=centro_id, modelo=modelo, objeto_id=objeto_id,
+                registro_id=pk, fecha=fecha, estado=estado, eliminado=eliminado,
+            ))
+
+    if nuevas and completo:
+        InstantaneaRegistro.objects.bulk_create(nuevas, ignore_conflicts=True)
+
+    return {
+        "registro": objetivo,
+        "estado": estado,
+        "eliminado": eliminado,
+        "plegadas": plegadas,
+        "completo": completo,
+    }
+
+
+def instantaneas_para_archivar(filas):
+    """
+    Guarda la instantánea de cada objeto en su última revisión de `filas`
+    (valores de RegistroAccion con centro_id, modelo, objeto_id, fecha e id)
+    para que, archivadas sus revisiones, estado_en() siga partiendo de un
+    estado completo. Devuelve cuántos objetos quedan con instantánea.
+    """
+    ultimas = {}
+    for fila in filas:
+        if fila["accion"] not in ACCIONES_OBJETO or not fila["centro_id"]:
+            continue
+        clave = (fila["centro_id"], fila["modelo"], fila["objeto_id"])
+        if clave not in ultimas or (fila["fecha"], fila["id"]) > ultimas[clave]:
+            ultimas[clave] = (fila["fecha"], fila["id"])
+
+    guardadas = 0
+    for (centro_id, modelo, objeto_id), (_, registro_id) in ultimas.items():
+        resultado = estado_en(centro_id, modelo, objeto_id, registro_id, instantanea_final=True)
+        if resultado and resultado["completo"]:
+            guardadas += 1
+    return guardadas
@@ -0,0 +1,252 @@
+import hashlib
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models.signals import post_init, post_save
+from PIL import Image, ImageOps, UnidentifiedImageError, features
+
+logger = logging.getLogger(__name__)
+
+
+# Imágenes de alimentos, platos, etc. Las importadas se copian con el hash de
+# su contenido como nombre (la misma foto en mil filas se guarda una vez) y de
+# cada imagen se generan miniaturas de tamaño fijo en MEDIA_ROOT/miniaturas/,
+# que son las que pintan los listados y las etiquetas (filtro `miniatura`).
+# Todo el trabajo con ficheros va en hilos y fuera de las transacciones.
+
+# nombre: (ancho, alto, recortar). Recortar = rellena el tamaño exacto; si no, cabe dentro.
+TAMANOS = {
+    'lista': (96, 96, True),        # Celdas de las tablas
+    'tarjeta': (400, 300, True),    # Vista en cuadrícula
+    'etiqueta': (300, 300, False),  # Etiquetas impresas
+}
+CARPETA_MINIATURAS = 'miniaturas'
+FORMATO, EXTENSION = ('WEBP', '.webp') if features.check('webp') else ('JPEG', '.jpg')
+EXTENSIONES_IMAGEN = ('.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp')
+
+_executor = ThreadPoolExecutor(max_workers=getattr(settings, 'IMAGENES_HILOS', 4), thread_name_prefix='imagenes')
+_bloqueo = threading.Lock()
+# Candados por hash repartidos en un número fijo (dos hashes pueden compartir
+# uno y solo esperan de más; un dict por hash crecería sin límite)
+_bloqueos_hash = [threading.Lock() for _ in range(64)]
+_en_cola = set()
+_fallidas = set()  # Originales que no se pudieron leer: no se reintentan en cada página
+
+
+def _hilos(hilos=None):
+    return hilos or getattr(settings, 'IMAGENES_HILOS', 4)
+
+
+######################################################################################
+##################################   MINIATURAS    ###################################
+######################################################################################
+
+
+def ruta_miniatura(nombre, tamano):
+    """
+    Ruta en el storage de la miniatura `tamano` de la imagen `nombre`. Se
+    conserva la extensión del original: foo.jpg y foo.png son imágenes
+    distintas y no pueden compartir miniatura.
+    """
+    return f"{CARPETA_MINIATURAS}/{tamano}/{nombre}{EXTENSION}"
+
+
+def generar_miniaturas(nombre, forzar=False, storage=default_storage):
+    """
+    Crea las miniaturas de una imagen del storage (las que falten, o todas con
+    `forzar`). Devuelve cuántas ha escrito; 0 si la imagen no existe o no se
+    puede leer.
+    """
+    pendientes = {
+        tamano: ruta_miniatura(nombre, tamano)
+        for tamano in TAMANOS
+        if forzar or not storage.exists(ruta_miniatura(nombre, tamano))
+    }
+    if not pendientes:
+        return 0
+
+    try:
+        with storage.open(nombre, 'rb') as archivo:
+            original = ImageOps.exif_transpose(Image.open(archivo))
+            original.load()
+    except (FileNotFoundError, UnidentifiedImageError, OSError) as e:
+        logger.warning("No se pueden generar miniaturas de %s: %s", nombre, e)
+        return 0
+
+    modo = 'RGBA' if FORMATO == 'WEBP' and original.mode in ('RGBA', 'LA', 'P') else 'RGB'
+    original = original.convert(modo)
+    for tamano, ruta in pendientes.items():
+        ancho, alto, recortar = TAMANOS[tamano]
+        if recortar:
+            miniatura = ImageOps.fit(original, (ancho, alto), Image.LANCZOS)
+        else:
+            miniatura = original.copy()
+            miniatura.thumbnail((ancho, alto), Image.LANCZOS)
+        buffer = BytesIO()
+        miniatura.save(buffer, FORMATO, quality=82)
+        if storage.exists(ruta):
+            storage.delete(ruta)
+        storage.save(ruta, ContentFile(buffer.getvalue()))
+    return len(pendientes)
+
+
+def programar_miniaturas(nombre, reintentar=False):
+    """
+    Genera las miniaturas en segundo plano, sin duplicar las ya en cola. Las
+    imágenes que fallaron solo se reintentan con `reintentar` (al guardarse).
+    """
+    with _bloqueo:
+        if nombre in _en_cola or (nombre in _fallidas and not reintentar):
+            return
+        _en_cola.add(nombre)
+        _fallidas.discard(nombre)
+
+    def trabajo():
+        escritas = 0
+        try:
+            escritas = generar_miniaturas(nombre)
+        finally:
+            with _bloqueo:
+                _en_cola.discard(nombre)
+                if not escritas and not default_storage.exists(ruta_miniatura(nombre, 'lista')):
+                    _fallidas.add(nombre)
+
+    _executor.submit(trabajo)
+
+
+def url_miniatura(archivo, tamano):
+    """
+    URL de la miniatura de un FieldFile; mientras no exista se usa la imagen
+    original y se programa su generación.
+    """
+    if not archivo or not archivo.name:
+        return ''
+    ruta = ruta_miniatura(archivo.name, tamano)
+    if archivo.storage.exists(ruta):
+        return archivo.storage.url(ruta)
+    if archivo.storage is default_storage:
+        programar_miniaturas(archivo.name)
+    return archivo.url
+
+
+def _nombre_imagen(instance):
+    imagen = instance.__dict__.get('imagen')
+    return getattr(imagen, 'name', imagen) or ''
+
+
+def _al_cargar(sender, instance, **kwargs):
+    # Nombre con el que se cargó la instancia, para saber al guardar si cambió
+    instance._imagen_cargada = _nombre_imagen(instance)
+
+
+def _al_guardar(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    # Solo si se guarda la imagen y es otra: los save(update_fields=['stock_util'])
+    # de producción no tocan el storage
+    if raw or (update_fields is not None and 'imagen' not in update_fields):
+        return
+    nombre = _nombre_imagen(instance)
+    anterior = getattr(instance, '_imagen_cargada', None)
+    instance._imagen_cargada = nombre
+    if nombre and (created or nombre != anterior):
+        transaction.on_commit(lambda: programar_miniaturas(nombre, reintentar=True))
+
+
+def registrar_miniaturas(modelo):
+    """Genera las miniaturas del campo `imagen` del modelo cuando se guarda una imagen nueva."""
+    uid = f'miniaturas_{modelo._meta.label_lower}'
+    post_init.connect(_al_cargar, sender=modelo, dispatch_uid=uid)
+    post_save.connect(_al_guardar, sender=modelo, dispatch_uid=uid)
+
+
+######################################################################################
+###########################   IMÁGENES IMPORTADAS (HASH)    ##########################
+######################################################################################
+
+
+def _bloqueo_hash(digest):
+    return _bloqueos_hash[int(digest[:8], 16) % len(_bloqueos_hash)]
+
+
+def guardar_por_hash(ruta, carpeta, storage=default_storage):
+    """
+    Copia el fichero `ruta` al storage como `carpeta/<sha256>.<ext>` (si ya
+    hay uno con el mismo contenido no se vuelve a escribir) y genera sus
+    miniaturas. Devuelve el nombre en el storage o None si no es una imagen.
+    """
+    with open(ruta, 'rb') as origen:
+        contenido = origen.read()
+    try:
+        Image.open(BytesIO(contenido)).verify()
+    except (UnidentifiedImageError, OSError):
+        return None
+
+    digest = hashlib.sha256(contenido).hexdigest()
+    extension = os.path.splitext(ruta)[1].lower() or '.jpg'
+    nombre = f"{carpeta.strip('/')}/{digest}{extension}"
+    with _bloqueo_hash(digest):
+        if not storage.exists(nombre):
+            storage.save(nombre, ContentFile(contenido))
+        generar_miniaturas(nombre, storage=storage)
+    return nombre
+
+
+def ingerir_imagenes(rutas, carpeta, hilos=None):
+    """
+    Copia en paralelo las imágenes `rutas` (relativas a MEDIA_ROOT) con
+    guardar_por_hash(). Devuelve {ruta: nombre en el storage o None si no
+    existe o no es una imagen}. No toca la BD: se llama antes de abrir la
+    transacción que asigna las imágenes.
+    """
+    rutas = list(dict.fromkeys(ruta for ruta in rutas if ruta))
+
+    def ingerir(ruta):
+        absoluta = os.path.join(settings.MEDIA_ROOT, ruta)
+        if not os.path.isfile(absoluta):
+            return ruta, None
+        try:
+            return ruta, guardar_por_hash(absoluta, carpeta)
+        except OSError as e:
+            logger.warning("No se pudo copiar la imagen %s: %s", ruta, e)
+            return ruta, None
+
+    if len(rutas) <= 1:
+        return dict(map(ingerir, rutas))
+    with ThreadPoolExecutor(max_workers=min(_hilos(hilos), len(rutas))) as executor:
+        return dict(executor.map(ingerir, rutas))
+
+
+######################################################################################
+############################   MEDIA EXISTENTE (RELLENO)    ##########################
+######################################################################################
+
+
+def imagenes_en_media(carpeta=''):
+    """Nombres (relativos a MEDIA_ROOT) de las imágenes bajo `carpeta`, sin las miniaturas."""
+    raiz = os.path.join(settings.MEDIA_ROOT, carpeta)
+    for directorio, subdirectorios, archivos in os.walk(raiz):
+        relativo = os.path.relpath(directorio, settings.MEDIA_ROOT).replace(os.sep, '/')
+        if relativo == CARPETA_MINIATURAS:
+            subdirectorios[:] = []
+            continue
+        for archivo in archivos:
+            if archivo.lower().endswith(EXTENSIONES_IMAGEN):
+                yield archivo if relativo == '.' else f"{relativo}/{archivo}"
+
+
+def generar_miniaturas_media(carpeta='', forzar=False, hilos=None):
+    """
+    Genera en paralelo las miniaturas de las imágenes que ya hay en
+    MEDIA_ROOT. Devuelve (imágenes revisadas, miniaturas escritas).
+    """
+    nombres = list(imagenes_en_media(carpeta))
+    if not nombres:
+        return 0, 0
+    with ThreadPoolExecutor(max_workers=_hilos(hilos)) as executor:
+        escritas = sum(executor.map(lambda nombre: generar_miniaturas(nombre, forzar=forzar), nombres))
+    return len(nombres), escritas
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from app.core.archivo import archivar_registros, directorio_archivo
+
+
+class Command(BaseCommand):
+    help = (
+        "Mueve los registros de auditoría antiguos a ficheros JSONL comprimidos "
+        "(uno por centro y mes) y los borra de la base de datos. Se pueden "
+        "consultar después con buscar_registros_archivados."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dias', type=int, default=365, help="Conservar en la BD los últimos N días")
+        parser.add_argument('--centro', type=int, help="Limitar a un centro (id)")
+        parser.add_argument('--destino', help=f"Carpeta de los ficheros (por defecto {directorio_archivo()})")
+        parser.add_argument('--sin-borrar', action='store_true', help="Solo exportar, sin borrar de la BD")
+
+    def handle(self, *args, **options):
+        resumen = archivar_registros(
+            dias=options['dias'],
+            centro=options['centro'],
+            directorio=options['destino'],
+            borrar=not options['sin_borrar'],
+        )
+        for ruta, filas in sorted(resumen.items()):
+            self.stdout.write(f"{ruta}: {filas} registros")
+        self.stdout.write(self.style.SUCCESS(f"{sum(resumen.values())} registros archivados."))
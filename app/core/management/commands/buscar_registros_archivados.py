@@ -0,0 +1,36 @@
+import json
+from django.core.management.base import BaseCommand
+from django.utils.dateparse import parse_date
+from app.core.archivo import buscar_en_archivo
+
+
+class Command(BaseCommand):
+    help = "Busca en los registros de auditoría archivados. Escribe una línea JSON por registro encontrado."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--centro', type=int, help="Centro (id)")
+        parser.add_argument('--modelo', help="Nombre del modelo, p. ej. Alimento")
+        parser.add_argument('--objeto', type=int, help="Id del objeto")
+        parser.add_argument('--usuario', type=int, help="Id del UserProfile")
+        parser.add_argument('--accion', help="crear, modificar, eliminar o lote")
+        parser.add_argument('--desde', type=parse_date, help="AAAA-MM-DD")
+        parser.add_argument('--hasta', type=parse_date, help="AAAA-MM-DD")
+        parser.add_argument('--texto', help="Texto libre (en cualquier campo)")
+        parser.add_argument('--origen', help="Carpeta de los ficheros archivados")
+
+    def handle(self, *args, **options):
+        total = 0
+        for registro in buscar_en_archivo(
+            directorio=options['origen'],
+            centro_id=options['centro'],
+            modelo=options['modelo'],
+            objeto_id=options['objeto'],
+            usuario_id=options['usuario'],
+            accion=options['accion'],
+            desde=options['desde'],
+            hasta=options['hasta'],
+            texto=options['texto'],
+        ):
+            self.stdout.write(json.dumps(registro, ensure_ascii=False))
+            total += 1
+        self.stderr.write(f"{total} registros encontrados.")
@@ -0,0 +1,24 @@
+import os
+from django.core.management.base import BaseCommand
+from app.core.imagenes import TAMANOS, generar_miniaturas_media
+
+
+class Command(BaseCommand):
+    help = (
+        "Genera las miniaturas (" + ", ".join(TAMANOS) + ") de las imágenes que "
+        "ya hay en MEDIA_ROOT, en paralelo. Solo crea las que falten salvo con "
+        "--forzar; las nuevas imágenes las generan solas al guardarse."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--carpeta', default='', help="Limitar a una carpeta de MEDIA_ROOT (p. ej. alimentos)")
+        parser.add_argument('--hilos', type=int, default=os.cpu_count(), help="Hilos en paralelo (por defecto, uno por CPU)")
+        parser.add_argument('--forzar', action='store_true', help="Regenerar también las miniaturas existentes")
+
+    def handle(self, *args, **options):
+        imagenes, escritas = generar_miniaturas_media(
+            carpeta=options['carpeta'],
+            forzar=options['forzar'],
+            hilos=max(options['hilos'] or 1, 1),
+        )
+        self.stdout.write(self.style.SUCCESS(f"{imagenes} imágenes revisadas, {escritas} miniaturas generadas."))
@@ -0,0 +1,58 @@
+from django.http import Http404
+from app.super.models import UserProfile
+
+
+def resolver_centro(request):
+    """
+    Resuelve una sola vez por petición el UserProfile (con su centro por
+    select_related) del usuario y lo deja en request.user_profile y
+    request.centro. También queda en la caché de request.user.userprofile,
+    así que el código que usa ese atributo tampoco vuelve a consultar.
+    """
+    if hasattr(request, "user_profile"):
+        return request.user_profile
+
+    perfil = None
+    user = getattr(request, "user", None)
+    if user is not None and user.is_authenticated:
+        perfil = UserProfile.objects.select_related("centro").filter(user_id=user.pk).first()
+        if perfil is not None:
+            # Cachea la relación en los dos sentidos (user.userprofile y perfil.user)
+            user.userprofile = perfil
+
+    request.user_profile = perfil
+    request.centro = perfil.centro if perfil else None
+    return perfil
+
+
+def perfil_de_request(request):
+    """UserProfile del usuario de la petición o None."""
+    return resolver_centro(request)
+
+
+def perfil_o_404(request):
+    """Como get_object_or_404(UserProfile, user=request.user), sin repetir la consulta."""
+    perfil = resolver_centro(request)
+    if perfil is None:
+        raise Http404("El usuario no tiene perfil")
+    return perfil
+
+
+def centro_de_request(request):
+    """Centro del usuario de la petición o None."""
+    resolver_centro(request)
+    return request.centro
+
+
+class CentroMiddleware:
+    """
+    Middleware de tenant: resuelve perfil y centro al principio de cada
+    petición (ver resolver_centro). Debe ir después de AuthenticationMiddleware.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        resolver_centro(request)
+        return self.get_response(request)
@@ -1,33 +1,128 @@
-import threading
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+
+# Usuario y centro de la petición en curso. Con contextvars cada petición
+# (hilo o tarea asyncio) ve su propio valor y el middleware lo restaura al
+# terminar, así que no se filtran usuarios entre peticiones.
+_usuario_actual = ContextVar('usuario_actual', default=None)
+_centro_actual = ContextVar('centro_actual', default=None)
 
-# Creamos un objeto thread-safe para guardar el usuario actual
-_usuario_actual = threading.local()
 
 class UsuarioActualMiddleware:
     """
-    Middleware que almacena el usuario actual en un objeto thread-local
-    para que pueda ser accedido en signals y otras partes del código.
+    Middleware que fija el usuario y el centro actuales durante la petición
+    para que puedan ser accedidos en signals y otras partes del código.
+    Funciona igual en WSGI y en ASGI (vistas síncronas y asíncronas).
     """
+    sync_capable = True
+    async_capable = True
+
     def __init__(self, get_response):
         self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
 
     def __call__(self, request):
-        # Guardamos el usuario actual, si existe
-        _usuario_actual.user = getattr(request, 'user', None)
-        response = self.get_response(request)
-        return response
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        from app.core.auditoria import buffer_auditoria
+        from app.core.middleware.centro import resolver_centro
+
+        # Perfil y centro resueltos una vez para toda la petición
+        resolver_centro(request)
+        with contexto_usuario(getattr(request, 'user', None), request.centro):
+            # Los registros de auditoría de la petición se guardan juntos al final
+            with buffer_auditoria():
+                return self.get_response(request)
+
+    async def __acall__(self, request):
+        from app.core.auditoria import buffer_auditoria_async
+        from app.core.middleware.centro import resolver_centro
+
+        await sync_to_async(resolver_centro)(request)
+        with contexto_usuario(getattr(request, 'user', None), request.centro):
+            async with buffer_auditoria_async():
+                return await self.get_response(request)
+
+
+@contextmanager
+def contexto_usuario(usuario, centro=None):
+    """
+    Fija usuario (y centro) mientras dura el bloque y después restaura los
+    anteriores. Para tareas en segundo plano, comandos y trabajos.
+    """
+    token_usuario = _usuario_actual.set(usuario)
+    token_centro = _centro_actual.set(centro)
+    try:
+        yield
+    finally:
+        _centro_actual.reset(token_centro)
+        _usuario_actual.reset(token_usuario)
+
 
 def get_usuario_actual():
     """
     Función para obtener el usuario actual desde cualquier parte del código.
     """
-    return getattr(_usuario_actual, 'user', None)
+    return _usuario_actual.get()
+
+
+def get_centro_actual():
+    """Centro de la petición o del trabajo en curso (None si no hay)."""
+    return _centro_actual.get()
 
-def set_usuario_actual(usuario):
+
+def set_usuario_actual(usuario, centro=None):
     """
-    Asigna un usuario al thread-local para usarlo fuera de una request,
+    Asigna un usuario al contexto actual para usarlo fuera de una request,
     por ejemplo en shell o scripts.
     """
-    _usuario_actual.user = usuario
+    _usuario_actual.set(usuario)
+    _centro_actual.set(centro)
+
+
+######################################################################################
+########################   PROPAGACIÓN A OTROS HILOS/PROCESOS   ######################
+######################################################################################
+
+
+def enviar_con_contexto(executor, fn, *args, **kwargs):
+    """
+    executor.submit() que ejecuta fn con una copia del contexto actual
+    (usuario y centro). Los hilos de un ThreadPoolExecutor no heredan los
+    contextvars por sí solos. El buffer y el lote de auditoría no se
+    comparten: la copia los referenciaría y el hilo escribiría en los de una
+    petición que quizá ya terminó, así que fn empieza sin ninguno.
+    """
+    def ejecutar():
+        from app.core.auditoria import _lote, _pendientes
+        _pendientes.set(None)
+        _lote.set(None)
+        return fn(*args, **kwargs)
+
+    return executor.submit(copy_context().run, ejecutar)
+
 
+def contexto_serializable():
+    """Ids de usuario y centro actuales, para pasarlos a otro proceso."""
+    usuario, centro = get_usuario_actual(), get_centro_actual()
+    return {
+        'usuario_id': getattr(usuario, 'pk', None),
+        'centro_id': getattr(centro, 'pk', None),
+    }
 
+
+@contextmanager
+def contexto_desde(datos):
+    """
+    Reconstruye en un proceso hijo (ProcessPoolExecutor, trabajo en cola) el
+    contexto guardado con contexto_serializable().
+    """
+    from django.contrib.auth.models import User
+    from app.super.models import Centros
+    usuario = User.objects.filter(pk=datos.get('usuario_id')).first() if datos.get('usuario_id') else None
+    centro = Centros.objects.filter(pk=datos.get('centro_id')).first() if datos.get('centro_id') else None
+    with contexto_usuario(usuario, centro):
+        yield
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.6 on 2026-10-19 19:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_delete_permiso'),
+        ('super', '0003_permiso'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='registroaccion',
+            index=models.Index(fields=['centro', '-fecha', '-id'], name='registro_centro_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='registroaccion',
+            index=models.Index(fields=['centro', 'modelo', '-fecha'], name='registro_centro_modelo_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='registroaccion',
+            index=models.Index(fields=['centro', 'usuario', '-fecha'], name='registro_centro_usuario_idx'),
+        ),
+    ]
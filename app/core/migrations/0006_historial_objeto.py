@@ -0,0 +1,44 @@
+# Generated by Django 5.2.6 on 2026-10-19 19:25
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_registroaccion_indices'),
+        ('super', '0003_permiso'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InstantaneaRegistro',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('modelo', models.CharField(max_length=100)),
+                ('objeto_id', models.PositiveIntegerField()),
+                ('registro_id', models.PositiveIntegerField()),
+                ('fecha', models.DateTimeField()),
+                ('estado', models.JSONField(default=dict)),
+                ('eliminado', models.BooleanField(default=False)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='registroaccion',
+            index=models.Index(fields=['centro', 'modelo', 'objeto_id', 'fecha'], name='registro_objeto_idx'),
+        ),
+        migrations.AddField(
+            model_name='instantanearegistro',
+            name='centro',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='super.centros'),
+        ),
+        migrations.AddIndex(
+            model_name='instantanearegistro',
+            index=models.Index(fields=['centro', 'modelo', 'objeto_id', 'fecha'], name='instantanea_objeto_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='instantanearegistro',
+            constraint=models.UniqueConstraint(fields=('centro', 'modelo', 'objeto_id', 'registro_id'), name='instantanea_unica'),
+        ),
+    ]
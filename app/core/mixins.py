@@ -1,6 +1,8 @@
+from urllib.parse import urlencode
+from django.db.models import Q
 from django.http import HttpResponseForbidden
 from django.views.generic import ListView, DetailView, CreateView, UpdateView, DeleteView, TemplateView
-from app.super.permissions import tiene_permiso
+from app.super.permissions import tiene_permiso, permisos_request
 
 class PermisoMixin:
     """
@@ -33,7 +35,7 @@ class PermisoMixin:
                     break
 
         # Chequea si el usuario tiene el permiso
-        user_profile = getattr(request.user, "userprofile", None)
+        user_profile, _ = permisos_request(request)
         if user_profile is None:
             return HttpResponseForbidden("Usuario sin perfil")
         if not tiene_permiso(user_profile, self.permiso_modulo, self.permiso_accion):
@@ -65,4 +67,88 @@ class PaginationMixin:
             else:
                 context['custom_page_range'] = range(current_page - window, current_page + window + 1)
         
-        return context
\ No newline at end of file
+        return context
+
+
+
+class KeysetPaginationMixin:
+    """
+    Paginación por clave (seek) para listados grandes y ordenados de forma
+    descendente por keyset_campos (el último debe ser único, normalmente id).
+    En lugar de OFFSET filtra a partir de la última fila vista, así que pedir
+    la página 1.000 cuesta lo mismo que la primera.
+
+    La página llega al template en object_list/context_object_name y los
+    cursores en 'pagina_keyset' (ver core/pagination_keyset.html).
+    """
+    keyset_campos = ('fecha', 'id')
+    keyset_por_pagina = 25
+
+    def valor_cursor(self, fila, campo):
+        return fila[campo] if isinstance(fila, dict) else getattr(fila, campo)
+
+    def crear_cursor(self, fila):
+        return '|'.join(str(self.valor_cursor(fila, campo)) for campo in self.keyset_campos)
+
+    def leer_cursor(self, cursor):
+        """Convierte el cursor a los valores tipados de cada campo (None si no es válido)."""
+        partes = cursor.split('|')
+        if len(partes) != len(self.keyset_campos):
+            return None
+        try:
+            return [
+                self.model._meta.get_field(campo).to_python(valor)
+                for campo, valor in zip(self.keyset_campos, partes)
+            ]
+        except Exception:
+            return None
+
+    def filtro_keyset(self, valores, operador):
+        """(a, b) < (va, vb)  ==>  a < va OR (a = va AND b < vb)"""
+        filtro = Q()
+        iguales = {}
+        for campo, valor in zip(self.keyset_campos, valores):
+            filtro |= Q(**iguales, **{f'{campo}__{operador}': valor})
+            iguales[campo] = valor
+        return filtro
+
+    def filas_keyset(self, queryset, filtro, orden, limite):
+        """
+        Lee una página. Se redefine cuando object_list no admite filter()
+        (por ejemplo un UNION, donde el filtro va dentro de cada consulta).
+        """
+        return list(queryset.filter(filtro).order_by(*orden)[:limite])
+
+    def paginar_keyset(self, queryset):
+        n = self.keyset_por_pagina
+        descendente = [f'-{campo}' for campo in self.keyset_campos]
+        antes = self.request.GET.get('antes')
+        despues = self.request.GET.get('despues')
+        valores = self.leer_cursor(antes or despues or '')
+
+        if antes and valores:
+            # Página anterior: las n filas siguientes en orden ascendente, invertidas
+            filas = self.filas_keyset(queryset, self.filtro_keyset(valores, 'gt'), self.keyset_campos, n + 1)
+            hay_anterior, hay_siguiente = len(filas) > n, True
+            filas = filas[:n][::-1]
+        else:
+            filtro = self.filtro_keyset(valores, 'lt') if despues and valores else Q()
+            filas = self.filas_keyset(queryset, filtro, descendente, n + 1)
+            hay_anterior, hay_siguiente = bool(despues and valores), len(filas) > n
+            filas = filas[:n]
+
+        filtros = self.request.GET.copy()
+        for clave in ('antes', 'despues', 'page'):
+            filtros.pop(clave, None)
+
+        return filas, {
+            'anterior': self.crear_cursor(filas[0]) if filas and hay_anterior else None,
+            'siguiente': self.crear_cursor(filas[-1]) if filas and hay_siguiente else None,
+            'filtros': urlencode(list(filtros.lists()), doseq=True),
+        }
+
+    def get_context_data(self, **kwargs):
+        filas, pagina = self.paginar_keyset(self.object_list)
+        context = super().get_context_data(object_list=filas, **kwargs)
+        context['pagina_keyset'] = pagina
+        return context
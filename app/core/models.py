@@ -12,7 +12,44 @@ class RegistroAccion(ModeloBaseCentro):
     objeto_repr = models.TextField()
     cambios = models.JSONField(null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            # Listado del centro por fecha (paginación por clave fecha, id)
+            models.Index(fields=['centro', '-fecha', '-id'], name='registro_centro_fecha_idx'),
+            # Filtros por modelo y por usuario dentro del centro
+            models.Index(fields=['centro', 'modelo', '-fecha'], name='registro_centro_modelo_idx'),
+            models.Index(fields=['centro', 'usuario', '-fecha'], name='registro_centro_usuario_idx'),
+            # Historial de un objeto concreto
+            models.Index(fields=['centro', 'modelo', 'objeto_id', 'fecha'], name='registro_objeto_idx'),
+        ]
+
     def __str__(self):
         return f"{self.usuario} {self.accion} {self.modelo} ({self.objeto_repr})"
 
 
+
+
+class InstantaneaRegistro(ModeloBaseCentro):
+    """
+    Estado completo de un objeto auditado tras una revisión concreta. Sirve de
+    punto de partida para reconstruir el estado sin repasar todo el historial
+    (ver app.core.historial). registro_id no es FK: la instantánea sigue
+    valiendo aunque el registro se archive.
+    """
+    modelo = models.CharField(max_length=100)
+    objeto_id = models.PositiveIntegerField()
+    registro_id = models.PositiveIntegerField()
+    fecha = models.DateTimeField()
+    estado = models.JSONField(default=dict)
+    eliminado = models.BooleanField(default=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['centro', 'modelo', 'objeto_id', 'fecha'], name='instantanea_objeto_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['centro', 'modelo', 'objeto_id', 'registro_id'], name='instantanea_unica'),
+        ]
+
+    def __str__(self):
+        return f"{self.modelo} {self.objeto_id} @ {self.registro_id}"
@@ -0,0 +1,9 @@
+from django import template
+from app.core.imagenes import url_miniatura
+
+register = template.Library()
+
+@register.filter(name='miniatura')
+def miniatura(imagen, tamano='lista'):
+    """URL de la miniatura de un ImageField: {{ alimento.imagen|miniatura:'lista' }}"""
+    return url_miniatura(imagen, tamano)
@@ -8,6 +8,7 @@ app_name = 'core'
 urlpatterns = [
     path("registros/", RegistroAccionListView.as_view(), name="registro_accion_list"),
     path("registros/<int:pk>/", RegistroAccionDetailView.as_view(), name="registro_accion_detail"),
+    path("registros/estado/<str:modelo>/<int:objeto_id>/<int:registro_id>/", EstadoObjetoView.as_view(), name="estado_objeto"),
     
     path("lista_usuarios/", UsersListView.as_view(), name="UsersListView"),
     path("crear_usuario/", UserCreateView.as_view(), name="UserCreateView"),
@@ -1,4 +1,5 @@
 from django.shortcuts import render
+from django.http import Http404
 from django.views.generic import ListView
 from app.core.models import RegistroAccion
 from django.contrib.auth.mixins import LoginRequiredMixin
@@ -11,9 +12,13 @@ from django.contrib.auth.models import User
 from django.views import View
 from django.views.generic import DetailView, ListView
 from django.views.generic.edit import UpdateView, DeleteView
-from .mixins import PaginationMixin, PermisoMixin
+from datetime import datetime, time, timedelta
+from django.utils.dateparse import parse_date
+from django.utils.timezone import make_aware
+from .mixins import PaginationMixin, PermisoMixin, KeysetPaginationMixin
 from app.dashuser.views import datos_centro
 from app.super.models import UserProfile
+from app.core.middleware.centro import perfil_o_404
 from app.super.forms import UserProfileForm
 
 
@@ -23,25 +28,57 @@ from app.super.forms import UserProfileForm
 ######################################################################################
 
 
-class RegistroAccionListView(PermisoMixin, PaginationMixin, LoginRequiredMixin, ListView):
+class RegistroAccionListView(PermisoMixin, KeysetPaginationMixin, LoginRequiredMixin, ListView):
     permiso_modulo = "RegistroAccion"
     model = RegistroAccion
     template_name = "core/registro_accion_list.html"
     context_object_name = "registros"
-    paginate_by = 10
+    keyset_por_pagina = 10
 
     def get_queryset(self):
         user = self.request.user
-        if hasattr(user, "userprofile") and user.userprofile.centro:
-            return RegistroAccion.objects.filter(
-                centro=user.userprofile.centro
-            ).order_by("-fecha")
-        return RegistroAccion.objects.none()
+        if not (hasattr(user, "userprofile") and user.userprofile.centro):
+            return RegistroAccion.objects.none()
+
+        queryset = RegistroAccion.objects.filter(centro=user.userprofile.centro).select_related("usuario")
+
+        # Filtros (cada uno apoyado en un índice que empieza por centro)
+        params = self.request.GET
+        if params.get("modelo"):
+            queryset = queryset.filter(modelo=params["modelo"])
+        if params.get("objeto_id", "").isdigit():
+            queryset = queryset.filter(objeto_id=int(params["objeto_id"]))
+        if params.get("usuario", "").isdigit():
+            queryset = queryset.filter(usuario_id=int(params["usuario"]))
+        if params.get("accion"):
+            queryset = queryset.filter(accion=params["accion"])
+        # Rango sobre la columna (no fecha__date) para que use el índice
+        desde, hasta = self._fecha("desde"), self._fecha("hasta")
+        if desde:
+            queryset = queryset.filter(fecha__gte=make_aware(datetime.combine(desde, time.min)))
+        if hasta:
+            queryset = queryset.filter(fecha__lt=make_aware(datetime.combine(hasta + timedelta(days=1), time.min)))
+        return queryset
+
+    def _fecha(self, parametro):
+        """Fecha AAAA-MM-DD del GET; None (sin filtro) si falta o no existe, p. ej. 2025-02-30."""
+        try:
+            return parse_date(self.request.GET.get(parametro, ""))
+        except ValueError:
+            return None
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         # añadimos el contexto con los datos del centro
         context.update(datos_centro(self.request))
+
+        from app.core.auditoria import REGISTRO
+        user = self.request.user
+        centro = user.userprofile.centro if hasattr(user, "userprofile") else None
+        context["modelos"] = sorted({modelo.__name__ for modelo in REGISTRO} | {"EtiquetaPlato"})
+        context["usuarios"] = UserProfile.objects.filter(centro=centro).order_by("nombre") if centro else []
+        context["acciones"] = ["crear", "modificar", "eliminar", "lote"]
+        context["filtro"] = self.request.GET
         return context
 
 
@@ -59,6 +96,32 @@ class RegistroAccionDetailView(PermisoMixin, LoginRequiredMixin, DetailView):
         if hasattr(user, "userprofile") and user.userprofile.centro:
             return RegistroAccion.objects.filter(centro=user.userprofile.centro)
         return RegistroAccion.objects.none()
+
+
+class EstadoObjetoView(PermisoMixin, LoginRequiredMixin, View):
+    """
+    Estado reconstruido de un objeto auditado tras una revisión. Devuelve un
+    fragmento que el panel de historial carga dentro de la ficha.
+    """
+    permiso_modulo = "RegistroAccion"
+    permiso_accion = "read"
+
+    def get(self, request, modelo, objeto_id, registro_id):
+        from app.core.historial import estado_en, lotes_del_modelo
+        centro = request.user.userprofile.centro
+        resultado = estado_en(centro, modelo, objeto_id, registro_id) if centro else None
+        if resultado is None:
+            raise Http404("Revisión no encontrada")
+
+        return render(request, "core/estado_objeto.html", {
+            "modelo": modelo,
+            "objeto_id": objeto_id,
+            "registro": resultado["registro"],
+            "estado": sorted(resultado["estado"].items()),
+            "eliminado": resultado["eliminado"],
+            "completo": resultado["completo"],
+            "lotes": lotes_del_modelo(centro, modelo, hasta=resultado["registro"].fecha).count(),
+        })
     
     
 ######################################################################################
@@ -73,7 +136,7 @@ class UsersListView(PermisoMixin, PaginationMixin, LoginRequiredMixin, ListView)
 
     def get_queryset(self):
         # Filtramos por el centro del usuario logueado
-        user_profile = get_object_or_404(UserProfile, user=self.request.user)
+        user_profile = perfil_o_404(self.request)
         if user_profile.centro:
             return UserProfile.objects.filter(centro=user_profile.centro)
         return UserProfile.objects.none()
@@ -93,7 +156,7 @@ class UserCreateView(PermisoMixin, LoginRequiredMixin, CreateView):
 
     def get_form(self, form_class=None):
         form = super().get_form(form_class)
-        creator_profile = get_object_or_404(UserProfile, user=self.request.user)
+        creator_profile = perfil_o_404(self.request)
 
         if creator_profile.centro:
             # Ocultar el campo centro y dejarlo solo de lectura
@@ -106,7 +169,7 @@ class UserCreateView(PermisoMixin, LoginRequiredMixin, CreateView):
         profile = form.save(commit=False)
 
         # Asignar centro automáticamente si el creador tiene uno
-        creator_profile = get_object_or_404(UserProfile, user=self.request.user)
+        creator_profile = perfil_o_404(self.request)
         if creator_profile.centro:
             profile.centro = creator_profile.centro
 
@@ -189,7 +252,7 @@ class UserDetailView(PermisoMixin, LoginRequiredMixin, DetailView):
 
     def get_queryset(self):
         # Filtramos solo por el centro del usuario logueado
-        user_profile = get_object_or_404(UserProfile, user=self.request.user)
+        user_profile = perfil_o_404(self.request)
         if user_profile.centro:
             return UserProfile.objects.filter(centro=user_profile.centro)
         return UserProfile.objects.none()   
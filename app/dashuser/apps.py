@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class AlimentosConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'app.dashuser'
+
+    def ready(self):
+        import app.dashuser.estadisticas  # contadores del dashboard
@@ -0,0 +1,151 @@
+from datetime import datetime, time, timedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count
+from django.db.models.signals import post_save, post_delete
+from django.utils import timezone
+from app.dashuser.models import Alimento
+from app.platos.models import Plato, Receta, AlimentoPlato, EtiquetaPlato
+
+
+# Estadísticas del dashboard por centro, en caché. Los totales y las raciones
+# de cada día son contadores que las señales de alta/baja suben y bajan; los
+# rankings se descartan cuando cambian platos o ingredientes. Lo que falte en
+# la caché se calcula al leer, y el TTL acota cualquier desajuste.
+
+DIAS_RACIONES = 7
+TOTALES = {
+    'total_platos': Plato,
+    'total_recetas': Receta,
+    'total_alimentos': Alimento,
+}
+
+
+def _timeout():
+    return getattr(settings, 'DASHBOARD_CACHE_TIMEOUT', 300)
+
+
+def _clave(centro_id, nombre):
+    return f'dashboard:{centro_id}:{nombre}'
+
+
+def _clave_raciones(centro_id, dia):
+    return _clave(centro_id, f'raciones:{dia.isoformat()}')
+
+
+def _rankings(centro):
+    platos = (
+        Plato.objects.filter(centro=centro)
+        .values('nombre')
+        .annotate(total=Count('id'))
+        .order_by('-total')[:5]
+    )
+    alimentos = (
+        Alimento.objects.filter(centro=centro)
+        .annotate(num_usos=Count('alimentoplato'))
+        .order_by('-num_usos')
+        .values('nombre', 'num_usos')[:5]
+    )
+    return {
+        'platos': [(p['nombre'], p['total']) for p in platos],
+        'alimentos': [(a['nombre'], a['num_usos']) for a in alimentos],
+    }
+
+
+def _raciones(centro, dias):
+    """Etiquetas por día (hora local) para los días pedidos, en una consulta."""
+    inicio = timezone.make_aware(datetime.combine(min(dias), time.min))
+    fin = timezone.make_aware(datetime.combine(max(dias) + timedelta(days=1), time.min))
+    por_dia = dict.fromkeys(dias, 0)
+    for fecha in EtiquetaPlato.objects.filter(centro=centro, fecha__gte=inicio, fecha__lt=fin).values_list('fecha', flat=True).iterator():
+        dia = timezone.localdate(fecha)
+        if dia in por_dia:
+            por_dia[dia] += 1
+    return por_dia
+
+
+def estadisticas_dashboard(centro):
+    """
+    Datos del dashboard del centro con una sola lectura de la caché
+    (get_many). Solo se consulta la BD para las piezas que falten.
+    """
+    hoy = timezone.localdate()
+    dias = [hoy - timedelta(days=n) for n in range(DIAS_RACIONES, -1, -1)]
+
+    claves = {nombre: _clave(centro.pk, nombre) for nombre in (*TOTALES, 'rankings')}
+    claves.update({dia: _clave_raciones(centro.pk, dia) for dia in dias})
+    en_cache = cache.get_many(list(claves.values()))
+
+    datos = {pieza: en_cache[clave] for pieza, clave in claves.items() if clave in en_cache}
+    nuevos = {}
+
+    for nombre, modelo in TOTALES.items():
+        if nombre not in datos:
+            datos[nombre] = nuevos[claves[nombre]] = modelo.objects.filter(centro=centro).count()
+    if 'rankings' not in datos:
+        datos['rankings'] = nuevos[claves['rankings']] = _rankings(centro)
+    faltan = [dia for dia in dias if dia not in datos]
+    if faltan:
+        for dia, total in _raciones(centro, faltan).items():
+            datos[dia] = nuevos[claves[dia]] = total
+
+    if nuevos:
+        cache.set_many(nuevos, _timeout())
+
+    return {
+        'stats': {nombre: datos[nombre] for nombre in TOTALES},
+        'platos': datos['rankings']['platos'],
+        'alimentos': datos['rankings']['alimentos'],
+        'raciones': [(dia, datos[dia]) for dia in dias if datos[dia]],
+    }
+
+
+######################################################################################
+#############################   ACTUALIZACIÓN POR SEÑALES   ##########################
+######################################################################################
+
+
+def _sumar(clave, delta):
+    try:
+        cache.incr(clave, delta)
+    except ValueError:
+        pass  # No está en caché: se calculará en la próxima lectura
+
+
+def _al_guardar(sender, instance, created, raw=False, **kwargs):
+    if raw or not created:
+        return
+    _actualizar(sender, instance, 1)
+
+
+def _al_borrar(sender, instance, **kwargs):
+    _actualizar(sender, instance, -1)
+
+
+def _actualizar(modelo, instance, delta):
+    # Las claves se calculan ya (la instancia puede cambiar después) y la
+    # caché se toca al confirmar: una escritura deshecha no mueve los totales
+    centro_id = instance.centro_id
+    sumas = [_clave(centro_id, nombre) for nombre, modelo_total in TOTALES.items() if modelo is modelo_total]
+    if modelo is EtiquetaPlato and instance.fecha:
+        sumas.append(_clave_raciones(centro_id, timezone.localdate(instance.fecha)))
+    rankings = modelo in (Plato, AlimentoPlato, Alimento)
+
+    def aplicar():
+        for clave in sumas:
+            _sumar(clave, delta)
+        if rankings:
+            cache.delete(_clave(centro_id, 'rankings'))
+
+    transaction.on_commit(aplicar)
+
+
+for _modelo in (Plato, Receta, Alimento, AlimentoPlato, EtiquetaPlato):
+    post_save.connect(_al_guardar, sender=_modelo, dispatch_uid=f'dashboard_save_{_modelo._meta.label_lower}')
+    post_delete.connect(_al_borrar, sender=_modelo, dispatch_uid=f'dashboard_delete_{_modelo._meta.label_lower}')
+
+
+def invalidar_dashboard(centro_id):
+    """Descarta totales y rankings del centro tras escrituras sin señales (importaciones en bloque)."""
+    cache.delete_many([_clave(centro_id, nombre) for nombre in (*TOTALES, 'rankings')])
@@ -1,8 +1,11 @@
 from django.db import models
+from django.db.models import F, Sum, Value, Case, When, Subquery, OuterRef
+from django.db.models.functions import Coalesce
 from django.utils import timezone
 from django.core.validators import RegexValidator
-from app.super.models import ModeloBaseCentro
+from app.super.models import ModeloBaseCentro, CentroScopedQuerySet
 from django.db import transaction
+from decimal import Decimal
 
 
 
@@ -87,6 +90,61 @@ class Localizacion  (ModeloBaseCentro):
     
 
 gtin_validator = RegexValidator(r'^\d{8,14}$', 'El GTIN debe tener entre 8 y 14 dígitos.')
+
+# Estados de pedido cuyas líneas aún reservan stock
+ESTADOS_PEDIDO_PENDIENTE = ['pendiente', 'encamino', 'parcial']
+
+
+class StockQuerySet(CentroScopedQuerySet):
+    """
+    Stock reservado, disponible y aviso de reposición calculados en la misma
+    consulta del listado, para Alimento y Utensilio (cada uno es una FK de
+    PedidoDetalle con su propio nombre).
+    """
+
+    def _lineas_pendientes(self, centro=None):
+        from app.pedidos.models import PedidoDetalle
+
+        campo = self.model._meta.model_name   # 'alimento' o 'utensilio'
+        lineas = PedidoDetalle.objects.filter(
+            **{campo: OuterRef('pk')},
+            pedido__estado__in=ESTADOS_PEDIDO_PENDIENTE,
+            cantidad__gt=F('cantidad_recibida'),
+        )
+        if centro:
+            lineas = lineas.filter(pedido__centro=centro)
+        return campo, lineas
+
+    def con_stock(self, centro=None):
+        """
+        Anota reservado, disponible, bajo_minimo y el último pedido pendiente
+        (pedido_pendiente_id, pedido_reciente_estado) con subconsultas
+        correlacionadas, sin cargar ni recorrer las líneas en Python.
+        """
+        campo, lineas = self._lineas_pendientes(centro)
+        decimal = models.DecimalField(max_digits=12, decimal_places=2)
+
+        reservado = (
+            lineas.order_by()
+            .values(campo)
+            .annotate(total=Sum(F('cantidad') - F('cantidad_recibida')))
+            .values('total')
+        )
+        ultimo = lineas.order_by('-pedido__fecha_pedido', '-pedido_id')
+
+        return self.annotate(
+            reservado=Coalesce(Subquery(reservado, output_field=decimal), Value(Decimal('0')), output_field=decimal),
+            pedido_pendiente_id=Subquery(ultimo.values('pedido_id')[:1]),
+            pedido_reciente_estado=Subquery(ultimo.values('pedido__estado')[:1]),
+        ).annotate(
+            disponible=Coalesce(F('stock_actual'), Value(Decimal('0')), output_field=decimal) - F('reservado'),
+        ).annotate(
+            bajo_minimo=Case(
+                When(disponible__lt=F('stock_minimo'), then=Value(True)),
+                default=Value(False),
+                output_field=models.BooleanField(),
+            ),
+        )
     
 class Alimento(ModeloBaseCentro):
     nombre = models.CharField(max_length=100, unique=True)
@@ -108,6 +166,8 @@ class Alimento(ModeloBaseCentro):
     stock_util = models.DecimalField(max_digits=10, decimal_places=2, default=0, blank=True, null=True)
     stock_minimo = models.DecimalField(max_digits=10, decimal_places=2, default=0, blank=True, null=True)
 
+    objects = StockQuerySet.as_manager()
+
     class Meta:
         ordering = ['nombre']
         verbose_name = "Alimento"
@@ -127,28 +187,26 @@ class Alimento(ModeloBaseCentro):
         """
         Calcula el stock reservado en pedidos no completados
         centro: Opcional, filtra por centro específico
+        Si la instancia viene de Alimento.objects.con_stock() usa la anotación.
         """
-        from pedidos.models import PedidoDetalle
-        
-        filtros = {
-            'alimento': self,
-            'pedido__estado__in': ['pendiente', 'enviado', 'parcial'],
-            'cantidad__gt': models.F('cantidad_recibida')
-        }
-        
-        if centro:
-            filtros['pedido__centro'] = centro
-            
-        detalles = PedidoDetalle.objects.filter(**filtros)
-        return sum(d.cantidad - d.cantidad_recibida for d in detalles)
+        if hasattr(self, 'reservado'):
+            return self.reservado
+        total = self.get_pedidos_pendientes(centro).aggregate(
+            total=Sum(F('cantidad') - F('cantidad_recibida'))
+        )['total']
+        return total or Decimal('0')
     
     def stock_disponible(self, centro=None):
         """Stock actual menos reservado (puede filtrar por centro)"""
-        return self.stock_actual - self.stock_reservado(centro)
+        if hasattr(self, 'disponible'):
+            return self.disponible
+        return (self.stock_actual or 0) - self.stock_reservado(centro)
     
     def necesita_reposicion(self, centro=None):
         """Indica si el stock disponible está por debajo del mínimo"""
-        return self.stock_disponible(centro) < self.stock_minimo
+        if hasattr(self, 'bajo_minimo'):
+            return self.bajo_minimo
+        return self.stock_disponible(centro) < (self.stock_minimo or 0)
     
     def actualizar_stock(self, cantidad):
         """
@@ -175,11 +233,11 @@ class Alimento(ModeloBaseCentro):
         Devuelve los pedidos no completados para este alimento
         centro: Opcional, filtra por centro específico
         """
-        from pedidos.models import PedidoDetalle
+        from app.pedidos.models import PedidoDetalle
         
         filtros = {
             'alimento': self,
-            'pedido__estado__in': ['pendiente', 'enviado', 'parcial'],
+            'pedido__estado__in': ESTADOS_PEDIDO_PENDIENTE,
             'cantidad__gt': models.F('cantidad_recibida')
         }
         
@@ -233,6 +291,8 @@ class Utensilio(ModeloBaseCentro):
     precio = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True)
     stock_actual = models.DecimalField(max_digits=10, decimal_places=2, default=0, blank=True)  # Stock disponible
     stock_minimo = models.DecimalField(max_digits=10, decimal_places=2, default=0)  # Stock mínimo para alerta
+
+    objects = StockQuerySet.as_manager()
     
     class Meta:
         ordering = ['nombre']
@@ -245,13 +305,28 @@ class Utensilio(ModeloBaseCentro):
     def stock_actual_format(self):
         return int(self.stock_actual) if self.stock_actual % 1 == 0 else self.stock_actual
 
+    def stock_reservado(self, centro=None):
+        """
+        Calcula el stock reservado en pedidos no completados
+        Si la instancia viene de Utensilio.objects.con_stock() usa la anotación.
+        """
+        if hasattr(self, 'reservado'):
+            return self.reservado
+        total = self.get_pedidos_pendientes(centro).aggregate(
+            total=Sum(F('cantidad') - F('cantidad_recibida'))
+        )['total']
+        return total or Decimal('0')
     
     def stock_disponible(self, centro=None):
         """Stock actual menos reservado (puede filtrar por centro)"""
+        if hasattr(self, 'disponible'):
+            return self.disponible
         return self.stock_actual - self.stock_reservado(centro)
     
     def necesita_reposicion(self, centro=None):
         """Indica si el stock disponible está por debajo del mínimo"""
+        if hasattr(self, 'bajo_minimo'):
+            return self.bajo_minimo
         return self.stock_disponible(centro) < self.stock_minimo
     
     def actualizar_stock(self, cantidad):
@@ -267,11 +342,11 @@ class Utensilio(ModeloBaseCentro):
         Devuelve los pedidos no completados para este utensilio
         centro: Opcional, filtra por centro específico
         """
-        from pedidos.models import PedidoDetalle
+        from app.pedidos.models import PedidoDetalle
         
         filtros = {
             'utensilio': self,
-            'pedido__estado__in': ['pendiente', 'enviado', 'parcial'],
+            'pedido__estado__in': ESTADOS_PEDIDO_PENDIENTE,
             'cantidad__gt': models.F('cantidad_recibida')
         }
         
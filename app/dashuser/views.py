@@ -13,12 +13,14 @@ from django.utils.timezone import localtime, now, timedelta
 from django.core.exceptions import ObjectDoesNotExist
 from app.core.mixins import PaginationMixin, PermisoMixin
 from app.super.views import MODULOS, ACCIONES
-from app.super.permissions import tiene_permiso
+from app.super.permissions import permisos_request, matriz_permisos
 from django.db.models import Count
 from app.platos.models import Plato, Receta, EtiquetaPlato
 from app.super.models import UserProfile
+from app.core.middleware.centro import perfil_o_404, perfil_de_request
 from django.contrib.auth.mixins import LoginRequiredMixin
 from app.pedidos.models import PedidoDetalle
+from app.pedidos.alertas import programar_evaluacion
 from app.recepcion.models import Recepcion
 from .models import Alergenos, TipoAlimento, Alimento, Localizacion, Conservacion, InformacionNutricional, UnidadDeMedida, Trazas, EtiquetaAlimento, Utensilio
 from .forms import AlergenosForm, TipoAlimento, LocalizacionForm, TipoAlimentosForm, ConservacionForm, InformacionNutricionalForm, AlimentoForm, UnidadDeMedidaForm, TrazasForm, EtiquetaAlimentoForm, UtensilioForm
@@ -37,10 +39,9 @@ def datos_centro(request):
     if not request.user.is_authenticated:
         return context
 
-    # Datos del usuario
-    try:
-        user_profile = UserProfile.objects.get(user=request.user)
-    except UserProfile.DoesNotExist:
+    # Datos del usuario (perfil y permisos se resuelven una vez por petición)
+    user_profile, _ = permisos_request(request)
+    if user_profile is None:
         return context
 
     hora_actual = localtime().hour
@@ -56,14 +57,11 @@ def datos_centro(request):
     imagen_centro_url = user_profile.centro.imagen.url if user_profile.centro and user_profile.centro.imagen else None
 
     # Construimos los permisos
-    permisos_dict = {}
-    for modulo in MODULOS:
-        permisos_dict[modulo] = {}
-        for accion in ACCIONES:
-            permisos_dict[modulo][accion] = tiene_permiso(user_profile, modulo, accion)
+    permisos_dict = matriz_permisos(user_profile, MODULOS, ACCIONES)
 
     context.update({
         'user_profile': user_profile,
+        'centro_actual': user_profile.centro,
         'nombre': user_profile.nombre,
         'apellidos': user_profile.apellidos,
         'cargo': user_profile.cargo,
@@ -85,47 +83,24 @@ class DashboardView(LoginRequiredMixin, TemplateView):
         centro = user_profile.centro
         context.update(datos_centro(self.request))
 
-        # 📊 Platos más creados
-        platos_mas_creados = (
-            Plato.objects.filter(centro=centro)
-            .values("nombre")
-            .annotate(total=Count("id"))
-            .order_by("-total")[:5]
-        )
-
-        # 📊 Alimentos más usados en recetas
-        alimentos_mas_usados = (
-            Alimento.objects.filter(centro=centro)
-            .annotate(num_usos=Count("alimentoplato"))
-            .order_by("-num_usos")[:5]
-        )
-
-        # 📊 Raciones últimos 7 días (por etiquetas)
-        ultimos_dias = now().date() - timedelta(days=7)
-        raciones = (
-            EtiquetaPlato.objects
-            .filter(plato__centro=centro, fecha__date__gte=ultimos_dias)
-            .values("fecha__date")
-            .annotate(total=Count("id"))
-            .order_by("fecha__date")
-        )
+        # 📊 Estadísticas del centro (caché por centro, ver app.dashuser.estadisticas)
+        from app.dashuser.estadisticas import estadisticas_dashboard
+        estadisticas = estadisticas_dashboard(centro) if centro else {
+            "stats": {}, "platos": [], "alimentos": [], "raciones": [],
+        }
 
         # 📊 Totales
-        context["stats"] = {
-            "total_platos": Plato.objects.filter(centro=centro).count(),
-            "total_recetas": Receta.objects.filter(centro=centro).count(),
-            "total_alimentos": Alimento.objects.filter(centro=centro).count(),
-        }
+        context["stats"] = estadisticas["stats"]
 
         # Preparar datos para Chart.js
-        context["platos_labels"] = [p["nombre"] for p in platos_mas_creados]
-        context["platos_values"] = [p["total"] for p in platos_mas_creados]
+        context["platos_labels"] = [nombre for nombre, _ in estadisticas["platos"]]
+        context["platos_values"] = [total for _, total in estadisticas["platos"]]
 
-        context["alimentos_labels"] = [a.nombre for a in alimentos_mas_usados]
-        context["alimentos_values"] = [a.num_usos for a in alimentos_mas_usados]
+        context["alimentos_labels"] = [nombre for nombre, _ in estadisticas["alimentos"]]
+        context["alimentos_values"] = [usos for _, usos in estadisticas["alimentos"]]
 
-        context["raciones_labels"] = [r["fecha__date"].strftime("%Y-%m-%d") for r in raciones]
-        context["raciones_values"] = [r["total"] for r in raciones]
+        context["raciones_labels"] = [dia.strftime("%Y-%m-%d") for dia, _ in estadisticas["raciones"]]
+        context["raciones_values"] = [total for _, total in estadisticas["raciones"]]
 
         return context
     
@@ -143,7 +118,7 @@ class AlergenosList(PermisoMixin, PaginationMixin, LoginRequiredMixin, ListView)
 
     def get_queryset(self):
         try:
-            user_profile = UserProfile.objects.filter(user=self.request.user).first()
+            user_profile = perfil_de_request(self.request)
             if user_profile and user_profile.centro:
                 centro = user_profile.centro
                 queryset = Alergenos.objects.filter(centro=centro).order_by('id')
@@ -180,7 +155,7 @@ class AlergenosCreate(PermisoMixin, LoginRequiredMixin, CreateView):
     success_url = reverse_lazy('dashuser:AlergenosList')
 
     def form_valid(self, form):
-        user_profile = get_object_or_404(UserProfile, user=self.request.user)
+        user_profile = perfil_o_404(self.request)
         if user_profile.centro:
             form.instance.centro = user_profile.centro
             messages.success(self.request, 'Alérgeno creado correctamente.')
@@ -204,7 +179,7 @@ class AlergenosUpdate(PermisoMixin, LoginRequiredMixin, UpdateView):
     context_object_name = 'alergeno'
 
     def get_queryset(self):
-        user_profile = get_object_or_404(UserProfile, user=self.request.user)
+        user_profile = perfil_o_404(self.request)
         if user_profile.centro:
             return Alergenos.objects.filter(centro_id=user_profile.centro_id)
         else:
@@ -230,11 +205,7 @@ class AlergenosDelete(PermisoMixin, LoginRequiredMixin, DeleteView):
     context_object_name = 'alergeno'
 
     def get_queryset(self):
-        user_profile = get_object_or_404(UserProfile, user=self.request.user)
-        if user_profile.centro:
-            return Alergenos.objects.filter(centro=user_profile.centro)
-        else:
-            return Alergenos.objects.none()
+        return Alergenos.objects.for_request(self.request)
 
     def post(self, request, *args, **kwargs):
         obj = self.get_object()
@@ -257,7 +228,7 @@ class TrazasList(PermisoMixin, PaginationMixin, LoginRequiredMixin, ListView):
 
     def get_queryset(self):
         try:
-            user_profile = UserProfile.objects.filter(user=self.request.user).first()
+            user_profile = perfil_de_request(self.request)
             if user_profile and user_profile.centro:
                 centro = user_profile.centro
                 queryset = Trazas.objects.filter(centro=centro).order_by('id')
@@ -293,7 +264,7 @@ class TrazasCreate(PermisoMixin, LoginRequiredMixin, CreateView):
     success_url = reverse_lazy('dashuser:TrazasList')
 
     def form_valid(self, form):
-        user_profile = get_object_or_404(UserProfile, user=self.request.user)
+        user_profile = perfil_o_404(self.request)
         if user_profile.centro:
             form.instance.centro = user_profile.centro
             messages.success(self.request, 'Traza creada correctamente.')
@@ -319,7 +290,7 @@ class TrazasUpdate(PermisoMixin, LoginRequiredMixin, UpdateView):
     context_object_name = 'traza'
 
     def get_queryset(self):
-        user_profile = get_object_or_404(UserProfile, user=self.request.user)
+        user_profile = perfil_o_404(self.request)
         if user_profile.centro:
             return Trazas.objects.filter(centro_id=user_profile.centro_id)
         else:
@@ -345,11 +316,7 @@ class TrazasDelete(PermisoMixin, LoginRequiredMixin, DeleteView):
     context_object_name = 'traza'
 
     def get_queryset(self):
-        user_profile = get_object_or_404(UserProfile, user=self.request.user)
-        if user_profile.centro:
-            return Trazas.objects.filter(centro=user_profile.centro)
-        else:
-            return Trazas.objects.none()
+        return Trazas.objects.for_request(self.request)
 
     def post(self, request, *args, **kwargs):
         obj = self.get_object()
@@ -373,7 +340,7 @@ class UnidadDeMedidaList(PermisoMixin, PaginationMixin, LoginRequiredMixin, List
 
     def get_queryset(self):
         try:
-            user_profile = UserProfile.objects.filter(user=self.request.user).first()
+            user_profile = perfil_de_request(self.request)
             if user_profile and user_profile.centro:
                 centro = user_profile.centro
                 queryset = UnidadDeMedida.objects.filter(centro=centro).order_by('id')
@@ -410,7 +377,7 @@ class UnidadDeMedidaCreate(PermisoMixin, LoginRequiredMixin, CreateView):
     success_url = reverse_lazy('dashuser:UnidadDeMedidaList')
 
     def form_valid(self, form):
-        user_profile = get_object_or_404(UserProfile, user=self.request.user)
+        user_profile = perfil_o_404(self.request)
         if user_profile.centro:
             form.instance.centro = user_profile.centro
             messages.success(self.request, 'Unidad de medida creada correctamente.')
@@ -435,7 +402,7 @@ class UnidadDeMedidaUpdate(PermisoMixin, LoginRequiredMixin, UpdateView):
     context_object_name = 'unidaddemedida'
 
     def get_queryset(self):
-        user_profile = get_object_or_404(UserProfile, user=self.request.user)
+        user_profile = perfil_o_404(self.request)
         if user_profile.centro:
             return UnidadDeMedida.objects.filter(centro_id=user_profile.centro_id)
         else:
@@ -461,11 +428,7 @@ class UnidadDeMedidaDelete(PermisoMixin, LoginRequiredMixin, DeleteView):
     context_object_name = 'unidaddemedida'
 
     def get_queryset(self):
-        user_profile = get_object_or_404(UserProfile, user=self.request.user)
-        if user_profile.centro:
-            return UnidadDeMedida.objects.filter(centro=user_profile.centro)
-        else:
-            return UnidadDeMedida.objects.none()
+        return UnidadDeMedida.objects.for_request(self.request)
 
     def post(self, request, *args, **kwargs):
         obj = self.get_object()
@@ -489,7 +452,7 @@ class TipoAlimentoList(PermisoMixin, PaginationMixin, LoginRequiredMixin, ListVi
 
     def get_queryset(self):
         try:
-            user_profile = UserProfile.objects.filter(user=self.request.user).first()
+            user_profile = perfil_de_request(self.request)
             if user_profile and user_profile.centro:
                 centro = user_profile.centro
                 queryset = TipoAlimento.objects.filter(centro=centro).order_by('id')
@@ -525,7 +488,7 @@ class TipoAlimentoCreate(PermisoMixin, LoginRequiredMixin, CreateView):
     success_url = reverse_lazy('dashuser:TipoAlimentoList')
 
     def form_valid(self, form):
-        user_profile = get_object_or_404(UserProfile, user=self.request.user)
+        user_profile = perfil_o_404(self.request)
         if user_profile.centro:
             form.instance.centro = user_profile.centro
             messages.success(self.request, 'Tipo de alimento creado correctamente.')
@@ -551,7 +514,7 @@ class TipoAlimentoUpdate(PermisoMixin, LoginRequiredMixin, UpdateView):
     context_object_name = 'tipoalimento'
 
     def get_queryset(self):
-        user_profile = get_object_or_404(UserProfile, user=self.request.user)
+        user_profile = perfil_o_404(self.request)
         if user_profile.centro:
             return TipoAlimento.objects.filter(centro_id=user_profile.centro_id)
         else:
@@ -576,11 +539,7 @@ class TipoAlimentoDelete(PermisoMixin, LoginRequiredMixin, DeleteView):
     context_object_name = 'tipoalimento'
 
     def get_queryset(self):
-        user_profile = get_object_or_404(UserProfile, user=self.request.user)
-        if user_profile.centro:
-            return TipoAlimento.objects.filter(centro=user_profile.centro)
-        else:
-            return TipoAlimento.objects.none()
+        return TipoAlimento.objects.for_request(self.request)
 
     def post(self, request, *args, **kwargs):
         obj = self.get_object()
@@ -603,7 +562,7 @@ class LocalizacionList(PermisoMixin, PaginationMixin, LoginRequiredMixin, ListVi
 
     def get_queryset(self):
         try:
-            user_profile = UserProfile.objects.filter(user=self.request.user).first()
+            user_profile = perfil_de_request(self.request)
             if user_profile and user_profile.centro:
                 centro = user_profile.centro
                 queryset = Localizacion.objects.filter(centro=centro).order_by('id')
@@ -639,7 +598,7 @@ class LocalizacionCreate(PermisoMixin, LoginRequiredMixin, CreateView):
     success_url = reverse_lazy('dashuser:LocalizacionList')
 
     def form_valid(self, form):
-        user_profile = get_object_or_404(UserProfile, user=self.request.user)
+        user_profile = perfil_o_404(self.request)
         if user_profile.centro:
             form.instance.centro = user_profile.centro
             messages.success(self.request, 'Localización creada correctamente.')
@@ -665,7 +624,7 @@ class LocalizacionUpdate(PermisoMixin, LoginRequiredMixin, UpdateView):
     context_object_name = 'localizacion'
 
     def get_queryset(self):
-        user_profile = get_object_or_404(UserProfile, user=self.request.user)
+        user_profile = perfil_o_404(self.request)
         if user_profile.centro:
             return Localizacion.objects.filter(centro_id=user_profile.centro_id)
         else:
@@ -691,11 +650,7 @@ class LocalizacionDelete(PermisoMixin, LoginRequiredMixin, DeleteView):
     context_object_name = 'localizacion'
 
     def get_queryset(self):
-        user_profile = get_object_or_404(UserProfile, user=self.request.user)
-        if user_profile.centro:
-            return Localizacion.objects.filter(centro=user_profile.centro)
-        else:
-            return Localizacion.objects.none()
+        return Localizacion.objects.for_request(self.request)
 
     def post(self, request, *args, **kwargs):
         obj = self.get_object()
@@ -719,7 +674,7 @@ class ConservacionList(PermisoMixin, PaginationMixin, LoginRequiredMixin, ListVi
 
     def get_queryset(self):
         try:
-            user_profile = UserProfile.objects.filter(user=self.request.user).first()
+            user_profile = perfil_de_request(self.request)
             if user_profile and user_profile.centro:
                 centro = user_profile.centro
                 queryset = Conservacion.objects.filter(centro=centro).order_by('id')
@@ -755,7 +710,7 @@ class ConservacionCreate(PermisoMixin, LoginRequiredMixin, CreateView):
     success_url = reverse_lazy('dashuser:ConservacionList')
 
     def form_valid(self, form):
-        user_profile = get_object_or_404(UserProfile, user=self.request.user)
+        user_profile = perfil_o_404(self.request)
         if user_profile.centro:
             form.instance.centro = user_profile.centro
             messages.success(self.request, 'Conservación creada correctamente.')
@@ -781,7 +736,7 @@ class ConservacionUpdate(PermisoMixin, LoginRequiredMixin, UpdateView):
     context_object_name = 'conservacion'
 
     def get_queryset(self):
-        user_profile = get_object_or_404(UserProfile, user=self.request.user)
+        user_profile = perfil_o_404(self.request)
         if user_profile.centro:
             return Conservacion.objects.filter(centro_id=user_profile.centro_id)
         else:
@@ -807,11 +762,7 @@ class ConservacionDelete(PermisoMixin, LoginRequiredMixin, DeleteView):
     context_object_name = 'conservacion'
 
     def get_queryset(self):
-        user_profile = get_object_or_404(UserProfile, user=self.request.user)
-        if user_profile.centro:
-            return Conservacion.objects.filter(centro=user_profile.centro)
-        else:
-            return Conservacion.objects.none()
+        return Conservacion.objects.for_request(self.request)
 
     def post(self, request, *args, **kwargs):
         obj = self.get_object()
@@ -833,10 +784,10 @@ class AlimentoList(PermisoMixin, PaginationMixin, LoginRequiredMixin, ListView):
 
     def get_queryset(self):
         try:
-            user_profile = UserProfile.objects.filter(user=self.request.user).first()
+            user_profile = perfil_de_request(self.request)
             if user_profile and user_profile.centro:
                 centro = user_profile.centro
-                queryset = Alimento.objects.filter(centro=centro).order_by('nombre')
+                queryset = Alimento.objects.filter(centro=centro).con_stock(centro).select_related('tipo_alimento').order_by('nombre')
 
 
                 search_query = self.request.GET.get('buscar')
@@ -910,6 +861,8 @@ class AlimentoDetailView(PaginationMixin, LoginRequiredMixin, DetailView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context.update(datos_centro(self.request))  
+        from app.core.historial import historial_para
+        context['historial'] = historial_para(self.request, self.object)
         return context
     
     
@@ -960,6 +913,7 @@ class AlimentoUpdate(PaginationMixin, LoginRequiredMixin, View):
             alimento.save()
 
             alimento_form.save_m2m()  # ✅ guarda alérgenos y trazas
+            programar_evaluacion([alimento.pk])  # puede haber cambiado el stock mínimo
 
             nutricion = nutricion_form.save(commit=False)
             nutricion.alimento = alimento
@@ -1059,10 +1013,10 @@ class UtensilioList(PermisoMixin, PaginationMixin, LoginRequiredMixin, ListView)
 
     def get_queryset(self):
         try:
-            user_profile = UserProfile.objects.filter(user=self.request.user).first()
+            user_profile = perfil_de_request(self.request)
             if user_profile and user_profile.centro:
                 centro = user_profile.centro
-                queryset = Utensilio.objects.filter(centro=centro).order_by('id')
+                queryset = Utensilio.objects.filter(centro=centro).con_stock(centro).order_by('id')
 
                 search_query = self.request.GET.get('buscar')
                 ordering = self.request.GET.get('ordenar') 
@@ -1074,7 +1028,7 @@ class UtensilioList(PermisoMixin, PaginationMixin, LoginRequiredMixin, ListView)
                 if ordering == 'nombre':
                     queryset = queryset.order_by('nombre')
                 elif ordering == 'stock_bajo':
-                    queryset = queryset.filter(stock_actual__lt=F('stock_minimo')).order_by('stock_actual')
+                    queryset = queryset.filter(bajo_minimo=True).order_by('disponible')
 
                 return queryset
             else:
@@ -1115,7 +1069,7 @@ class UtensilioCreate(PermisoMixin, LoginRequiredMixin, CreateView):
     success_url = reverse_lazy('dashuser:UtensilioList')
 
     def form_valid(self, form):
-        user_profile = get_object_or_404(UserProfile, user=self.request.user)
+        user_profile = perfil_o_404(self.request)
         if user_profile.centro:
             form.instance.centro = user_profile.centro
             messages.success(self.request, 'Utensilio creado correctamente.')
@@ -1141,7 +1095,7 @@ class UtensilioUpdate(PermisoMixin, LoginRequiredMixin, UpdateView):
     context_object_name = 'utensilio'
 
     def get_queryset(self):
-        user_profile = get_object_or_404(UserProfile, user=self.request.user)
+        user_profile = perfil_o_404(self.request)
         if user_profile.centro:
             return Utensilio.objects.filter(centro_id=user_profile.centro_id)
         else:
@@ -1168,11 +1122,7 @@ class UtensilioDelete(PermisoMixin, LoginRequiredMixin, DeleteView):
     context_object_name = 'utensilio'
 
     def get_queryset(self):
-        user_profile = get_object_or_404(UserProfile, user=self.request.user)
-        if user_profile.centro:
-            return Utensilio.objects.filter(centro=user_profile.centro)
-        else:
-            return Utensilio.objects.none()
+        return Utensilio.objects.for_request(self.request)
 
     def post(self, request, *args, **kwargs):
         obj = self.get_object()
@@ -0,0 +1,138 @@
+import math
+from collections import defaultdict
+from decimal import Decimal
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
+from app.dashuser.models import Alimento
+from app.recepcion.models import Recepcion
+from .models import AlertaReposicion, Pedido, PedidoDetalle
+
+
+CENTIMO = Decimal('0.01')
+
+
+######################################################################################
+###########################   EVALUACIÓN DE ALERTAS   ################################
+######################################################################################
+
+
+def evaluar_alimentos(alimento_ids):
+    """
+    Recalcula las alertas de reposición solo de los alimentos indicados.
+    Una consulta para el stock (con_stock), un borrado de las alertas que ya
+    no proceden y un upsert de las que siguen o aparecen.
+    """
+    ids = {i for i in alimento_ids if i}
+    if not ids:
+        return
+
+    alertas = []
+    for alimento in Alimento.objects.filter(pk__in=ids).con_stock().values(
+        'pk', 'centro_id', 'disponible', 'stock_minimo', 'bajo_minimo'
+    ):
+        if alimento['bajo_minimo']:
+            alertas.append(AlertaReposicion(
+                centro_id=alimento['centro_id'],
+                alimento_id=alimento['pk'],
+                stock_disponible=alimento['disponible'],
+                stock_minimo=alimento['stock_minimo'],
+                cantidad_sugerida=alimento['stock_minimo'] - alimento['disponible'],
+            ))
+
+    with transaction.atomic():
+        (AlertaReposicion.objects
+            .filter(alimento_id__in=ids)
+            .exclude(alimento_id__in=[a.alimento_id for a in alertas])
+            .delete())
+        AlertaReposicion.objects.bulk_create(
+            alertas,
+            update_conflicts=True,
+            unique_fields=['alimento'],
+            update_fields=['stock_disponible', 'stock_minimo', 'cantidad_sugerida', 'actualizada'],
+        )
+
+
+def programar_evaluacion(alimento_ids):
+    """
+    Reevalúa los alimentos al confirmar la transacción en curso (o en el acto
+    si no hay ninguna), para no hacerlo por cada movimiento de un mismo lote.
+    """
+    ids = {i for i in alimento_ids if i}
+    if ids:
+        transaction.on_commit(lambda: evaluar_alimentos(ids))
+
+
+######################################################################################
+#########################   PEDIDOS SUGERIDOS (BORRADOR)   ###########################
+######################################################################################
+
+
+def _cantidad_en_unidad_compra(alimento, cantidad_uso):
+    """Pasa la cantidad sugerida (unidad de uso) a la unidad en que se compra."""
+    if alimento.unidad_compra_id != alimento.unidad_uso_id and alimento.peso_unitario:
+        return Decimal(math.ceil(cantidad_uso / alimento.peso_unitario))
+    return cantidad_uso.quantize(CENTIMO)
+
+
+def crear_pedidos_borrador(centro, cantidades, usuario=None, observaciones=''):
+    """
+    Crea un pedido en borrador por proveedor para las cantidades indicadas
+    ({alimento_id: cantidad en unidad de uso}), tomando proveedor y precio de
+    la última recepción de cada alimento. Los alimentos que ya están en otro
+    borrador o que nunca se han recibido se omiten. Devuelve (pedidos, omitidos).
+    """
+    ultima = Recepcion.objects.filter(alimento=OuterRef('pk')).order_by('-fecha_recepcion', '-id')
+    en_borrador = PedidoDetalle.objects.filter(
+        pedido__centro=centro, pedido__estado='borrador', alimento__isnull=False
+    ).values('alimento_id')
+
+    alimentos = (
+        Alimento.objects
+        .filter(centro=centro, pk__in=[pk for pk, cantidad in cantidades.items() if cantidad > 0])
+        .exclude(pk__in=en_borrador)
+        .annotate(
+            ultimo_proveedor_id=Subquery(ultima.values('proveedor_id')[:1]),
+            ultimo_precio=Subquery(ultima.values('precio_compra')[:1]),
+        )
+    )
+
+    por_proveedor = defaultdict(list)
+    omitidos = []
+    for alimento in alimentos:
+        if alimento.ultimo_proveedor_id is None:
+            omitidos.append(alimento)
+        else:
+            por_proveedor[alimento.ultimo_proveedor_id].append(alimento)
+
+    pedidos, lineas = [], []
+    with transaction.atomic():
+        for proveedor_id, alimentos_proveedor in por_proveedor.items():
+            pedido = Pedido.objects.create(
+                centro=centro,
+                proveedor_id=proveedor_id,
+                estado='borrador',
+                creado_por=usuario,
+                observaciones=observaciones,
+            )
+            pedidos.append(pedido)
+            for alimento in alimentos_proveedor:
+                lineas.append(PedidoDetalle(
+                    pedido=pedido,
+                    alimento=alimento,
+                    cantidad=_cantidad_en_unidad_compra(alimento, Decimal(cantidades[alimento.pk])),
+                    unidad_id=alimento.unidad_compra_id,
+                    precio_unitario=alimento.ultimo_precio or 0,
+                ))
+        PedidoDetalle.objects.bulk_create(lineas)
+
+    return pedidos, omitidos
+
+
+def generar_pedidos_sugeridos(centro, usuario=None):
+    """Borradores por proveedor con lo que falta para cubrir las alertas."""
+    cantidades = dict(
+        AlertaReposicion.objects.filter(centro=centro).values_list('alimento_id', 'cantidad_sugerida')
+    )
+    return crear_pedidos_borrador(
+        centro, cantidades, usuario, observaciones='Generado desde las alertas de reposición.'
+    )
@@ -0,0 +1,132 @@
+import csv
+from decimal import Decimal
+from tempfile import TemporaryFile
+import openpyxl
+from django.db.models import F, DecimalField, ExpressionWrapper
+from django.db.models.functions import Coalesce
+from .models import PedidoDetalle
+
+
+CABECERA = [
+    'Pedido', 'Fecha pedido', 'Fecha entrega', 'Estado', 'Proveedor',
+    'Producto', 'Cantidad', 'Recibido', 'Unidad', 'Precio unitario', 'Total línea',
+]
+
+AGRUPACIONES = {
+    '': 'Sin agrupar',
+    'proveedor': 'Por proveedor',
+    'mes': 'Por mes',
+    'proveedor_mes': 'Por proveedor y mes',
+}
+
+# Orden de la consulta según la agrupación: las filas de un mismo grupo
+# llegan seguidas y los subtotales se emiten sin guardar nada en memoria.
+ORDEN = {
+    '': ('pedido__fecha_pedido', 'pedido_id', 'id'),
+    'proveedor': ('pedido__proveedor__nombre', 'pedido__fecha_pedido', 'pedido_id', 'id'),
+    'mes': ('pedido__fecha_pedido', 'pedido_id', 'id'),
+    'proveedor_mes': ('pedido__proveedor__nombre', 'pedido__fecha_pedido', 'pedido_id', 'id'),
+}
+
+TAMANO_BLOQUE = 2000
+
+
+def lineas_exportacion(centro, desde=None, hasta=None, proveedor=None, estado=None, agrupar=''):
+    """
+    Líneas de pedido del centro como tuplas, con el total de línea calculado
+    en la BD. Se recorren con iterator() para no cargar el resultado entero.
+    """
+    lineas = PedidoDetalle.objects.filter(pedido__centro=centro)
+    if desde:
+        lineas = lineas.filter(pedido__fecha_pedido__gte=desde)
+    if hasta:
+        lineas = lineas.filter(pedido__fecha_pedido__lt=hasta)
+    if proveedor:
+        lineas = lineas.filter(pedido__proveedor=proveedor)
+    if estado:
+        lineas = lineas.filter(pedido__estado=estado)
+
+    return (
+        lineas
+        .annotate(
+            producto=Coalesce('alimento__nombre', 'utensilio__nombre'),
+            total=ExpressionWrapper(
+                F('cantidad') * F('precio_unitario'), output_field=DecimalField(max_digits=14, decimal_places=2)
+            ),
+        )
+        .order_by(*ORDEN.get(agrupar, ORDEN['']))
+        .values_list(
+            'pedido_id', 'pedido__fecha_pedido', 'pedido__fecha_entrega', 'pedido__estado',
+            'pedido__proveedor__nombre', 'producto', 'cantidad', 'cantidad_recibida',
+            'unidad__abreviatura', 'precio_unitario', 'total',
+        )
+        .iterator(chunk_size=TAMANO_BLOQUE)
+    )
+
+
+def _clave_grupo(fila, agrupar):
+    proveedor, fecha = fila[4], fila[1]
+    mes = fecha.strftime('%m/%Y')
+    if agrupar == 'proveedor':
+        return proveedor
+    if agrupar == 'mes':
+        return mes
+    if agrupar == 'proveedor_mes':
+        return f"{proveedor} {mes}"
+    return None
+
+
+def filas_exportacion(lineas, agrupar=''):
+    """
+    Generador de filas (cabecera, líneas, subtotales por grupo y total
+    general). Solo guarda el grupo en curso y sus acumulados.
+    """
+    yield CABECERA
+    vacio = [''] * (len(CABECERA) - 2)
+    grupo, subtotal, total = None, Decimal('0'), Decimal('0')
+
+    for fila in lineas:
+        clave = _clave_grupo(fila, agrupar)
+        if agrupar and clave != grupo:
+            if grupo is not None:
+                yield vacio + [f'Subtotal {grupo}', subtotal]
+            grupo, subtotal = clave, Decimal('0')
+        subtotal += fila[-1]
+        total += fila[-1]
+        yield list(fila)
+
+    if agrupar and grupo is not None:
+        yield vacio + [f'Subtotal {grupo}', subtotal]
+    yield vacio + ['Total', total]
+
+
+class _Eco:
+    """Pseudo-fichero para csv.writer: devuelve la línea en vez de guardarla."""
+
+    def write(self, valor):
+        return valor
+
+
+def csv_en_streaming(filas):
+    """Líneas CSV (separador ';', como espera Excel en español) una a una."""
+    writer = csv.writer(_Eco(), delimiter=';')
+    yield '\ufeff'  # BOM para que Excel detecte UTF-8
+    for fila in filas:
+        yield writer.writerow(fila)
+
+
+def xlsx_solo_escritura(filas, titulo='Pedidos'):
+    """
+    Escribe las filas con un libro openpyxl en modo write_only (las filas van
+    a disco según se añaden) y devuelve un fichero temporal posicionado al
+    principio, listo para FileResponse.
+    """
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet(title=titulo[:31])
+    for fila in filas:
+        ws.append([float(valor) if isinstance(valor, Decimal) else valor for valor in fila])
+
+    fichero = TemporaryFile()
+    wb.save(fichero)
+    fichero.seek(0)
+    return fichero
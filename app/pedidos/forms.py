@@ -23,7 +23,7 @@ class PedidoForm(forms.ModelForm):
         # Filtrar proveedores por centro del usuario
         if self.user:
             try:
-                user_profile = UserProfile.objects.get(user=self.user)
+                user_profile = self.user.userprofile
                 if user_profile.centro:
                     self.fields['proveedor'].queryset = Proveedor.objects.filter(centro=user_profile.centro)
             except UserProfile.DoesNotExist:
@@ -47,7 +47,7 @@ class PedidoDetalleForm(forms.ModelForm):
         super().__init__(*args, **kwargs)
 
         if user:
-            centro = UserProfile.objects.get(user=user).centro
+            centro = user.userprofile.centro
             if 'alimento' in self.fields:
                 self.fields['alimento'].queryset = Alimento.objects.filter(centro=centro)
             if 'utensilio' in self.fields:  # ✅ evita KeyError
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from app.dashuser.models import Alimento
+from app.pedidos.alertas import evaluar_alimentos
+
+
+class Command(BaseCommand):
+    help = (
+        "Reevalúa desde cero las alertas de reposición. En el día a día se "
+        "mantienen solas con cada movimiento de stock; esto sirve para la carga "
+        "inicial o tras importar datos."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--centro', type=int, help="Limitar a un centro (id)")
+        parser.add_argument('--bloque', type=int, default=500, help="Alimentos por consulta")
+
+    def handle(self, *args, **options):
+        alimentos = Alimento.objects.order_by('pk')
+        if options['centro']:
+            alimentos = alimentos.filter(centro_id=options['centro'])
+
+        ids = list(alimentos.values_list('pk', flat=True))
+        bloque = options['bloque']
+        for inicio in range(0, len(ids), bloque):
+            evaluar_alimentos(ids[inicio:inicio + bloque])
+
+        self.stdout.write(self.style.SUCCESS(f"{len(ids)} alimentos evaluados."))
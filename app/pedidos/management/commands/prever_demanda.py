@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand, CommandError
+from app.super.models import Centros
+from app.pedidos.prevision import MODELOS, calcular_necesidades, generar_pedidos_prevision
+
+
+class Command(BaseCommand):
+    help = (
+        "Prevé la demanda de platos a partir de las etiquetas impresas, la "
+        "convierte en necesidades de ingredientes y, opcionalmente, crea los "
+        "pedidos en borrador por proveedor."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('centro', type=int, help="Id del centro")
+        parser.add_argument('--dias', type=int, default=7, help="Días a cubrir")
+        parser.add_argument('--modelo', choices=list(MODELOS), default='semanal')
+        parser.add_argument('--historico', type=int, default=730, help="Días de histórico a usar")
+        parser.add_argument('--sin-minimo', action='store_true', help="No reponer hasta el stock mínimo")
+        parser.add_argument('--crear-pedidos', action='store_true', help="Crear los pedidos en borrador")
+
+    def handle(self, *args, **options):
+        try:
+            centro = Centros.objects.get(pk=options['centro'])
+        except Centros.DoesNotExist:
+            raise CommandError(f"No existe el centro {options['centro']}")
+
+        opciones = {
+            'historico_dias': options['historico'],
+            'mantener_minimo': not options['sin_minimo'],
+        }
+
+        if options['crear_pedidos']:
+            pedidos, omitidos = generar_pedidos_prevision(
+                centro, dias_prevision=options['dias'], modelo=options['modelo'], **opciones
+            )
+            self.stdout.write(self.style.SUCCESS(f"{len(pedidos)} pedidos en borrador creados."))
+            for alimento in omitidos:
+                self.stdout.write(self.style.WARNING(f"Sin recepciones previas: {alimento.nombre}"))
+            return
+
+        necesidades = calcular_necesidades(centro, options['dias'], options['modelo'], **opciones)
+        self.stdout.write(f"{'Alimento':40} {'Necesidad':>12} {'Disponible':>12} {'Faltante':>12}")
+        for fila in necesidades:
+            self.stdout.write(
+                f"{fila['nombre'][:40]:40} {fila['necesidad']:>12} {fila['disponible']:>12} {fila['faltante']:>12}"
+            )
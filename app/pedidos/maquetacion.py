@@ -0,0 +1,22 @@
+from functools import lru_cache
+from weasyprint import HTML, CSS
+
+
+# Maquetación de WeasyPrint, sin nada de Django: es lo único que ejecutan los
+# procesos de zip_pedidos (app.pedidos.pdf). Se arrancan con 'spawn', así que
+# importan solo este módulo y no necesitan la configuración ni la BD.
+
+
+@lru_cache(maxsize=None)
+def css(texto):
+    """CSS ya parseado; se compila una vez por proceso y se reutiliza en cada PDF."""
+    return CSS(string=texto)
+
+
+def html_a_pdf(html, texto_css, base_url):
+    return HTML(string=html, base_url=base_url).write_pdf(stylesheets=[css(texto_css)])
+
+
+def pdf_trabajador(args):
+    nombre, html, texto_css, base_url = args
+    return nombre, html_a_pdf(html, texto_css, base_url)
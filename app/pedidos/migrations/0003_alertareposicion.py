@@ -0,0 +1,40 @@
+# Generated by Django 5.2.6 on 2026-10-19 19:06
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashuser', '0021_alimento_stock_util'),
+        ('pedidos', '0002_pedidodetalle_utensilio'),
+        ('super', '0003_permiso'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='pedido',
+            name='estado',
+            field=models.CharField(choices=[('borrador', 'Borrador'), ('pendiente', 'Pendiente'), ('encamino', 'En camino'), ('parcial', 'Parcialmente Recibido'), ('recibido', 'Recibido'), ('cancelado', 'Cancelado')], default='pendiente', max_length=20),
+        ),
+        migrations.CreateModel(
+            name='AlertaReposicion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('stock_disponible', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('stock_minimo', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('cantidad_sugerida', models.DecimalField(decimal_places=2, help_text='En unidad de uso del alimento', max_digits=12)),
+                ('desde', models.DateTimeField(auto_now_add=True)),
+                ('actualizada', models.DateTimeField(auto_now=True)),
+                ('alimento', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='alerta_reposicion', to='dashuser.alimento')),
+                ('centro', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='super.centros')),
+            ],
+            options={
+                'verbose_name': 'Alerta de reposición',
+                'verbose_name_plural': 'Alertas de reposición',
+                'ordering': ['-desde'],
+                'indexes': [models.Index(fields=['centro', '-desde'], name='alertarepo_centro_desde_idx')],
+            },
+        ),
+    ]
@@ -1,11 +1,40 @@
 from django.db import models
+from django.db.models import F, Q, Sum, Count, Value, Case, When, ExpressionWrapper
+from django.db.models.functions import Coalesce
 from django.core.exceptions import ValidationError
 from django.contrib.auth.models import User
 from datetime import date
-from app.super.models import ModeloBaseCentro
+from app.super.models import ModeloBaseCentro, CentroScopedQuerySet
 from app.recepcion.models import Proveedor
 from app.dashuser.models import Alimento, UnidadDeMedida, Utensilio
 
+class PedidoQuerySet(CentroScopedQuerySet):
+
+    def con_totales(self):
+        """
+        Importe, cantidades pedida/recibida, porcentaje recibido y recuento de
+        líneas (totales y completas) agregados en la misma consulta del listado.
+        """
+        decimal = models.DecimalField(max_digits=14, decimal_places=2)
+        cero = Value(0, output_field=decimal)
+        return self.annotate(
+            importe_total=Coalesce(
+                Sum(ExpressionWrapper(F('detalles__cantidad') * F('detalles__precio_unitario'), output_field=decimal)),
+                cero,
+            ),
+            cantidad_pedida=Coalesce(Sum('detalles__cantidad'), cero),
+            cantidad_recibida=Coalesce(Sum('detalles__cantidad_recibida'), cero),
+            num_lineas=Count('detalles'),
+            lineas_completas=Count('detalles', filter=Q(detalles__cantidad_recibida__gte=F('detalles__cantidad'))),
+        ).annotate(
+            porcentaje=Case(
+                When(cantidad_pedida=0, then=cero),
+                default=ExpressionWrapper(F('cantidad_recibida') * 100 / F('cantidad_pedida'), output_field=decimal),
+                output_field=decimal,
+            ),
+        )
+
+
 class Pedido(ModeloBaseCentro):
     proveedor = models.ForeignKey(Proveedor, on_delete=models.CASCADE)
     fecha_pedido = models.DateField(auto_now_add=True)
@@ -14,6 +43,7 @@ class Pedido(ModeloBaseCentro):
     estado = models.CharField(
         max_length=20,
         choices=[
+            ('borrador', 'Borrador'),
             ('pendiente', 'Pendiente'),
             ('encamino', 'En camino'),
             ('parcial', 'Parcialmente Recibido'),
@@ -24,6 +54,8 @@ class Pedido(ModeloBaseCentro):
     )
     creado_por = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
 
+    objects = PedidoQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Pedido'
         verbose_name_plural = 'Pedidos'
@@ -32,43 +64,53 @@ class Pedido(ModeloBaseCentro):
     def __str__(self):
         return f"Pedido #{self.id} a {self.proveedor}"
 
+    CAMPOS_TOTALES = ('importe_total', 'cantidad_pedida', 'cantidad_recibida', 'porcentaje',
+                      'num_lineas', 'lineas_completas')
+
+    def _totales(self, refrescar=False):
+        """Anotaciones de con_totales(); si la instancia no las trae, una consulta."""
+        if refrescar or not hasattr(self, 'importe_total'):
+            totales = Pedido.objects.filter(pk=self.pk).con_totales().values(*self.CAMPOS_TOTALES).first()
+            for campo in self.CAMPOS_TOTALES:
+                setattr(self, campo, totales[campo] if totales else 0)
+        return self
+
     def total_pedido(self):
-        return sum(detalle.total_linea() for detalle in self.detalles.all())
+        return self._totales().importe_total
     
     @property
     def cantidad_total_recibida(self):
         """Cantidad total recibida de todos los items del pedido"""
-        return sum(d.cantidad_recibida for d in self.detalles.all())
+        return self._totales().cantidad_recibida
     
     @property
     def porcentaje_recibido(self):
         """Porcentaje del pedido que ha sido recibido"""
-        total_pedido = sum(d.cantidad for d in self.detalles.all())
-        if total_pedido == 0:
-            return 0
-        return (self.cantidad_total_recibida / total_pedido) * 100
+        return self._totales().porcentaje
     
     def actualizar_estado(self):
-        """Actualiza el estado del pedido basado en las recepciones"""
-        if self.estado == 'cancelado':
+        """
+        Actualiza el estado del pedido basado en las recepciones. Líneas
+        totales, completas y cantidad recibida salen de un único agregado.
+        Los borradores no cambian hasta que se confirman a mano.
+        """
+        if self.estado in ('cancelado', 'borrador'):
             return
-        
-        total_detalles = self.detalles.count()
-        if total_detalles == 0:
+
+        totales = self._totales(refrescar=True)
+        if totales.num_lineas == 0:
             return
-        
-        detalles_completos = sum(1 for d in self.detalles.all() if d.cantidad_recibida >= d.cantidad)
-        
-        if detalles_completos == total_detalles:
+
+        if totales.lineas_completas == totales.num_lineas:
             self.estado = 'recibido'
             if not self.fecha_entrega:
                 self.fecha_entrega = date.today()
-        elif self.cantidad_total_recibida > 0:
+        elif totales.cantidad_recibida > 0:
             self.estado = 'parcial'
         else:
             self.estado = 'encamino' if self.estado != 'pendiente' else 'pendiente'
-        
-        self.save()
+
+        self.save(update_fields=['estado', 'fecha_entrega'])
 
 
 class PedidoDetalle(models.Model):
@@ -111,22 +153,16 @@ class PedidoDetalle(models.Model):
         """Devuelve el producto asociado (alimento o utensilio)"""
         return self.alimento if self.alimento else self.utensilio
     
-    def actualizar_cantidad_recibida(self, cantidad):
-        """Actualiza la cantidad recibida y ajusta el stock"""
+    def actualizar_cantidad_recibida(self, cantidad, lote=None, fecha_caducidad=None):
+        """Recepciona una sola línea (ver recibir.recibir_pedido para varias a la vez)"""
         if cantidad < 0 or (self.cantidad_recibida + cantidad) > self.cantidad:
             raise ValueError("Cantidad recibida no válida")
-        
-        self.cantidad_recibida += cantidad
-        self.save()
-        
-        # Actualizar el stock del producto
-        producto = self.producto()
-        if producto:
-            producto.stock_actual += cantidad
-            producto.save()
-        
-        # Actualizar estado del pedido padre
-        self.pedido.actualizar_estado()
+
+        from .recibir import recibir_pedido
+        recibir_pedido(self.pedido, {
+            self.pk: {'cantidad': cantidad, 'lote': lote, 'fecha_caducidad': fecha_caducidad},
+        })
+        self.refresh_from_db(fields=['cantidad_recibida'])
 
     def __str__(self):
         if self.alimento:
@@ -135,3 +171,27 @@ class PedidoDetalle(models.Model):
             return f"{self.cantidad} x {self.utensilio.nombre} @ {self.precio_unitario}€"
         return f"{self.cantidad} x Item desconocido @ {self.precio_unitario}€"
 
+
+class AlertaReposicion(ModeloBaseCentro):
+    """
+    Alimento cuyo stock disponible (actual - reservado) está por debajo del
+    mínimo. Solo existe mientras dura la situación: se crea, actualiza o borra
+    al reevaluar los alimentos afectados por un movimiento de stock.
+    """
+    alimento = models.OneToOneField(Alimento, on_delete=models.CASCADE, related_name='alerta_reposicion')
+    stock_disponible = models.DecimalField(max_digits=12, decimal_places=2)
+    stock_minimo = models.DecimalField(max_digits=10, decimal_places=2)
+    cantidad_sugerida = models.DecimalField(max_digits=12, decimal_places=2, help_text="En unidad de uso del alimento")
+    desde = models.DateTimeField(auto_now_add=True)
+    actualizada = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'Alerta de reposición'
+        verbose_name_plural = 'Alertas de reposición'
+        ordering = ['-desde']
+        indexes = [
+            models.Index(fields=['centro', '-desde'], name='alertarepo_centro_desde_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.alimento.nombre}: {self.stock_disponible} < {self.stock_minimo}"
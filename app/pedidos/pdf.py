@@ -0,0 +1,104 @@
+import logging
+import multiprocessing
+import threading
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+from django.db.models import Prefetch
+from django.template.loader import get_template, render_to_string
+from .maquetacion import html_a_pdf as _html_a_pdf, pdf_trabajador as _pdf_trabajador
+from .models import PedidoDetalle
+
+logger = logging.getLogger(__name__)
+
+
+HOJA_ESTILOS = 'pedidos/pedido_pdf.css'
+MAX_PROCESOS = 4
+
+# Un único pool por proceso web, creado al primer ZIP y reutilizado. Con
+# 'spawn' y no fork: el proceso web ya tiene hilos (importaciones, imágenes)
+# y hacer fork con hilos vivos puede dejar bloqueos tomados en el hijo.
+_pool = None
+_bloqueo_pool = threading.Lock()
+
+
+def _pool_pdf():
+    global _pool
+    with _bloqueo_pool:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=MAX_PROCESOS, mp_context=multiprocessing.get_context('spawn'),
+            )
+        return _pool
+
+
+def _descartar_pool():
+    global _pool
+    with _bloqueo_pool:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def texto_hoja_estilos():
+    return get_template(HOJA_ESTILOS).template.source
+
+
+def pedidos_para_pdf(pedidos):
+    """
+    Prepara un queryset de pedidos para pintarlos: proveedor y centro por
+    join, totales anotados y todas las líneas (con alimento, utensilio y
+    unidad) en una sola consulta adicional.
+    """
+    return (
+        pedidos
+        .con_totales()
+        .select_related('proveedor', 'centro')
+        .prefetch_related(Prefetch(
+            'detalles',
+            queryset=PedidoDetalle.objects.select_related('alimento', 'utensilio', 'unidad').order_by('id'),
+        ))
+    )
+
+
+def pdf_pedido(pedido, base_url):
+    """PDF de un solo pedido."""
+    html = render_to_string('pedidos/pedido_pdf.html', {'pedido': pedido})
+    return _html_a_pdf(html, texto_hoja_estilos(), base_url)
+
+
+def pdf_pedidos(pedidos, base_url):
+    """Un único PDF con todos los pedidos, cada uno desde una página nueva."""
+    html = render_to_string('pedidos/pedidos_lote_pdf.html', {'pedidos': pedidos})
+    return _html_a_pdf(html, texto_hoja_estilos(), base_url)
+
+
+def zip_pedidos(pedidos, base_url, procesos=MAX_PROCESOS):
+    """
+    ZIP con un PDF por pedido. Las plantillas se pintan aquí (necesitan la
+    BD); la maquetación de WeasyPrint, que es lo costoso, se reparte entre
+    los procesos del pool. Con un solo pedido o procesos=1 (o si el pool se
+    ha roto) se hace todo en el proceso actual.
+    """
+    css = texto_hoja_estilos()
+    trabajos = [
+        (f'pedido_{pedido.pk}.pdf', render_to_string('pedidos/pedido_pdf.html', {'pedido': pedido}), css, base_url)
+        for pedido in pedidos
+    ]
+
+    resultados = None
+    if procesos > 1 and len(trabajos) > 1:
+        try:
+            resultados = list(_pool_pdf().map(_pdf_trabajador, trabajos))
+        except BrokenProcessPool:
+            logger.exception("Pool de PDF roto; se maqueta en el proceso actual")
+            _descartar_pool()
+    if resultados is None:
+        resultados = [_pdf_trabajador(trabajo) for trabajo in trabajos]
+
+    buffer = BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for nombre, pdf in resultados:
+            zf.writestr(nombre, pdf)
+    return buffer.getvalue()
@@ -0,0 +1,176 @@
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+import numpy as np
+from django.db.models import Count, F
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from app.dashuser.models import Alimento
+from app.platos.models import EtiquetaPlato, AlimentoPlato, AlimentoSalsa, cantidad_para_stock
+from .alertas import crear_pedidos_borrador
+
+
+MODELOS = {
+    'media': 'Media móvil',
+    'semanal': 'Estacional por día de la semana',
+}
+
+
+######################################################################################
+#############################   HISTÓRICO Y MODELOS   ################################
+######################################################################################
+
+
+def historico_produccion(centro, desde, hasta):
+    """
+    Raciones impresas por plato y día entre `desde` y `hasta` (incluidos),
+    como matriz (platos x días). La agregación se hace en la BD, así que dos
+    años de etiquetas llegan como una fila por plato y día con producción.
+    """
+    filas = (
+        EtiquetaPlato.objects
+        .filter(
+            centro=centro,
+            impresa=True,
+            # Rango sobre la columna (no fecha__date) para que use el índice (centro, fecha)
+            fecha__gte=timezone.make_aware(datetime.combine(desde, time.min)),
+            fecha__lt=timezone.make_aware(datetime.combine(hasta + timedelta(days=1), time.min)),
+        )
+        .annotate(dia=TruncDate('fecha'))
+        .values('plato_id', 'dia')
+        .annotate(raciones=Count('id'))
+        .values_list('plato_id', 'dia', 'raciones')
+        .order_by()
+    )
+    filas = list(filas)
+    platos = sorted({plato_id for plato_id, _, _ in filas})
+    dias = (hasta - desde).days + 1
+    matriz = np.zeros((len(platos), dias))
+    if filas:
+        indice = {plato_id: i for i, plato_id in enumerate(platos)}
+        p, d, n = zip(*filas)
+        np.add.at(
+            matriz,
+            (np.fromiter((indice[x] for x in p), dtype=int), np.fromiter(((x - desde).days for x in d), dtype=int)),
+            np.asarray(n, dtype=float),
+        )
+    return platos, matriz
+
+
+def prever_media(matriz, dias_prevision, ventana=28):
+    """Media diaria de las últimas `ventana` jornadas por el horizonte."""
+    if matriz.shape[1] == 0:
+        return np.zeros(matriz.shape[0])
+    return matriz[:, -ventana:].mean(axis=1) * dias_prevision
+
+
+def prever_semanal(matriz, hasta, dias_prevision, semanas=8):
+    """
+    Media de cada día de la semana en las últimas `semanas` semanas, sumada
+    sobre los días del horizonte (los lunes con lo que se hace un lunes...).
+    """
+    n = min(matriz.shape[1], semanas * 7)
+    if n == 0:
+        return np.zeros(matriz.shape[0])
+    reciente = matriz[:, -n:]
+    inicio = hasta - timedelta(days=n - 1)
+    dia_semana = (np.arange(n) + inicio.weekday()) % 7
+
+    # Media por día de la semana: (platos x 7)
+    sumas = np.zeros((matriz.shape[0], 7))
+    np.add.at(sumas.T, dia_semana, reciente.T)
+    veces = np.bincount(dia_semana, minlength=7)
+    medias = sumas / np.maximum(veces, 1)
+
+    # Cuántas veces aparece cada día de la semana en el horizonte
+    manana = hasta + timedelta(days=1)
+    horizonte = np.bincount((np.arange(dias_prevision) + manana.weekday()) % 7, minlength=7)
+    return medias @ horizonte
+
+
+######################################################################################
+#############################   NECESIDADES DE COMPRA   ##############################
+######################################################################################
+
+
+def matriz_recetas(platos):
+    """
+    Cantidad de cada alimento (en unidad de stock, ya corregida por merma)
+    por ración de cada plato, incluida su salsa: matriz (platos x alimentos).
+    """
+    campos = ('alimento_id', 'cantidad', 'unidad_medida__abreviatura', 'alimento__porcentaje_uso')
+    filas = list(AlimentoPlato.objects.filter(plato_id__in=platos).values_list('plato_id', *campos))
+    filas += list(
+        AlimentoSalsa.objects
+        .filter(salsa__plato__id__in=platos)
+        .annotate(plato_ref=F('salsa__plato__id'))
+        .values_list('plato_ref', *campos)
+    )
+
+    alimentos = sorted({fila[1] for fila in filas})
+    indice_plato = {plato_id: i for i, plato_id in enumerate(platos)}
+    indice_alimento = {alimento_id: j for j, alimento_id in enumerate(alimentos)}
+    recetas = np.zeros((len(platos), len(alimentos)))
+    for plato_id, alimento_id, cantidad, abreviatura, porcentaje_uso in filas:
+        if not porcentaje_uso or porcentaje_uso <= 0:
+            porcentaje_uso = 100
+        recetas[indice_plato[plato_id], indice_alimento[alimento_id]] += float(
+            cantidad_para_stock(cantidad, abreviatura, porcentaje_uso)
+        )
+    return alimentos, recetas
+
+
+def calcular_necesidades(centro, dias_prevision=7, modelo='semanal', historico_dias=730, mantener_minimo=True):
+    """
+    Explota la demanda prevista de platos en ingredientes y la compara con el
+    stock disponible. Devuelve una fila por alimento con necesidad, disponible
+    y faltante (en unidad de uso), ordenada de mayor a menor faltante.
+    """
+    hasta = timezone.localdate() - timedelta(days=1)
+    desde = hasta - timedelta(days=historico_dias - 1)
+
+    platos, matriz = historico_produccion(centro, desde, hasta)
+    if not platos:
+        return []
+
+    if modelo == 'media':
+        demanda = prever_media(matriz, dias_prevision)
+    else:
+        demanda = prever_semanal(matriz, hasta, dias_prevision)
+
+    alimentos, recetas = matriz_recetas(platos)
+    if not alimentos:
+        return []
+    necesidad = demanda @ recetas
+
+    stock = {
+        a['pk']: a
+        for a in Alimento.objects.filter(pk__in=alimentos).con_stock(centro).values(
+            'pk', 'nombre', 'disponible', 'stock_minimo'
+        )
+    }
+    disponible = np.array([float(stock[a]['disponible']) for a in alimentos])
+    minimo = np.array([float(stock[a]['stock_minimo'] or 0) for a in alimentos])
+    faltante = np.clip(necesidad + (minimo if mantener_minimo else 0) - disponible, 0, None)
+
+    filas = [
+        {
+            'alimento_id': alimento_id,
+            'nombre': stock[alimento_id]['nombre'],
+            'necesidad': Decimal(f"{necesidad[j]:.2f}"),
+            'disponible': Decimal(f"{disponible[j]:.2f}"),
+            'faltante': Decimal(f"{faltante[j]:.2f}"),
+        }
+        for j, alimento_id in enumerate(alimentos)
+    ]
+    filas.sort(key=lambda fila: fila['faltante'], reverse=True)
+    return filas
+
+
+def generar_pedidos_prevision(centro, usuario=None, dias_prevision=7, modelo='semanal', **opciones):
+    """Borradores por proveedor con lo que falta para cubrir la previsión."""
+    necesidades = calcular_necesidades(centro, dias_prevision, modelo, **opciones)
+    cantidades = {fila['alimento_id']: fila['faltante'] for fila in necesidades}
+    return crear_pedidos_borrador(
+        centro, cantidades, usuario,
+        observaciones=f"Previsión {MODELOS.get(modelo, modelo).lower()} a {dias_prevision} días.",
+    )
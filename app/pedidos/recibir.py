@@ -0,0 +1,132 @@
+from collections import defaultdict
+from decimal import Decimal
+from django.db import transaction
+from app.core.auditoria import auditoria_en_lote, contar_en_lote
+from app.dashuser.models import Alimento, Utensilio
+from app.recepcion.models import Recepcion, StockLote
+from .alertas import programar_evaluacion
+from .models import PedidoDetalle
+
+
+def recibir_pedido(pedido, entradas):
+    """
+    Recepciona de una vez varias líneas de un pedido.
+
+    entradas: {detalle_id: {'cantidad': Decimal, 'lote': str, 'fecha_caducidad': date}}
+    (lote y fecha_caducidad solo son obligatorios en las líneas de alimento).
+
+    Todo va en una transacción y con un número fijo de sentencias sea cual sea
+    el tamaño del pedido: un bulk_update de las líneas, otro para el stock de
+    los alimentos y otro para el de los utensilios (leídos con bloqueo), un
+    bulk_create de Recepcion y otro de StockLote, y un agregado para el
+    estado del pedido. Como las escrituras en bloque no emiten señales, en
+    auditoría queda un único registro resumen de la recepción.
+    Devuelve la lista de recepciones creadas.
+    """
+    entradas = {int(pk): datos for pk, datos in entradas.items() if Decimal(datos.get('cantidad') or 0) > 0}
+    if not entradas:
+        return []
+
+    descripcion = f"Recepción del pedido #{pedido.pk}"
+    with transaction.atomic(), auditoria_en_lote(descripcion, modelo='Pedido', objeto_id=pedido.pk, centro=pedido.centro):
+        detalles = list(
+            PedidoDetalle.objects
+            .select_for_update()
+            .filter(pedido=pedido, pk__in=entradas)
+            .select_related('alimento')
+        )
+        if len(detalles) != len(entradas):
+            raise ValueError("Alguna línea no pertenece al pedido.")
+
+        recepciones = []
+        entrada_alimento = defaultdict(Decimal)     # alimento_id -> cantidad en unidad de uso
+        coste_alimento = defaultdict(Decimal)       # alimento_id -> cantidad * precio
+        entrada_utensilio = defaultdict(Decimal)
+        for detalle in detalles:
+            datos = entradas[detalle.pk]
+            cantidad = Decimal(datos['cantidad'])
+            if cantidad > detalle.cantidad - detalle.cantidad_recibida:
+                raise ValueError(f"Cantidad recibida no válida en la línea {detalle}.")
+            detalle.cantidad_recibida += cantidad
+
+            if detalle.utensilio_id:
+                entrada_utensilio[detalle.utensilio_id] += cantidad
+                continue
+
+            alimento = detalle.alimento
+            if not datos.get('lote') or not datos.get('fecha_caducidad'):
+                raise ValueError(f"Falta lote o caducidad de '{alimento.nombre}'.")
+
+            # Misma conversión que Recepcion.actualizar_stock_alimento
+            cantidad_entrada = cantidad
+            if alimento.unidad_compra_id != alimento.unidad_uso_id:
+                if not alimento.peso_unitario or alimento.peso_unitario <= 0:
+                    raise ValueError(
+                        f"El alimento '{alimento.nombre}' necesita peso_unitario para convertir entre unidades."
+                    )
+                cantidad_entrada *= alimento.peso_unitario
+            entrada_alimento[alimento.pk] += cantidad_entrada
+            coste_alimento[alimento.pk] += cantidad_entrada * detalle.precio_unitario
+
+            recepcion = Recepcion(
+                centro_id=pedido.centro_id,
+                proveedor_id=pedido.proveedor_id,
+                alimento=alimento,
+                lote=datos['lote'],
+                fecha_caducidad=datos['fecha_caducidad'],
+                cantidad=cantidad,
+                unidad_compra_id=detalle.unidad_id,
+                precio_compra=detalle.precio_unitario,
+                observaciones=f"Pedido #{pedido.pk}",
+            )
+            recepcion.cantidad_entrada = cantidad_entrada
+            recepciones.append(recepcion)
+
+        PedidoDetalle.objects.bulk_update(detalles, ['cantidad_recibida'])
+
+        # Las filas de producto quedan bloqueadas hasta el final de la transacción,
+        # así que leer, sumar y escribir con bulk_update no pierde movimientos
+        # concurrentes. El precio medio sigue la fórmula de Recepcion.
+        alimentos = list(Alimento.objects.select_for_update().filter(pk__in=entrada_alimento))
+        for alimento in alimentos:
+            stock_anterior = alimento.stock_actual or 0
+            entrada = entrada_alimento[alimento.pk]
+            if stock_anterior > 0 and alimento.precio_medio:
+                alimento.precio_medio = (
+                    stock_anterior * alimento.precio_medio + coste_alimento[alimento.pk]
+                ) / (stock_anterior + entrada)
+            else:
+                alimento.precio_medio = coste_alimento[alimento.pk] / entrada
+            alimento.stock_actual = stock_anterior + entrada
+            alimento.stock_util = alimento.stock_actual * (alimento.porcentaje_uso or 100) / 100
+        Alimento.objects.bulk_update(alimentos, ['stock_actual', 'stock_util', 'precio_medio'])
+
+        utensilios = list(Utensilio.objects.select_for_update().filter(pk__in=entrada_utensilio))
+        for utensilio in utensilios:
+            utensilio.stock_actual += entrada_utensilio[utensilio.pk]
+        Utensilio.objects.bulk_update(utensilios, ['stock_actual'])
+
+        Recepcion.objects.bulk_create(recepciones)
+        StockLote.objects.bulk_create([
+            StockLote(
+                centro_id=r.centro_id,
+                alimento_id=r.alimento_id,
+                recepcion=r,
+                lote=r.lote,
+                fecha_caducidad=r.fecha_caducidad,
+                cantidad_inicial=r.cantidad_entrada,
+                cantidad_disponible=r.cantidad_entrada,
+            )
+            for r in recepciones
+        ])
+
+        contar_en_lote('PedidoDetalle', 'modificar', len(detalles))
+        contar_en_lote('Alimento', 'modificar', len(alimentos))
+        contar_en_lote('Utensilio', 'modificar', len(utensilios))
+        contar_en_lote('Recepcion', 'crear', len(recepciones))
+        contar_en_lote('StockLote', 'crear', len(recepciones))
+
+        pedido.actualizar_estado()
+        programar_evaluacion(entrada_alimento)
+
+    return recepciones
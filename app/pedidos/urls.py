@@ -10,10 +10,17 @@ urlpatterns = [
     path('pedido/<int:pk>/', DetailPedidoView.as_view(), name='detalle_pedido'),
     path('pedido/eliminar/<int:pk>/', DeletePedidoView.as_view(), name='eliminar_pedido'),
     path('pedido/editar/<int:pk>/', UpdatePedidoView.as_view(), name='editar_pedido'),
+    path('pedido/recibir/<int:pk>/', RecibirPedidoView.as_view(), name='recibir_pedido'),
     
     path('pedido/<int:pk>/exportar/pdf/', exportar_pedido_pdf, name='exportar_pedido_pdf'),
     path('pedido/<int:pk>/exportar/excel/', exportar_pedido_excel, name='exportar_pedido_excel'),
+    path('pedidos/exportar/', ExportarPedidosView.as_view(), name='exportar_pedidos'),
+    path('pedidos/exportar/pdf/', ExportarPedidosPdfView.as_view(), name='exportar_pedidos_pdf'),
     
     path('pedidos/proveedor/<int:pk>/', ListPedidoPorProveedorView.as_view(), name='pedidos_por_proveedor'), 
+
+    path('alertas/', AlertaReposicionList.as_view(), name='alertas_reposicion'),
+    path('alertas/generar-pedidos/', GenerarPedidosSugeridosView.as_view(), name='generar_pedidos_sugeridos'),
+    path('prevision/generar-pedidos/', GenerarPedidosPrevisionView.as_view(), name='generar_pedidos_prevision'),
     
 ]
\ No newline at end of file
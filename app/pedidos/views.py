@@ -1,376 +1,682 @@
-from django.shortcuts import render, redirect
-from django.urls import reverse_lazy
-from django.forms import inlineformset_factory
-from django.shortcuts import get_object_or_404
-from django.contrib import messages
-from django.contrib.auth import authenticate
-from django.db.models import Q
-from datetime import date
-from django.http import HttpResponse
-from django.template.loader import render_to_string
-from weasyprint import HTML
-from django.core.exceptions import ObjectDoesNotExist
-from django.views.generic.list import ListView
-from django.views.generic.edit import CreateView, UpdateView
-from django.views.generic import DetailView, DeleteView
-from django.contrib.auth.mixins import LoginRequiredMixin
-from app.core.mixins import PaginationMixin, PermisoMixin
-from .models import Pedido, PedidoDetalle
-from .forms import PedidoDetalleForm, PedidoForm, ConfirmPasswordForm
-from app.dashuser.views import datos_centro
-from app.super.models import UserProfile
-from app.recepcion.models import Proveedor
-import openpyxl
-
-
-######################################################################################
-###############################    PEDIDOS    ########################################
-######################################################################################    
-
-
-class CreatePedidoView(LoginRequiredMixin, CreateView):
-    model = Pedido
-    form_class = PedidoForm
-    template_name = 'pedidos/pedido_form.html'
-    success_url = reverse_lazy('pedidos:listado_pedidos')
-
-    def get_form_kwargs(self):
-        """Pasa el usuario al formulario para filtrar proveedores"""
-        kwargs = super().get_form_kwargs()
-        kwargs['user'] = self.request.user
-        return kwargs
-
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        formset_prefix = 'detalle'
-
-        PedidoDetalleFormSet = inlineformset_factory(
-            Pedido,
-            PedidoDetalle,
-            form=PedidoDetalleForm,
-            fields=['alimento', 'utensilio', 'cantidad', 'unidad', 'precio_unitario'],
-            extra=1,
-            can_delete=True
-        )
-
-        if self.request.POST:
-            context['formset'] = PedidoDetalleFormSet(
-                self.request.POST,
-                form_kwargs={'user': self.request.user},
-                prefix=formset_prefix
-            )
-        else:
-            context['formset'] = PedidoDetalleFormSet(
-                form_kwargs={'user': self.request.user},
-                prefix=formset_prefix
-            )
-
-        context['formset_prefix'] = formset_prefix
-        context.update(datos_centro(self.request))
-        return context
-
-    def form_valid(self, form):
-        user_profile = get_object_or_404(UserProfile, user=self.request.user)
-
-        if not user_profile.centro:
-            messages.error(self.request, 'No está asociado a ningún centro.')
-            return self.form_invalid(form)
-
-        formset_prefix = 'detalle'
-        PedidoDetalleFormSet = inlineformset_factory(
-            Pedido,
-            PedidoDetalle,
-            form=PedidoDetalleForm,
-            fields=['alimento', 'utensilio', 'cantidad', 'unidad', 'precio_unitario'],
-            extra=1,
-            can_delete=True
-        )
-
-        formset = PedidoDetalleFormSet(
-            self.request.POST,
-            form_kwargs={'user': self.request.user},
-            prefix=formset_prefix
-        )
-
-        if formset.is_valid():
-            pedido = form.save(commit=False)
-            pedido.centro = user_profile.centro
-            pedido.creado_por = self.request.user
-            pedido.save()
-            formset.instance = pedido
-            formset.save()
-
-            messages.success(self.request, 'Pedido creado correctamente.')
-            return redirect('pedidos:listado_pedidos')
-        else:
-            messages.error(self.request, 'Revise los errores en los detalles del pedido.')
-            context = self.get_context_data()
-            context['formset'] = formset
-            return self.render_to_response(context)
-
-    def form_invalid(self, form):
-        for field, errors in form.errors.items():
-            for error in errors:
-                messages.error(self.request, f"Error en el campo '{field}': {error}")
-        return super().form_invalid(form)
-    
-    
-class ListPedidoView(PermisoMixin, PaginationMixin, LoginRequiredMixin, ListView):
-    permiso_modulo = "Pedido"
-    model = Pedido
-    template_name = 'pedidos/pedido_list.html'
-    context_object_name = 'pedidos'
-    paginate_by = 10
-
-    def get_queryset(self):
-        try:
-            user_profile = UserProfile.objects.filter(user=self.request.user).first()
-            if user_profile and user_profile.centro:
-                centro = user_profile.centro
-                
-                # Orden personalizado usando expresión Case
-                from django.db.models import Case, When, Value
-                from django.db.models.fields import IntegerField
-                
-                queryset = Pedido.objects.filter(centro=centro).order_by(
-                    Case(
-                        When(estado='pendiente', then=Value(0)),
-                        When(estado='encamino', then=Value(1)),
-                        When(estado='parcial', then=Value(2)),
-                        When(estado='recibido', then=Value(3)),
-                        When(estado='cancelado', then=Value(4)),
-                        default=Value(5),
-                        output_field=IntegerField()
-                    ),
-                    '-fecha_entrega'  # Orden descendente por fecha
-                )
-
-                # Resto de la lógica (búsqueda y ordenamiento adicional)
-                search_query = self.request.GET.get('buscar')
-                if search_query:
-                    queryset = queryset.filter(
-                        Q(proveedor__nombre__icontains=search_query) |
-                        Q(observaciones__icontains=search_query)
-                    )
-
-                ordering = self.request.GET.get('ordenar')
-                if ordering == 'fecha':
-                    queryset = queryset.order_by('fecha_entrega')
-                elif ordering == 'proveedor':
-                    queryset = queryset.order_by('proveedor__nombre')
-
-                return queryset
-            else:
-                return Pedido.objects.none()
-        except ObjectDoesNotExist:
-            return Pedido.objects.none()
-
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        context.update(datos_centro(self.request))
-
-        if not context['pedidos'].exists():
-            context['mensaje'] = "No tiene pedidos registrados."
-        
-        # Añadir información sobre el orden actual
-        context['orden_actual'] = self.request.GET.get('ordenar', 'estado')
-        return context
-    
-
-class ListPedidoPorProveedorView(PaginationMixin, LoginRequiredMixin, ListView):
-    model = Pedido
-    template_name = 'pedidos/pedidoproveedor_list.html'
-    context_object_name = 'pedidos'
-    paginate_by = 10
-
-    def get_queryset(self):
-        try:
-            proveedor_id = self.kwargs['pk']
-            user_profile = UserProfile.objects.filter(user=self.request.user).first()
-            if user_profile and user_profile.centro:
-                centro = user_profile.centro
-                return Pedido.objects.filter(centro=centro, proveedor__id=proveedor_id).order_by('-fecha_entrega')
-            else:
-                return Pedido.objects.none()
-        except ObjectDoesNotExist:
-            return Pedido.objects.none()
-
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        context.update(datos_centro(self.request))
-        context['proveedor'] = Proveedor.objects.get(pk=self.kwargs['pk'])
-        if not context['pedidos'].exists():
-            context['mensaje'] = "No hay pedidos para este proveedor."
-        return context
-        
-class DetailPedidoView(LoginRequiredMixin, DetailView):
-    model = Pedido
-    template_name = 'pedidos/pedido_detail.html'
-    context_object_name = 'pedido'
-
-    def get_queryset(self):
-        user_profile = UserProfile.objects.filter(user=self.request.user).first()
-        if user_profile and user_profile.centro:
-            return Pedido.objects.filter(centro=user_profile.centro)
-        return Pedido.objects.none()
-
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        context.update(datos_centro(self.request))
-        context['detalles'] = self.object.detalles.all()
-        context['total'] = sum(item.total_linea() for item in context['detalles'])
-        return context    
-    
-    
-    
-class DeletePedidoView(LoginRequiredMixin, DeleteView):
-    model = Pedido
-    template_name = 'pedidos/pedido_confirm_delete.html'
-    success_url = reverse_lazy('pedidos:listado_pedidos')
-    
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        form = kwargs.get('form', ConfirmPasswordForm())
-        context['form'] = form
-        context.update(datos_centro(self.request))
-    
-    def get(self, request, *args, **kwargs):
-        self.object = self.get_object()
-        form = ConfirmPasswordForm()
-        return render(request, self.template_name, {
-            'object': self.object,
-            'form': form
-        })
-
-    def post(self, request, *args, **kwargs):
-        self.object = self.get_object()
-        form = ConfirmPasswordForm(request.POST)
-
-        if form.is_valid():
-            password = form.cleaned_data['password']
-            user = authenticate(username=request.user.username, password=password)
-
-            if user is not None:
-                self.object.delete()
-                messages.success(request, "Pedido eliminado correctamente.")
-                return redirect(self.success_url)
-            else:
-                messages.error(request, "Contraseña incorrecta.")
-
-        return render(request, self.template_name, {
-            'object': self.object,
-            'form': form
-        })    
-
-
-class UpdatePedidoView(LoginRequiredMixin, UpdateView):
-    model = Pedido
-    form_class = PedidoForm
-    template_name = 'pedidos/pedido_form.html'
-    success_url = reverse_lazy('pedidos:listado_pedidos')
-
-    def get_form_kwargs(self):
-        """Pasa el usuario al formulario para filtrar proveedores"""
-        kwargs = super().get_form_kwargs()
-        kwargs['user'] = self.request.user
-        return kwargs
-
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        PedidoDetalleFormSet = inlineformset_factory(
-            Pedido,
-            PedidoDetalle,
-            form=PedidoDetalleForm,
-            fields=['alimento', 'cantidad', 'unidad', 'precio_unitario'],
-            extra=1,
-            can_delete=True
-        )
-        
-        if self.request.POST:
-            context['formset'] = PedidoDetalleFormSet(
-                self.request.POST, 
-                instance=self.object, 
-                form_kwargs={'user': self.request.user}
-            )
-        else:
-            context['formset'] = PedidoDetalleFormSet(
-                instance=self.object, 
-                form_kwargs={'user': self.request.user}
-            )
-        
-        context.update(datos_centro(self.request))
-        return context
-
-    def form_valid(self, form):
-        context = self.get_context_data()
-        formset = context['formset']
-        old_estado = self.get_object().estado
-
-        if formset.is_valid():
-            pedido = form.save(commit=False)
-            nuevo_estado = form.cleaned_data.get('estado')
-
-            if nuevo_estado == 'recibido' and old_estado != 'recibido':
-                pedido.fecha_entrega = date.today()
-
-            pedido.save()
-            formset.instance = pedido
-            formset.save()
-
-            messages.success(self.request, 'Pedido actualizado correctamente.')
-            return redirect(self.success_url)
-        else:
-            messages.error(self.request, 'Revise los errores en los detalles del pedido.')
-            return self.render_to_response(context)
-
-    def form_invalid(self, form):
-        for field, errors in form.errors.items():
-            for error in errors:
-                messages.error(self.request, f"Error en el campo '{field}': {error}")
-        return super().form_invalid(form)
-    
-    
-######################################################################################
-###########################   EXPORTAR PEDIDOS    ####################################
-######################################################################################  
- 
-    
-def exportar_pedido_pdf(request, pk):
-    pedido = get_object_or_404(Pedido, pk=pk)
-    html_string = render_to_string('pedidos/pedido_pdf.html', {'pedido': pedido})
-
-    response = HttpResponse(content_type='application/pdf')
-    response['Content-Disposition'] = f'inline; filename=pedido_{pedido.id}.pdf'
-
-    HTML(string=html_string).write_pdf(response)
-    return response    
-
-
-
-def exportar_pedido_excel(request, pk):
-    pedido = get_object_or_404(Pedido, pk=pk)
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    ws.title = f'Pedido #{pedido.id}'
-
-    ws.append(['Producto', 'Cantidad', 'Unidad', 'Precio Unitario', 'Total Línea'])
-
-    for d in pedido.detalles.all():
-        producto = d.alimento.nombre if d.alimento else d.utensilio.nombre
-        ws.append([
-            producto,
-            float(d.cantidad),
-            str(d.unidad),
-            float(d.precio_unitario),
-            float(d.total_linea())
-        ])
-
-    ws.append([])
-    ws.append(['', '', '', 'Total Pedido:', float(pedido.total_pedido())])
-
-    response = HttpResponse(
-        content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-    )
-    response['Content-Disposition'] = f'attachment; filename=pedido_{pedido.id}.xlsx'
-    wb.save(response)
-    return response    
\ No newline at end of file
+from django.shortcuts import render, redirect
+from django.urls import reverse_lazy
+from django.forms import inlineformset_factory
+from django.shortcuts import get_object_or_404
+from django.contrib import messages
+from django.contrib.auth import authenticate
+from django.db.models import Q, F
+from datetime import date
+from decimal import Decimal, InvalidOperation
+from django.utils.dateparse import parse_date
+from django.utils.http import url_has_allowed_host_and_scheme
+from django.http import HttpResponse, StreamingHttpResponse, FileResponse
+from django.template.loader import render_to_string
+from django.core.exceptions import ObjectDoesNotExist
+from django.views.generic.list import ListView
+from django.views.generic.edit import CreateView, UpdateView
+from django.views.generic import DetailView, DeleteView
+from django.views import View
+from django.contrib.auth.mixins import LoginRequiredMixin
+from app.core.mixins import PaginationMixin, PermisoMixin
+from .models import Pedido, PedidoDetalle, AlertaReposicion
+from .alertas import programar_evaluacion, generar_pedidos_sugeridos
+from .prevision import MODELOS, generar_pedidos_prevision
+from .recibir import recibir_pedido
+from .pdf import pedidos_para_pdf, pdf_pedido, pdf_pedidos, zip_pedidos
+from .exportar import AGRUPACIONES, lineas_exportacion, filas_exportacion, csv_en_streaming, xlsx_solo_escritura
+from .forms import PedidoDetalleForm, PedidoForm, ConfirmPasswordForm
+from app.dashuser.views import datos_centro
+from app.super.models import UserProfile
+from app.core.middleware.centro import perfil_o_404, perfil_de_request
+from app.recepcion.models import Proveedor
+import openpyxl
+
+
+######################################################################################
+###############################    PEDIDOS    ########################################
+######################################################################################    
+
+
+class CreatePedidoView(LoginRequiredMixin, CreateView):
+    model = Pedido
+    form_class = PedidoForm
+    template_name = 'pedidos/pedido_form.html'
+    success_url = reverse_lazy('pedidos:listado_pedidos')
+
+    def get_form_kwargs(self):
+        """Pasa el usuario al formulario para filtrar proveedores"""
+        kwargs = super().get_form_kwargs()
+        kwargs['user'] = self.request.user
+        return kwargs
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        formset_prefix = 'detalle'
+
+        PedidoDetalleFormSet = inlineformset_factory(
+            Pedido,
+            PedidoDetalle,
+            form=PedidoDetalleForm,
+            fields=['alimento', 'utensilio', 'cantidad', 'unidad', 'precio_unitario'],
+            extra=1,
+            can_delete=True
+        )
+
+        if self.request.POST:
+            context['formset'] = PedidoDetalleFormSet(
+                self.request.POST,
+                form_kwargs={'user': self.request.user},
+                prefix=formset_prefix
+            )
+        else:
+            context['formset'] = PedidoDetalleFormSet(
+                form_kwargs={'user': self.request.user},
+                prefix=formset_prefix
+            )
+
+        context['formset_prefix'] = formset_prefix
+        context.update(datos_centro(self.request))
+        return context
+
+    def form_valid(self, form):
+        user_profile = perfil_o_404(self.request)
+
+        if not user_profile.centro:
+            messages.error(self.request, 'No está asociado a ningún centro.')
+            return self.form_invalid(form)
+
+        formset_prefix = 'detalle'
+        PedidoDetalleFormSet = inlineformset_factory(
+            Pedido,
+            PedidoDetalle,
+            form=PedidoDetalleForm,
+            fields=['alimento', 'utensilio', 'cantidad', 'unidad', 'precio_unitario'],
+            extra=1,
+            can_delete=True
+        )
+
+        formset = PedidoDetalleFormSet(
+            self.request.POST,
+            form_kwargs={'user': self.request.user},
+            prefix=formset_prefix
+        )
+
+        if formset.is_valid():
+            pedido = form.save(commit=False)
+            pedido.centro = user_profile.centro
+            pedido.creado_por = self.request.user
+            pedido.save()
+            formset.instance = pedido
+            formset.save()
+            programar_evaluacion(pedido.detalles.values_list('alimento_id', flat=True))
+
+            messages.success(self.request, 'Pedido creado correctamente.')
+            return redirect('pedidos:listado_pedidos')
+        else:
+            messages.error(self.request, 'Revise los errores en los detalles del pedido.')
+            context = self.get_context_data()
+            context['formset'] = formset
+            return self.render_to_response(context)
+
+    def form_invalid(self, form):
+        for field, errors in form.errors.items():
+            for error in errors:
+                messages.error(self.request, f"Error en el campo '{field}': {error}")
+        return super().form_invalid(form)
+    
+    
+class ListPedidoView(PermisoMixin, PaginationMixin, LoginRequiredMixin, ListView):
+    permiso_modulo = "Pedido"
+    model = Pedido
+    template_name = 'pedidos/pedido_list.html'
+    context_object_name = 'pedidos'
+    paginate_by = 10
+
+    def get_queryset(self):
+        try:
+            user_profile = perfil_de_request(self.request)
+            if user_profile and user_profile.centro:
+                centro = user_profile.centro
+                
+                # Orden personalizado usando expresión Case
+                from django.db.models import Case, When, Value
+                from django.db.models.fields import IntegerField
+                
+                queryset = Pedido.objects.filter(centro=centro).con_totales().select_related('proveedor').order_by(
+                    Case(
+                        When(estado='borrador', then=Value(0)),  # Pendientes de confirmar
+                        When(estado='pendiente', then=Value(1)),
+                        When(estado='encamino', then=Value(2)),
+                        When(estado='parcial', then=Value(3)),
+                        When(estado='recibido', then=Value(4)),
+                        When(estado='cancelado', then=Value(5)),
+                        default=Value(6),
+                        output_field=IntegerField()
+                    ),
+                    '-fecha_entrega'  # Orden descendente por fecha
+                )
+
+                # Resto de la lógica (búsqueda y ordenamiento adicional)
+                search_query = self.request.GET.get('buscar')
+                if search_query:
+                    queryset = queryset.filter(
+                        Q(proveedor__nombre__icontains=search_query) |
+                        Q(observaciones__icontains=search_query)
+                    )
+
+                ordering = self.request.GET.get('ordenar')
+                if ordering == 'fecha':
+                    queryset = queryset.order_by('fecha_entrega')
+                elif ordering == 'proveedor':
+                    queryset = queryset.order_by('proveedor__nombre')
+
+                return queryset
+            else:
+                return Pedido.objects.none()
+        except ObjectDoesNotExist:
+            return Pedido.objects.none()
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context.update(datos_centro(self.request))
+
+        if not context['pedidos']:
+            context['mensaje'] = "No tiene pedidos registrados."
+        
+        # Añadir información sobre el orden actual
+        context['orden_actual'] = self.request.GET.get('ordenar', 'estado')
+
+        # Filtros del formulario de exportación
+        user_profile = perfil_de_request(self.request)
+        if user_profile and user_profile.centro:
+            context['proveedores'] = Proveedor.objects.filter(centro=user_profile.centro).order_by('nombre')
+        context['agrupaciones'] = AGRUPACIONES
+        context['estados'] = Pedido._meta.get_field('estado').choices
+        return context
+    
+
+class ListPedidoPorProveedorView(PaginationMixin, LoginRequiredMixin, ListView):
+    model = Pedido
+    template_name = 'pedidos/pedidoproveedor_list.html'
+    context_object_name = 'pedidos'
+    paginate_by = 10
+
+    def get_queryset(self):
+        try:
+            proveedor_id = self.kwargs['pk']
+            user_profile = perfil_de_request(self.request)
+            if user_profile and user_profile.centro:
+                centro = user_profile.centro
+                return (
+                    Pedido.objects
+                    .filter(centro=centro, proveedor__id=proveedor_id)
+                    .con_totales()
+                    .select_related('proveedor')
+                    .order_by('-fecha_entrega')
+                )
+            else:
+                return Pedido.objects.none()
+        except ObjectDoesNotExist:
+            return Pedido.objects.none()
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context.update(datos_centro(self.request))
+        context['proveedor'] = Proveedor.objects.get(pk=self.kwargs['pk'])
+        if not context['pedidos']:
+            context['mensaje'] = "No hay pedidos para este proveedor."
+        return context
+        
+class DetailPedidoView(LoginRequiredMixin, DetailView):
+    model = Pedido
+    template_name = 'pedidos/pedido_detail.html'
+    context_object_name = 'pedido'
+
+    def get_queryset(self):
+        user_profile = perfil_de_request(self.request)
+        if user_profile and user_profile.centro:
+            return Pedido.objects.filter(centro=user_profile.centro).con_totales().select_related('proveedor')
+        return Pedido.objects.none()
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context.update(datos_centro(self.request))
+        context['detalles'] = self.object.detalles.select_related('alimento', 'utensilio', 'unidad')
+        context['total'] = self.object.importe_total
+        return context    
+    
+    
+    
+class DeletePedidoView(LoginRequiredMixin, DeleteView):
+    model = Pedido
+    template_name = 'pedidos/pedido_confirm_delete.html'
+    success_url = reverse_lazy('pedidos:listado_pedidos')
+    
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        form = kwargs.get('form', ConfirmPasswordForm())
+        context['form'] = form
+        context.update(datos_centro(self.request))
+    
+    def get(self, request, *args, **kwargs):
+        self.object = self.get_object()
+        form = ConfirmPasswordForm()
+        return render(request, self.template_name, {
+            'object': self.object,
+            'form': form
+        })
+
+    def post(self, request, *args, **kwargs):
+        self.object = self.get_object()
+        form = ConfirmPasswordForm(request.POST)
+
+        if form.is_valid():
+            password = form.cleaned_data['password']
+            user = authenticate(username=request.user.username, password=password)
+
+            if user is not None:
+                alimento_ids = list(self.object.detalles.values_list('alimento_id', flat=True))
+                self.object.delete()
+                programar_evaluacion(alimento_ids)
+                messages.success(request, "Pedido eliminado correctamente.")
+                return redirect(self.success_url)
+            else:
+                messages.error(request, "Contraseña incorrecta.")
+
+        return render(request, self.template_name, {
+            'object': self.object,
+            'form': form
+        })    
+
+
+class UpdatePedidoView(LoginRequiredMixin, UpdateView):
+    model = Pedido
+    form_class = PedidoForm
+    template_name = 'pedidos/pedido_form.html'
+    success_url = reverse_lazy('pedidos:listado_pedidos')
+
+    def get_form_kwargs(self):
+        """Pasa el usuario al formulario para filtrar proveedores"""
+        kwargs = super().get_form_kwargs()
+        kwargs['user'] = self.request.user
+        return kwargs
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        PedidoDetalleFormSet = inlineformset_factory(
+            Pedido,
+            PedidoDetalle,
+            form=PedidoDetalleForm,
+            fields=['alimento', 'cantidad', 'unidad', 'precio_unitario'],
+            extra=1,
+            can_delete=True
+        )
+        
+        if self.request.POST:
+            context['formset'] = PedidoDetalleFormSet(
+                self.request.POST, 
+                instance=self.object, 
+                form_kwargs={'user': self.request.user}
+            )
+        else:
+            context['formset'] = PedidoDetalleFormSet(
+                instance=self.object, 
+                form_kwargs={'user': self.request.user}
+            )
+        
+        context.update(datos_centro(self.request))
+        return context
+
+    def form_valid(self, form):
+        context = self.get_context_data()
+        formset = context['formset']
+        old_estado = self.get_object().estado
+        alimento_ids = set(self.object.detalles.values_list('alimento_id', flat=True))
+
+        if formset.is_valid():
+            pedido = form.save(commit=False)
+            nuevo_estado = form.cleaned_data.get('estado')
+
+            if nuevo_estado == 'recibido' and old_estado != 'recibido':
+                pedido.fecha_entrega = date.today()
+
+            pedido.save()
+            formset.instance = pedido
+            formset.save()
+            alimento_ids.update(pedido.detalles.values_list('alimento_id', flat=True))
+            programar_evaluacion(alimento_ids)
+
+            messages.success(self.request, 'Pedido actualizado correctamente.')
+            return redirect(self.success_url)
+        else:
+            messages.error(self.request, 'Revise los errores en los detalles del pedido.')
+            return self.render_to_response(context)
+
+    def form_invalid(self, form):
+        for field, errors in form.errors.items():
+            for error in errors:
+                messages.error(self.request, f"Error en el campo '{field}': {error}")
+        return super().form_invalid(form)
+    
+    
+######################################################################################
+##########################   ALERTAS DE REPOSICIÓN    ################################
+######################################################################################
+
+
+class AlertaReposicionList(PermisoMixin, PaginationMixin, LoginRequiredMixin, ListView):
+    """Alimentos bajo mínimo. Lee la tabla de alertas ya evaluada, sin recalcular stock."""
+    permiso_modulo = "Pedido"
+    model = AlertaReposicion
+    template_name = 'pedidos/alertas_reposicion.html'
+    context_object_name = 'alertas'
+    paginate_by = 20
+
+    def get_queryset(self):
+        user_profile = perfil_de_request(self.request)
+        if user_profile and user_profile.centro:
+            return (
+                AlertaReposicion.objects
+                .filter(centro=user_profile.centro)
+                .select_related('alimento__unidad_uso')
+                .order_by('-desde')
+            )
+        return AlertaReposicion.objects.none()
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context.update(datos_centro(self.request))
+        context['modelos_prevision'] = MODELOS
+        if not context['alertas']:
+            context['mensaje'] = "No hay alimentos por debajo del stock mínimo."
+        return context
+
+
+class GenerarPedidosSugeridosView(PermisoMixin, LoginRequiredMixin, View):
+    """Crea pedidos en borrador, uno por proveedor, a partir de las alertas."""
+    permiso_modulo = "Pedido"
+    permiso_accion = "create"
+
+    def post(self, request, *args, **kwargs):
+        user_profile = perfil_o_404(request)
+        if not user_profile.centro:
+            messages.error(request, 'No está asociado a ningún centro.')
+            return redirect('pedidos:alertas_reposicion')
+
+        pedidos, omitidos = generar_pedidos_sugeridos(user_profile.centro, request.user)
+
+        if pedidos:
+            messages.success(request, f'Se han creado {len(pedidos)} pedidos en borrador.')
+        else:
+            messages.info(request, 'No hay alimentos nuevos que pedir.')
+        if omitidos:
+            nombres = ", ".join(a.nombre for a in omitidos)
+            messages.warning(request, f'Sin recepciones previas (no hay proveedor ni precio): {nombres}.')
+        return redirect('pedidos:listado_pedidos')
+
+
+class GenerarPedidosPrevisionView(PermisoMixin, LoginRequiredMixin, View):
+    """Crea pedidos en borrador con lo que falta para cubrir la demanda prevista."""
+    permiso_modulo = "Pedido"
+    permiso_accion = "create"
+
+    def post(self, request, *args, **kwargs):
+        user_profile = perfil_o_404(request)
+        if not user_profile.centro:
+            messages.error(request, 'No está asociado a ningún centro.')
+            return redirect('pedidos:alertas_reposicion')
+
+        modelo = request.POST.get('modelo', 'semanal')
+        if modelo not in MODELOS:
+            modelo = 'semanal'
+        try:
+            dias = min(max(int(request.POST.get('dias', 7)), 1), 60)
+        except ValueError:
+            dias = 7
+
+        pedidos, omitidos = generar_pedidos_prevision(
+            user_profile.centro, request.user, dias_prevision=dias, modelo=modelo
+        )
+
+        if pedidos:
+            messages.success(request, f'Se han creado {len(pedidos)} pedidos en borrador para {dias} días.')
+        else:
+            messages.info(request, 'El stock disponible cubre la demanda prevista.')
+        if omitidos:
+            nombres = ", ".join(a.nombre for a in omitidos)
+            messages.warning(request, f'Sin recepciones previas (no hay proveedor ni precio): {nombres}.')
+        return redirect('pedidos:listado_pedidos')
+
+
+class RecibirPedidoView(PermisoMixin, LoginRequiredMixin, View):
+    """
+    Recepción de un pedido entero en un solo envío: cantidad recibida, lote y
+    caducidad de cada línea pendiente. Las líneas se procesan juntas en
+    recibir_pedido (una transacción y un número fijo de consultas).
+    """
+    permiso_modulo = "Pedido"
+    permiso_accion = "update"
+    template_name = 'pedidos/pedido_recibir.html'
+
+    def get_pedido(self):
+        user_profile = perfil_o_404(self.request)
+        return get_object_or_404(
+            Pedido.objects.select_related('proveedor'), pk=self.kwargs['pk'], centro=user_profile.centro
+        )
+
+    def get_lineas(self, pedido):
+        return (
+            pedido.detalles
+            .filter(cantidad_recibida__lt=F('cantidad'))
+            .select_related('alimento', 'utensilio', 'unidad')
+        )
+
+    def render_form(self, pedido, lineas, valores=None):
+        # Al volver con errores se conserva lo que se había tecleado
+        valores = valores or {}
+        for linea in lineas:
+            linea.valor_cantidad = valores.get(f'cantidad_{linea.pk}', linea.cantidad_por_recibir)
+            linea.valor_lote = valores.get(f'lote_{linea.pk}', '')
+            linea.valor_caducidad = valores.get(f'caducidad_{linea.pk}', '')
+        context = datos_centro(self.request)
+        context.update({'pedido': pedido, 'lineas': lineas})
+        return render(self.request, self.template_name, context)
+
+    def get(self, request, *args, **kwargs):
+        pedido = self.get_pedido()
+        if pedido.estado not in ('pendiente', 'encamino', 'parcial'):
+            messages.error(request, f'El pedido #{pedido.pk} no está pendiente de recepción.')
+            return redirect('pedidos:listado_pedidos')
+        return self.render_form(pedido, list(self.get_lineas(pedido)))
+
+    def post(self, request, *args, **kwargs):
+        pedido = self.get_pedido()
+        if pedido.estado not in ('pendiente', 'encamino', 'parcial'):
+            messages.error(request, f'El pedido #{pedido.pk} no está pendiente de recepción.')
+            return redirect('pedidos:listado_pedidos')
+
+        lineas = list(self.get_lineas(pedido))
+        entradas = {}
+        for linea in lineas:
+            try:
+                cantidad = Decimal(request.POST.get(f'cantidad_{linea.pk}') or 0)
+            except InvalidOperation:
+                cantidad = None
+            # Decimal acepta 'NaN' e 'Infinity': no son cantidades
+            if cantidad is None or not cantidad.is_finite():
+                messages.error(request, f'Cantidad no válida en {linea.producto().nombre}.')
+                return self.render_form(pedido, lineas, request.POST)
+            if cantidad > 0:
+                # parse_date devuelve None si el formato no encaja y lanza ValueError si la fecha no existe (30/02)
+                try:
+                    fecha_caducidad = parse_date(request.POST.get(f'caducidad_{linea.pk}', ''))
+                except ValueError:
+                    messages.error(request, f'Fecha de caducidad no válida en {linea.producto().nombre}.')
+                    return self.render_form(pedido, lineas, request.POST)
+                entradas[linea.pk] = {
+                    'cantidad': cantidad,
+                    'lote': request.POST.get(f'lote_{linea.pk}', '').strip(),
+                    'fecha_caducidad': fecha_caducidad,
+                }
+
+        if not entradas:
+            messages.warning(request, 'No se ha indicado ninguna cantidad recibida.')
+            return self.render_form(pedido, lineas, request.POST)
+
+        try:
+            recibir_pedido(pedido, entradas)
+        except ValueError as e:
+            messages.error(request, str(e))
+            return self.render_form(pedido, lineas, request.POST)
+
+        messages.success(request, f'Pedido #{pedido.pk}: {len(entradas)} líneas recepcionadas ({pedido.get_estado_display()}).')
+        return redirect('pedidos:detalle_pedido', pk=pedido.pk)
+
+
+######################################################################################
+###########################   EXPORTAR PEDIDOS    ####################################
+######################################################################################  
+ 
+    
+def exportar_pedido_pdf(request, pk):
+    pedido = get_object_or_404(pedidos_para_pdf(Pedido.objects.all()), pk=pk)
+
+    response = HttpResponse(pdf_pedido(pedido, request.build_absolute_uri()), content_type='application/pdf')
+    response['Content-Disposition'] = f'inline; filename=pedido_{pedido.id}.pdf'
+    return response
+
+
+class ExportarPedidosPdfView(PermisoMixin, LoginRequiredMixin, View):
+    """
+    PDF de varios pedidos a la vez (por defecto, los pendientes de un
+    proveedor): uno por página en un único documento, o un ZIP con un PDF por
+    pedido generado en paralelo (formato=zip).
+    """
+    permiso_modulo = "Pedido"
+    permiso_accion = "read"
+
+    def get(self, request, *args, **kwargs):
+        user_profile = perfil_o_404(request)
+        pedidos = Pedido.objects.filter(centro=user_profile.centro)
+
+        # Ids no numéricos se ignoran en lugar de romper la consulta
+        proveedor = request.GET.get('proveedor', '')
+        if proveedor.isdigit():
+            pedidos = pedidos.filter(proveedor_id=proveedor)
+        ids = [pk for pk in request.GET.getlist('pedido') if pk.isdigit()]
+        if ids:
+            pedidos = pedidos.filter(pk__in=ids)
+        estado = request.GET.get('estado', 'pendientes')
+        if estado == 'pendientes':
+            pedidos = pedidos.filter(estado__in=['pendiente', 'encamino', 'parcial'])
+        elif estado:
+            pedidos = pedidos.filter(estado=estado)
+
+        pedidos = list(pedidos_para_pdf(pedidos).order_by('proveedor__nombre', 'fecha_pedido', 'id'))
+        if not pedidos:
+            messages.info(request, 'No hay pedidos que exportar con esos filtros.')
+            volver = request.META.get('HTTP_REFERER')
+            if not url_has_allowed_host_and_scheme(volver, allowed_hosts={request.get_host()}, require_https=request.is_secure()):
+                volver = 'pedidos:listado_pedidos'
+            return redirect(volver)
+
+        base_url = request.build_absolute_uri()
+        if request.GET.get('formato') == 'zip':
+            response = HttpResponse(zip_pedidos(pedidos, base_url), content_type='application/zip')
+            response['Content-Disposition'] = 'attachment; filename=pedidos.zip'
+            return response
+
+        response = HttpResponse(pdf_pedidos(pedidos, base_url), content_type='application/pdf')
+        response['Content-Disposition'] = 'inline; filename=pedidos.pdf'
+        return response
+
+
+
+def exportar_pedido_excel(request, pk):
+    pedido = get_object_or_404(Pedido, pk=pk)
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = f'Pedido #{pedido.id}'
+
+    ws.append(['Producto', 'Cantidad', 'Unidad', 'Precio Unitario', 'Total Línea'])
+
+    total = 0
+    for d in pedido.detalles.select_related('alimento', 'utensilio', 'unidad'):
+        producto = d.alimento.nombre if d.alimento else d.utensilio.nombre
+        total_linea = d.total_linea()
+        total += total_linea
+        ws.append([
+            producto,
+            float(d.cantidad),
+            str(d.unidad),
+            float(d.precio_unitario),
+            float(total_linea)
+        ])
+
+    ws.append([])
+    ws.append(['', '', '', 'Total Pedido:', float(total)])
+
+    response = HttpResponse(
+        content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    )
+    response['Content-Disposition'] = f'attachment; filename=pedido_{pedido.id}.xlsx'
+    wb.save(response)
+    return response
+
+
+class ExportarPedidosView(PermisoMixin, LoginRequiredMixin, View):
+    """
+    Exporta las líneas de todos los pedidos del centro filtradas por mes,
+    proveedor y estado, en CSV (en streaming) o XLSX (openpyxl write_only),
+    opcionalmente con subtotales por proveedor y/o mes. La memoria no
+    depende del número de líneas.
+    """
+    permiso_modulo = "Pedido"
+    permiso_accion = "read"
+
+    def get(self, request, *args, **kwargs):
+        user_profile = perfil_o_404(request)
+        if not user_profile.centro:
+            messages.error(request, 'No está asociado a ningún centro.')
+            return redirect('pedidos:listado_pedidos')
+
+        desde = hasta = None
+        mes = request.GET.get('mes', '')  # AAAA-MM (input type="month")
+        if mes:
+            try:
+                desde = parse_date(f'{mes}-01')
+            except ValueError:  # Bien formado pero inexistente (2025-13)
+                desde = None
+            if not desde:
+                messages.error(request, 'Mes no válido.')
+                return redirect('pedidos:listado_pedidos')
+            hasta = date(desde.year + desde.month // 12, desde.month % 12 + 1, 1)
+
+        agrupar = request.GET.get('agrupar', '')
+        if agrupar not in AGRUPACIONES:
+            agrupar = ''
+
+        # Se valida aquí: un error dentro del streaming cortaría la descarga a medias
+        proveedor = request.GET.get('proveedor', '')
+        lineas = lineas_exportacion(
+            user_profile.centro,
+            desde=desde,
+            hasta=hasta,
+            proveedor=int(proveedor) if proveedor.isdigit() else None,
+            estado=request.GET.get('estado') or None,
+            agrupar=agrupar,
+        )
+        filas = filas_exportacion(lineas, agrupar)
+        nombre = f"pedidos_{mes or 'todos'}"
+
+        if request.GET.get('formato') == 'xlsx':
+            return FileResponse(
+                xlsx_solo_escritura(filas),
+                as_attachment=True,
+                filename=f'{nombre}.xlsx',
+                content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+            )
+
+        response = StreamingHttpResponse(csv_en_streaming(filas), content_type='text/csv; charset=utf-8')
+        response['Content-Disposition'] = f'attachment; filename={nombre}.csv'
+        return response
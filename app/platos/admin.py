@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Receta, AlimentoPlato, Plato, TipoPlato, Salsa, AlimentoSalsa, EtiquetaPlato, TextoModo
+from .models import Receta, AlimentoPlato, Plato, TipoPlato, Salsa, AlimentoSalsa, EtiquetaPlato, TextoModo, ConsumoLote
 
 admin.site.register(AlimentoPlato)
 admin.site.register(Receta)
@@ -9,5 +9,6 @@ admin.site.register(Salsa)
 admin.site.register(AlimentoSalsa)
 admin.site.register(EtiquetaPlato)
 admin.site.register(TextoModo)
+admin.site.register(ConsumoLote)
 
 # Register your models here.
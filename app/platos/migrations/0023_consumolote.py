@@ -0,0 +1,34 @@
+# Generated by Django 5.2.6 on 2026-10-19 19:02
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashuser', '0021_alimento_stock_util'),
+        ('platos', '0022_alter_textomodo_nombre'),
+        ('recepcion', '0013_stocklote_centro_lote_idx'),
+        ('super', '0003_permiso'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConsumoLote',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cantidad', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('alimento', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='dashuser.alimento')),
+                ('centro', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='super.centros')),
+                ('etiqueta', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='consumos_lote', to='platos.etiquetaplato')),
+                ('stock_lote', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='consumos', to='recepcion.stocklote')),
+            ],
+            options={
+                'verbose_name': 'Consumo de lote',
+                'verbose_name_plural': 'Consumos de lote',
+                'indexes': [models.Index(fields=['stock_lote', 'etiqueta'], name='consumolote_lote_etiq_idx')],
+                'constraints': [models.UniqueConstraint(fields=('etiqueta', 'stock_lote'), name='consumolote_etiqueta_lote_uniq')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-19 19:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('platos', '0023_consumolote'),
+        ('super', '0003_permiso'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='etiquetaplato',
+            index=models.Index(fields=['centro', 'fecha'], name='etiqueta_centro_fecha_idx'),
+        ),
+    ]
@@ -9,6 +9,24 @@ from datetime import timedelta
 from app.dashuser.models import Alimento, UnidadDeMedida, Alergenos
 
 
+def cantidad_para_stock(cantidad, abreviatura, porcentaje_uso):
+    """
+    Cantidad de receta -> cantidad a descontar del stock: normaliza g -> kg y
+    ml -> L y la corrige con el porcentaje_uso (merma) del alimento.
+    """
+    cantidad = Decimal(cantidad)
+    abreviatura = abreviatura.lower()
+
+    # Normalizar unidades
+    if abreviatura in ["g", "gramo", "gramos"]:
+        cantidad /= Decimal(1000)  # g → kg
+    elif abreviatura in ["ml", "mililitro", "mililitros"]:
+        cantidad /= Decimal(1000)  # ml → L
+
+    # Aplicar porcentaje de uso (merma)
+    return cantidad / (Decimal(porcentaje_uso) / Decimal(100))
+
+
 class TextoModo(ModeloBaseCentro):
     nombre = models.CharField(max_length=100)
     texto = models.TextField(blank=True, null=True)
@@ -155,50 +173,74 @@ class Plato(ModeloBaseCentro):
 
         return ingredientes
     
-    def descontar_stock_por_produccion(self, cantidad_platos=1):
+    def descontar_stock_por_produccion(self, cantidad_platos=1, asignador=None):
         """
         Resta del stock todos los ingredientes del plato y de la salsa (si existe)
         cuando se produce, normalizando gramos a kg y ml a litros.
+
+        Los lotes se consumen FEFO. Para producir muchas etiquetas seguidas se
+        puede pasar un AsignadorFEFO compartido y guardarlo al final; si no, se
+        usa uno propio que se guarda aquí. Si falla un ingrediente, el
+        asignador y el resumen de auditoría vuelven a como estaban, igual que
+        el stock. Devuelve [(lote, cantidad)].
         """
-        with transaction.atomic():
-            # Ingredientes del plato
-            for ingrediente in self.ingredientes.all():
-                self._descontar_ingrediente_stock(ingrediente.alimento,
-                                                  ingrediente.cantidad * cantidad_platos,
-                                                  ingrediente.unidad_medida)
-
-            # Ingredientes de la salsa (si existe)
-            if self.salsa:
-                for ingrediente in self.salsa.ingredientes.all():
-                    self._descontar_ingrediente_stock(ingrediente.alimento,
-                                                      ingrediente.cantidad * cantidad_platos,
-                                                      ingrediente.unidad_medida)
-
-    def _descontar_ingrediente_stock(self, alimento, cantidad, unidad_medida):
+        from app.core.auditoria import parte_de_lote
+        from app.recepcion.fefo import AsignadorFEFO
+
+        propio = asignador is None
+        if propio:
+            asignador = AsignadorFEFO()
+
+        marca = asignador.marca()
+        try:
+            with transaction.atomic(), parte_de_lote():
+                asignaciones = self._descontar_ingredientes(cantidad_platos, asignador)
+                if propio:
+                    asignador.guardar()
+                    from app.pedidos.alertas import programar_evaluacion
+                    programar_evaluacion(asignador.alimentos_afectados())
+        except Exception:
+            asignador.deshacer(marca)
+            raise
+
+        return asignaciones
+
+    def _descontar_ingredientes(self, cantidad_platos, asignador):
+        asignaciones = []
+        # Ingredientes del plato
+        for ingrediente in self.ingredientes.all():
+            asignaciones += self._descontar_ingrediente_stock(ingrediente.alimento,
+                                                              ingrediente.cantidad * cantidad_platos,
+                                                              ingrediente.unidad_medida,
+                                                              asignador)
+
+        # Ingredientes de la salsa (si existe)
+        if self.salsa:
+            for ingrediente in self.salsa.ingredientes.all():
+                asignaciones += self._descontar_ingrediente_stock(ingrediente.alimento,
+                                                                  ingrediente.cantidad * cantidad_platos,
+                                                                  ingrediente.unidad_medida,
+                                                                  asignador)
+        return asignaciones
+
+    def _descontar_ingrediente_stock(self, alimento, cantidad, unidad_medida, asignador):
         """
         Descarta stock de un alimento según la unidad de medida y cantidad.
         Normaliza g → kg y ml → L, y aplica el porcentaje_uso (merma).
         """
-        abreviatura = unidad_medida.abreviatura.lower()
-        cantidad = Decimal(cantidad)
-
-        # Normalizar unidades
-        if abreviatura in ["g", "gramo", "gramos"]:
-            cantidad /= Decimal(1000)  # g → kg
-        elif abreviatura in ["ml", "mililitro", "mililitros"]:
-            cantidad /= Decimal(1000)  # ml → L
-
-        # Aplicar porcentaje de uso (merma)
         porcentaje_uso = Decimal(alimento.porcentaje_uso or 100)
         if porcentaje_uso <= 0:
             raise ValueError(f"El alimento '{alimento.nombre}' tiene porcentaje_uso inválido.")
         
         # Cantidad real a descontar del stock
-        cantidad_a_descontar = cantidad / (porcentaje_uso / Decimal(100))
+        cantidad_a_descontar = cantidad_para_stock(cantidad, unidad_medida.abreviatura, porcentaje_uso)
 
         # Restar del stock_actual y recalcular stock_util
         alimento.actualizar_stock(-cantidad_a_descontar)
 
+        # Consumir los lotes que antes caducan
+        return asignador.asignar(alimento, cantidad_a_descontar)
+
 class AlimentoPlato(ModeloBaseCentro):
     plato = models.ForeignKey(Plato, on_delete=models.CASCADE, related_name='ingredientes')
     alimento = models.ForeignKey(Alimento, on_delete=models.CASCADE)
@@ -251,6 +293,10 @@ class EtiquetaPlato(ModeloBaseCentro):
     class Meta:
         verbose_name = "Etiqueta de Plato"
         verbose_name_plural = "Etiquetas de Platos"
+        indexes = [
+            # Histórico de producción por centro (previsión de demanda)
+            models.Index(fields=['centro', 'fecha'], name='etiqueta_centro_fecha_idx'),
+        ]
 
     def save(self, *args, **kwargs):
         # Asegurarnos de tener fecha completa
@@ -307,6 +353,32 @@ class EtiquetaPlato(ModeloBaseCentro):
         return self.lote
 
 
+class ConsumoLote(ModeloBaseCentro):
+    """
+    Arista de trazabilidad: cantidad de un lote de proveedor (StockLote)
+    consumida al producir una etiqueta. Se recorre en los dos sentidos:
+    lote de proveedor -> etiquetas (retirada) y etiqueta -> lotes (reclamación).
+    """
+    etiqueta = models.ForeignKey(EtiquetaPlato, on_delete=models.CASCADE, related_name='consumos_lote')
+    stock_lote = models.ForeignKey('recepcion.StockLote', on_delete=models.PROTECT, related_name='consumos')
+    alimento = models.ForeignKey(Alimento, on_delete=models.CASCADE)
+    cantidad = models.DecimalField(max_digits=10, decimal_places=2)
+
+    class Meta:
+        verbose_name = 'Consumo de lote'
+        verbose_name_plural = 'Consumos de lote'
+        constraints = [
+            models.UniqueConstraint(fields=['etiqueta', 'stock_lote'], name='consumolote_etiqueta_lote_uniq'),
+        ]
+        indexes = [
+            # Retirada: del lote de proveedor a sus etiquetas sin tocar la tabla
+            models.Index(fields=['stock_lote', 'etiqueta'], name='consumolote_lote_etiq_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.cantidad} de {self.stock_lote} en {self.etiqueta.lote}"
+
+
 class DatosNuticionales(ModeloBaseCentro):
     plato = models.OneToOneField(Plato, on_delete=models.CASCADE, related_name='nutricion')
     energia = models.DecimalField(default=0, max_digits=6, decimal_places=2, blank=True)
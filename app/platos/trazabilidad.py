@@ -0,0 +1,83 @@
+from django.db.models import Sum, Count, Min, Max
+from .models import ConsumoLote, EtiquetaPlato
+
+
+def consumos_de_produccion(etiqueta, asignaciones):
+    """
+    Convierte las asignaciones FEFO de una etiqueta [(lote, cantidad)] en
+    aristas ConsumoLote sin guardar, sumando las que caen en el mismo lote
+    (un alimento presente en el plato y en su salsa).
+    """
+    aristas = {}
+    for lote, cantidad in asignaciones:
+        if lote.pk in aristas:
+            aristas[lote.pk].cantidad += cantidad
+        else:
+            aristas[lote.pk] = ConsumoLote(
+                centro_id=etiqueta.centro_id,
+                etiqueta=etiqueta,
+                stock_lote=lote,
+                alimento_id=lote.alimento_id,
+                cantidad=cantidad,
+            )
+    return list(aristas.values())
+
+
+def consumos_de_lote_proveedor(centro, lote, alimento=None, proveedor=None):
+    """Aristas que salen de un lote de proveedor (por su código de lote)."""
+    consumos = ConsumoLote.objects.filter(centro=centro, stock_lote__centro=centro, stock_lote__lote=lote)
+    if alimento:
+        consumos = consumos.filter(alimento=alimento)
+    if proveedor:
+        consumos = consumos.filter(stock_lote__recepcion__proveedor=proveedor)
+    return consumos
+
+
+def etiquetas_de_lote_proveedor(centro, lote, alimento=None, proveedor=None):
+    """
+    Trazabilidad hacia delante: etiquetas producidas con un lote de proveedor.
+    Se resuelve con un semijoin sobre los índices (centro, lote) de StockLote y
+    (stock_lote, etiqueta) de ConsumoLote, sin DISTINCT sobre las etiquetas.
+    """
+    consumos = consumos_de_lote_proveedor(centro, lote, alimento, proveedor)
+    return (
+        EtiquetaPlato.objects
+        .filter(id__in=consumos.values('etiqueta_id'))
+        .select_related('plato')
+        .order_by('-fecha')
+    )
+
+
+def resumen_retirada(centro, lote, alimento=None, proveedor=None):
+    """Totales de una retirada agrupados por plato, en una sola consulta."""
+    return (
+        consumos_de_lote_proveedor(centro, lote, alimento, proveedor)
+        .values('etiqueta__plato__nombre')
+        .annotate(
+            raciones=Count('etiqueta', distinct=True),
+            cantidad=Sum('cantidad'),
+            primera=Min('etiqueta__fecha'),
+            ultima=Max('etiqueta__fecha'),
+        )
+        .order_by('etiqueta__plato__nombre')
+    )
+
+
+def lotes_de_etiquetas(etiquetas):
+    """
+    Trazabilidad hacia atrás: lotes de proveedor que hay detrás de una o varias
+    etiquetas (una ración reclamada o un lote de producción entero).
+    """
+    return (
+        ConsumoLote.objects
+        .filter(etiqueta__in=etiquetas)
+        .values(
+            'stock_lote_id',
+            'stock_lote__lote',
+            'stock_lote__fecha_caducidad',
+            'alimento__nombre',
+            'stock_lote__recepcion__proveedor__nombre',
+        )
+        .annotate(cantidad=Sum('cantidad'), raciones=Count('etiqueta', distinct=True))
+        .order_by('alimento__nombre', 'stock_lote__fecha_caducidad')
+    )
@@ -40,6 +40,7 @@ urlpatterns = [
     
     path('lotes/historicos/', LotesResumenListView.as_view(), name='LotesResumenListView'),
     path('lote/<str:lote>/', LoteDetalleListView.as_view(), name='lote_detalle'),
+    path('trazabilidad/lote-proveedor/', TrazabilidadLoteProveedorView.as_view(), name='trazabilidad_lote'),
     path('reimprimir/<int:pk>/', views.reimprimir_etiqueta, name='reimprimir_etiqueta'),
     path('reimprimir-etiquetas/', views.reimprimir_etiquetas, name='reimprimir_etiquetas'),
 ]   
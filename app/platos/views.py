@@ -1,5 +1,6 @@
 from django.shortcuts import render, redirect
 from app.super.models import UserProfile
+from app.core.middleware.centro import perfil_o_404, perfil_de_request
 from django.utils.timezone import localtime
 from django.views.generic import ListView, CreateView, UpdateView, DeleteView, DetailView
 from django.contrib import messages
@@ -19,7 +20,11 @@ from app.dashuser.views import datos_centro
 from django.core.exceptions import ObjectDoesNotExist
 from django.contrib.auth.mixins import LoginRequiredMixin
 from app.core.mixins import PaginationMixin, PermisoMixin
-from .models import TipoPlato, Plato, Salsa, Receta, EtiquetaPlato, TextoModo, NuticionalesSalsa, DatosNuticionales
+from .models import TipoPlato, Plato, Salsa, Receta, EtiquetaPlato, TextoModo, NuticionalesSalsa, DatosNuticionales, AlimentoPlato, AlimentoSalsa, ConsumoLote
+from .trazabilidad import consumos_de_produccion, etiquetas_de_lote_proveedor, resumen_retirada, lotes_de_etiquetas
+from app.recepcion.fefo import AsignadorFEFO
+from app.pedidos.alertas import programar_evaluacion
+from app.core.auditoria import auditoria_en_lote
 from .forms import TipoPlatoForm, PlatoForm, AlimentoPlatoFormSet, SalsaForm, AlimentoSalsaFormSet, RecetaForm, GenerarEtiquetaForm, DatosNuticionalesForm, TextoModoForm
 import qrcode
 import json
@@ -42,7 +47,7 @@ class TipoPlatoList(PermisoMixin, PaginationMixin, LoginRequiredMixin, ListView)
 
     def get_queryset(self):
         try:
-            user_profile = UserProfile.objects.filter(user=self.request.user).first()
+            user_profile = perfil_de_request(self.request)
             if user_profile and user_profile.centro:
                 centro = user_profile.centro
                 queryset = TipoPlato.objects.filter(centro=centro).order_by('id')
@@ -78,7 +83,7 @@ class TipoPlatoCreate(PermisoMixin, LoginRequiredMixin, CreateView):
     success_url = reverse_lazy('platos:TipoPlatoList')
 
     def form_valid(self, form):
-        user_profile = get_object_or_404(UserProfile, user=self.request.user)
+        user_profile = perfil_o_404(self.request)
         if user_profile.centro:
             form.instance.centro = user_profile.centro
             messages.success(self.request, 'Tipo de plato creado correctamente.')
@@ -108,7 +113,7 @@ class TipoPlatoUpdate(PermisoMixin, LoginRequiredMixin, UpdateView):
         return reverse_lazy('platos:TipoPlatoList')
 
     def get_queryset(self):
-        user_profile = get_object_or_404(UserProfile, user=self.request.user)
+        user_profile = perfil_o_404(self.request)
         if not user_profile.centro:
             messages.error(self.request, 'No está asociado a ningún centro.')
             return TipoPlato.objects.none()
@@ -136,7 +141,7 @@ class TipoPlatoDelete(PermisoMixin, LoginRequiredMixin, DeleteView):
 
     def get_queryset(self):
         """Filtra los tipos de plato por centro del usuario"""
-        user_profile = get_object_or_404(UserProfile, user=self.request.user)
+        user_profile = perfil_o_404(self.request)
         if not user_profile.centro:
             messages.error(self.request, 'No está asociado a ningún centro.')
             return TipoPlato.objects.none()
@@ -169,7 +174,7 @@ class TextoModoList(PermisoMixin, PaginationMixin, LoginRequiredMixin, ListView)
 
     def get_queryset(self):
         try:
-            user_profile = UserProfile.objects.filter(user=self.request.user).first()
+            user_profile = perfil_de_request(self.request)
             if user_profile and user_profile.centro:
                 centro = user_profile.centro
                 queryset = TextoModo.objects.filter(centro=centro).order_by('id')
@@ -205,7 +210,7 @@ class TextoModoCreate(PermisoMixin, LoginRequiredMixin, CreateView):
     success_url = reverse_lazy('platos:TextoModoList')
 
     def form_valid(self, form):
-        user_profile = get_object_or_404(UserProfile, user=self.request.user)
+        user_profile = perfil_o_404(self.request)
         if user_profile.centro:
             form.instance.centro = user_profile.centro
             messages.success(self.request, 'Texto de modo de uso creado correctamente.')
@@ -234,7 +239,7 @@ class TextoModoUpdate(LoginRequiredMixin, UpdateView):
         return reverse_lazy('platos:TextoModoList')
 
     def get_queryset(self):
-        user_profile = get_object_or_404(UserProfile, user=self.request.user)
+        user_profile = perfil_o_404(self.request)
         if not user_profile.centro:
             messages.error(self.request, 'No está asociado a ningún centro.')
             return TextoModo.objects.none()
@@ -262,7 +267,7 @@ class TextoModoDelete(PermisoMixin, LoginRequiredMixin, DeleteView):
 
     def get_queryset(self):
         """Filtra los tipos de plato por centro del usuario"""
-        user_profile = get_object_or_404(UserProfile, user=self.request.user)
+        user_profile = perfil_o_404(self.request)
         if not user_profile.centro:
             messages.error(self.request, 'No está asociado a ningún centro.')
             return TextoModo.objects.none()
@@ -294,7 +299,7 @@ class PlatoList(PermisoMixin, PaginationMixin, LoginRequiredMixin, ListView):
 
     def get_queryset(self):
         try: 
-            user_profile = get_object_or_404(UserProfile, user=self.request.user)
+            user_profile = perfil_o_404(self.request)
             if user_profile.centro:
                 queryset = Plato.objects.filter(centro=user_profile.centro).order_by('nombre')
                 
@@ -352,7 +357,7 @@ class PlatoCreate(PermisoMixin, LoginRequiredMixin, CreateView):
         return context
 
     def form_valid(self, form):
-        user_profile = get_object_or_404(UserProfile, user=self.request.user)
+        user_profile = perfil_o_404(self.request)
         if not user_profile.centro:
             messages.error(self.request, 'No está asociado a ningún centro.')
             return self.form_invalid(form)
@@ -443,20 +448,17 @@ class PlatoUpdate(PermisoMixin, LoginRequiredMixin, UpdateView):
     context_object_name = 'plato'
 
     def get_queryset(self):
-        user_profile = get_object_or_404(UserProfile, user=self.request.user)
-        if user_profile.centro:
-            return Plato.objects.filter(centro=user_profile.centro)
-        return Plato.objects.none()
+        return Plato.objects.for_request(self.request)
 
     def get_form_kwargs(self):
         kwargs = super().get_form_kwargs()
-        user_profile = get_object_or_404(UserProfile, user=self.request.user)
+        user_profile = perfil_o_404(self.request)
         kwargs['centro'] = user_profile.centro
         return kwargs
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        user_profile = get_object_or_404(UserProfile, user=self.request.user)
+        user_profile = perfil_o_404(self.request)
         centro = user_profile.centro
 
         if self.request.POST:
@@ -487,7 +489,7 @@ class PlatoUpdate(PermisoMixin, LoginRequiredMixin, UpdateView):
         ingredientes_formset = context['ingredientes_formset']
 
         if ingredientes_formset.is_valid():
-            user_profile = get_object_or_404(UserProfile, user=self.request.user)
+            user_profile = perfil_o_404(self.request)
 
             # Guardar el plato
             self.object = form.save(commit=False)
@@ -573,10 +575,7 @@ class PlatoDetail(PermisoMixin, LoginRequiredMixin, DetailView):
     context_object_name = 'plato'
 
     def get_queryset(self):
-        user_profile = get_object_or_404(UserProfile, user=self.request.user)
-        if user_profile.centro:
-            return Plato.objects.filter(centro=user_profile.centro)
-        return Plato.objects.none()
+        return Plato.objects.for_request(self.request)
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -596,6 +595,10 @@ class PlatoDetail(PermisoMixin, LoginRequiredMixin, DetailView):
         # Datos Nutricionales (puede ser None si no los hemos creado aún)
         context['nutricion'] = getattr(self.object, 'nutricion', None)
 
+        # Historial de cambios del plato
+        from app.core.historial import historial_para
+        context['historial'] = historial_para(self.request, self.object)
+
         return context
 
 
@@ -610,11 +613,7 @@ class PlatoDelete(PermisoMixin, LoginRequiredMixin, DeleteView):
     context_object_name = 'plato'
 
     def get_queryset(self):
-        user_profile = get_object_or_404(UserProfile, user=self.request.user)
-        if user_profile.centro:
-            return Plato.objects.filter(centro=user_profile.centro)
-        else:
-            return Plato.objects.none()
+        return Plato.objects.for_request(self.request)
 
     def delete(self, request, *args, **kwargs):
         messages.success(self.request, 'Plato eliminado correctamente.')
@@ -634,7 +633,7 @@ class SalsaList(PermisoMixin, PaginationMixin, LoginRequiredMixin, ListView):
     paginate_by = 10
 
     def get_queryset(self):
-        user_profile = get_object_or_404(UserProfile, user=self.request.user)
+        user_profile = perfil_o_404(self.request)
         if user_profile.centro:
             queryset = Salsa.objects.filter(centro=user_profile.centro).order_by('nombre')
             
@@ -679,7 +678,7 @@ class SalsaCreate(PermisoMixin, LoginRequiredMixin, CreateView):
         return context
 
     def form_valid(self, form):
-        user_profile = get_object_or_404(UserProfile, user=self.request.user)
+        user_profile = perfil_o_404(self.request)
         if not user_profile.centro:
             messages.error(self.request, 'No está asociado a ningún centro.')
             return self.form_invalid(form)
@@ -768,14 +767,11 @@ class SalsaUpdate(PermisoMixin, LoginRequiredMixin, UpdateView):
     context_object_name = 'salsa'
 
     def get_queryset(self):
-        user_profile = get_object_or_404(UserProfile, user=self.request.user)
-        if user_profile.centro:
-            return Salsa.objects.filter(centro=user_profile.centro)
-        return Salsa.objects.none()
+        return Salsa.objects.for_request(self.request)
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        user_profile = get_object_or_404(UserProfile, user=self.request.user)
+        user_profile = perfil_o_404(self.request)
         centro = user_profile.centro
 
         if self.request.POST:
@@ -799,7 +795,7 @@ class SalsaUpdate(PermisoMixin, LoginRequiredMixin, UpdateView):
         ingredientes_formset = context['ingredientes_formset']
 
         if ingredientes_formset.is_valid():
-            user_profile = get_object_or_404(UserProfile, user=self.request.user)
+            user_profile = perfil_o_404(self.request)
             
             # Guardamos salsa
             self.object = form.save(commit=False)
@@ -872,10 +868,7 @@ class SalsaDetail(PermisoMixin, LoginRequiredMixin, DetailView):
     context_object_name = 'salsa'
 
     def get_queryset(self):
-        user_profile = get_object_or_404(UserProfile, user=self.request.user)
-        if user_profile.centro:
-            return Salsa.objects.filter(centro=user_profile.centro)
-        return Salsa.objects.none()
+        return Salsa.objects.for_request(self.request)
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -894,11 +887,7 @@ class SalsaDelete(PermisoMixin, LoginRequiredMixin, DeleteView):
     context_object_name = 'salsa'
 
     def get_queryset(self):
-        user_profile = get_object_or_404(UserProfile, user=self.request.user)
-        if user_profile.centro:
-            return Salsa.objects.filter(centro=user_profile.centro)
-        else:
-            return Salsa.objects.none()
+        return Salsa.objects.for_request(self.request)
 
     def delete(self, request, *args, **kwargs):
         messages.success(self.request, 'Salsa eliminada correctamente.')
@@ -966,13 +955,10 @@ class RecetaDetailView(PermisoMixin, LoginRequiredMixin, DetailView):
     context_object_name = 'receta'
 
     def get_queryset(self):
-        user_profile = get_object_or_404(UserProfile, user=self.request.user)
-        if user_profile.centro:
-            return Receta.objects.filter(centro=user_profile.centro)
-        return Receta.objects.none()
+        return Receta.objects.for_request(self.request)
 
     def get_object(self, queryset=None):
-        user_profile = get_object_or_404(UserProfile, user=self.request.user)
+        user_profile = perfil_o_404(self.request)
         return get_object_or_404(
             Receta,
             pk=self.kwargs['pk'],
@@ -1001,7 +987,7 @@ class RecetaUpdate(PermisoMixin, LoginRequiredMixin, UpdateView):
 
     def get_queryset(self):
         """Limita recetas solo del centro del usuario"""
-        user_profile = get_object_or_404(UserProfile, user=self.request.user)
+        user_profile = perfil_o_404(self.request)
         return Receta.objects.filter(centro=user_profile.centro)
 
     def get_object(self, queryset=None):
@@ -1054,10 +1040,7 @@ class EtiquetaDetail(PermisoMixin, LoginRequiredMixin, DetailView):
     context_object_name = 'plato'
 
     def get_queryset(self):
-        user_profile = get_object_or_404(UserProfile, user=self.request.user)
-        if user_profile.centro:
-            return Plato.objects.filter(centro=user_profile.centro)
-        return Plato.objects.none()
+        return Plato.objects.for_request(self.request)
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -1209,53 +1192,71 @@ def generar_etiqueta(request):
             etiquetas = EtiquetaPlato.objects.filter(id__in=selected_ids).select_related("plato")
             merger = PdfMerger()
 
-            for etiqueta in etiquetas:
-                plato = etiqueta.plato
-
-                # 🔹 Descontar stock de los ingredientes y de la salsa
-                try:
-                    plato.descontar_stock_por_produccion(cantidad_platos=1)
-                except ValueError as e:
-                    messages.error(request, f"Error al descontar stock para {plato.nombre}: {e}")
-                    continue  # Saltar a la siguiente etiqueta
-
-                ingredientes_info = plato.get_ingredientes_con_info()
-
-                # Recopilar alérgenos y trazas
-                todos_alergenos = set()
-                todas_trazas = set()
-                for ing in ingredientes_info:
-                    todos_alergenos.update(ing.get("alergenos", []))
-                    todas_trazas.update(ing.get("trazas", []))
-
-                # Generar QR
-                url = request.build_absolute_uri(reverse('platos:etiqueta_qr', args=[etiqueta.pk]))
-                qr_img = qrcode.make(url)
-                buffer = BytesIO()
-                qr_img.save(buffer, format="PNG")
-                qr_base64 = base64.b64encode(buffer.getvalue()).decode()
-
-                context = {
-                    "etiqueta": etiqueta,
-                    "ingredientes_info": ingredientes_info,
-                    "todos_alergenos": list(todos_alergenos),
-                    "todas_trazas": list(todas_trazas),
-                    "texto_modo_empleo": plato.texto.texto if plato.texto else "",
-                    "qr_base64": qr_base64,
-                }
-
-                # Generar PDF
-                html = render_to_string("platos/preview_etiqueta.html", context)
-                pdf_buffer = BytesIO()
-                html_obj = HTML(string=html, base_url=request.build_absolute_uri())
-                css = CSS(string='@page { size: 100mm auto; margin: 5mm; }')
-                html_obj.write_pdf(pdf_buffer, stylesheets=[css])
-                pdf_buffer.seek(0)
-                merger.append(pdf_buffer)
-
-                # Marcar etiqueta como impresa
-                etiqueta.impresa = True
-                etiqueta.save()
+            # 🔹 Un único asignador FEFO para todo el lote de impresión
+            asignador = AsignadorFEFO()
+            platos_ids = {etiqueta.plato_id for etiqueta in etiquetas}
+            asignador.precargar(
+                list(AlimentoPlato.objects.filter(plato_id__in=platos_ids).values_list("alimento_id", flat=True))
+                + list(AlimentoSalsa.objects.filter(salsa__plato__id__in=platos_ids).values_list("alimento_id", flat=True))
+            )
+            consumos = []
+
+            # 🔹 El descuento de stock no genera un registro por alimento, sino un resumen
+            with auditoria_en_lote(f"Producción de {len(selected_ids)} etiquetas", modelo="EtiquetaPlato"):
+                for etiqueta in etiquetas:
+                    plato = etiqueta.plato
+
+                    # 🔹 Descontar stock de los ingredientes y de la salsa
+                    try:
+                        asignaciones = plato.descontar_stock_por_produccion(cantidad_platos=1, asignador=asignador)
+                    except ValueError as e:
+                        messages.error(request, f"Error al descontar stock para {plato.nombre}: {e}")
+                        continue  # Saltar a la siguiente etiqueta
+
+                    # 🔹 Trazabilidad: qué lotes de proveedor lleva esta etiqueta
+                    consumos += consumos_de_produccion(etiqueta, asignaciones)
+
+                    ingredientes_info = plato.get_ingredientes_con_info()
+
+                    # Recopilar alérgenos y trazas
+                    todos_alergenos = set()
+                    todas_trazas = set()
+                    for ing in ingredientes_info:
+                        todos_alergenos.update(ing.get("alergenos", []))
+                        todas_trazas.update(ing.get("trazas", []))
+
+                    # Generar QR
+                    url = request.build_absolute_uri(reverse('platos:etiqueta_qr', args=[etiqueta.pk]))
+                    qr_img = qrcode.make(url)
+                    buffer = BytesIO()
+                    qr_img.save(buffer, format="PNG")
+                    qr_base64 = base64.b64encode(buffer.getvalue()).decode()
+
+                    context = {
+                        "etiqueta": etiqueta,
+                        "ingredientes_info": ingredientes_info,
+                        "todos_alergenos": list(todos_alergenos),
+                        "todas_trazas": list(todas_trazas),
+                        "texto_modo_empleo": plato.texto.texto if plato.texto else "",
+                        "qr_base64": qr_base64,
+                    }
+
+                    # Generar PDF
+                    html = render_to_string("platos/preview_etiqueta.html", context)
+                    pdf_buffer = BytesIO()
+                    html_obj = HTML(string=html, base_url=request.build_absolute_uri())
+                    css = CSS(string='@page { size: 100mm auto; margin: 5mm; }')
+                    html_obj.write_pdf(pdf_buffer, stylesheets=[css])
+                    pdf_buffer.seek(0)
+                    merger.append(pdf_buffer)
+
+                    # Marcar etiqueta como impresa
+                    etiqueta.impresa = True
+                    etiqueta.save()
+
+                asignador.guardar()
+            ConsumoLote.objects.bulk_create(consumos, batch_size=500, ignore_conflicts=True)
+            programar_evaluacion(asignador.alimentos_afectados())
 
             # Devolver PDF combinado
             response = HttpResponse(content_type="application/pdf")
@@ -1466,7 +1467,7 @@ class LotesResumenListView(PermisoMixin, PaginationMixin, LoginRequiredMixin, Li
         buscar = self.request.GET.get("buscar", "").strip().lower()
 
         # Recuperar etiquetas impresas del centro del usuario
-        user_profile = UserProfile.objects.filter(user=self.request.user).first()
+        user_profile = perfil_de_request(self.request)
         if user_profile and user_profile.centro:
             centro = user_profile.centro
             etiquetas = EtiquetaPlato.objects.filter(
@@ -1545,7 +1546,7 @@ class LoteDetalleListView(PermisoMixin, LoginRequiredMixin, ListView):
         lote = self.kwargs.get("lote")
 
         # Recuperar centro del usuario
-        user_profile = UserProfile.objects.filter(user=self.request.user).first()
+        user_profile = perfil_de_request(self.request)
         if user_profile and user_profile.centro:
             centro = user_profile.centro
             queryset = EtiquetaPlato.objects.filter(
@@ -1563,6 +1564,33 @@ class LoteDetalleListView(PermisoMixin, LoginRequiredMixin, ListView):
         # Pasamos el lote agrupado para mostrar en el título del modal
         lote = self.kwargs.get("lote")
         context['lote'] = lote
+        # Lotes de proveedor consumidos por las raciones de este lote
+        context['lotes_proveedor'] = lotes_de_etiquetas(self.object_list)
+        return context
+
+
+class TrazabilidadLoteProveedorView(PermisoMixin, PaginationMixin, LoginRequiredMixin, ListView):
+    """Retirada de un lote de proveedor: todas las raciones producidas con él."""
+    permiso_modulo = "EtiquetaPlato"
+    template_name = "platos/trazabilidad_lote.html"
+    context_object_name = "etiquetas"
+    paginate_by = 25
+
+    def get_queryset(self):
+        lote = self.request.GET.get("lote", "").strip()
+        user_profile = perfil_de_request(self.request)
+        if not lote or not (user_profile and user_profile.centro):
+            return EtiquetaPlato.objects.none()
+        self.centro = user_profile.centro
+        return etiquetas_de_lote_proveedor(self.centro, lote)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context.update(datos_centro(self.request))
+        lote = self.request.GET.get("lote", "").strip()
+        context["lote"] = lote
+        if lote and hasattr(self, "centro"):
+            context["resumen"] = resumen_retirada(self.centro, lote)
         return context
 
 
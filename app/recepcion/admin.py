@@ -1,7 +1,8 @@
 from django.contrib import admin
-from .models import TipoDeMerma, Merma
+from .models import TipoDeMerma, Merma, StockLote
 
 
 
 admin.site.register(TipoDeMerma),
-admin.site.register(Merma)
\ No newline at end of file
+admin.site.register(Merma)
+admin.site.register(StockLote)
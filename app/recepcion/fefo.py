@@ -0,0 +1,133 @@
+from collections import defaultdict
+from decimal import Decimal
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from .models import StockLote
+
+
+CENTIMO = Decimal('0.01')
+
+
+class AsignadorFEFO:
+    """
+    Reparte salidas de stock entre los lotes de cada alimento en orden FEFO
+    (primero el que antes caduca).
+
+    Los lotes de cada alimento se leen una sola vez y los descuentos se
+    acumulan en memoria hasta guardar(), que los aplica con un único
+    bulk_update. Imprimir 200 etiquetas cuesta así una consulta por alimento
+    distinto más una escritura, no una por etiqueta e ingrediente.
+
+    Como lo acumulado aún no está en la BD, si la producción de un plato
+    falla a medias hay que volver atrás con marca() / deshacer() (ver
+    Plato.descontar_stock_por_produccion).
+    """
+
+    def __init__(self, incluir_caducados=False):
+        self.incluir_caducados = incluir_caducados
+        self._lotes = {}                          # alimento_id -> [StockLote] en orden FEFO
+        self._lotes_por_id = {}
+        self._descuentos = defaultdict(Decimal)   # lote_id -> cantidad consumida
+        self._asignados = []                      # [(lote, cantidad)] en orden, para deshacer()
+
+    def precargar(self, alimento_ids):
+        """Carga en una consulta los lotes con stock de varios alimentos."""
+        pendientes = {a for a in alimento_ids if a not in self._lotes}
+        if not pendientes:
+            return
+        for alimento_id in pendientes:
+            self._lotes[alimento_id] = []
+
+        lotes = StockLote.objects.filter(alimento_id__in=pendientes).disponibles()
+        if not self.incluir_caducados:
+            lotes = lotes.filter(fecha_caducidad__gte=timezone.localdate())
+
+        for lote in lotes.orden_fefo():
+            self._lotes[lote.alimento_id].append(lote)
+            self._lotes_por_id[lote.pk] = lote
+
+    def asignar(self, alimento, cantidad):
+        """
+        Consume `cantidad` del alimento de sus lotes en orden FEFO.
+        Devuelve [(lote, cantidad)]. Lo que no cubran los lotes (stock anterior
+        al control por lotes) queda sin asignar.
+        """
+        alimento_id = getattr(alimento, 'pk', alimento)
+        self.precargar([alimento_id])
+
+        restante = Decimal(cantidad).quantize(CENTIMO)
+        asignaciones = []
+        for lote in self._lotes[alimento_id]:
+            if restante <= 0:
+                break
+            if lote.cantidad_disponible <= 0:
+                continue
+            tomado = min(lote.cantidad_disponible, restante)
+            lote.cantidad_disponible -= tomado
+            self._descuentos[lote.pk] += tomado
+            self._asignados.append((lote, tomado))
+            restante -= tomado
+            asignaciones.append((lote, tomado))
+        return asignaciones
+
+    def marca(self):
+        """Punto al que vuelve deshacer(): lo asignado hasta ahora."""
+        return len(self._asignados)
+
+    def deshacer(self, marca):
+        """Devuelve a los lotes lo asignado desde `marca` (su transacción se deshizo)."""
+        while len(self._asignados) > marca:
+            lote, tomado = self._asignados.pop()
+            lote.cantidad_disponible += tomado
+            self._descuentos[lote.pk] -= tomado
+
+    def alimentos_afectados(self):
+        """Ids de los alimentos que han pasado por este asignador."""
+        return list(self._lotes)
+
+    def guardar(self):
+        """Aplica los descuentos acumulados en una sola sentencia."""
+        # Se descuenta sobre el valor de la BD (F) para no pisar otras salidas concurrentes
+        cambios = [
+            StockLote(pk=lote_id, cantidad_disponible=F('cantidad_disponible') - cantidad)
+            for lote_id, cantidad in self._descuentos.items()
+            if cantidad
+        ]
+        if cambios:
+            with transaction.atomic():
+                StockLote.objects.bulk_update(cambios, ['cantidad_disponible'])
+        self._descuentos.clear()
+        self._asignados.clear()
+
+
+def consumir_fefo(alimento, cantidad, incluir_caducados=False):
+    """Salida puntual de stock (una merma, una producción suelta)."""
+    asignador = AsignadorFEFO(incluir_caducados=incluir_caducados)
+    asignaciones = asignador.asignar(alimento, cantidad)
+    asignador.guardar()
+    return asignaciones
+
+
+def devolver_stock(alimento, cantidad):
+    """
+    Reintegra cantidad a los lotes del alimento (corrección o borrado de una
+    merma), en orden FEFO y sin superar la cantidad inicial de cada lote.
+    """
+    restante = Decimal(cantidad).quantize(CENTIMO)
+    lotes = (
+        StockLote.objects
+        .filter(alimento=alimento, cantidad_disponible__lt=F('cantidad_inicial'))
+        .orden_fefo()
+    )
+    cambios = []
+    for lote in lotes:
+        if restante <= 0:
+            break
+        devuelto = min(lote.cantidad_inicial - lote.cantidad_disponible, restante)
+        cambios.append(StockLote(pk=lote.pk, cantidad_disponible=F('cantidad_disponible') + devuelto))
+        restante -= devuelto
+
+    if cambios:
+        with transaction.atomic():
+            StockLote.objects.bulk_update(cambios, ['cantidad_disponible'])
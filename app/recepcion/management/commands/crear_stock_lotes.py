@@ -0,0 +1,50 @@
+from decimal import Decimal
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from app.dashuser.models import Alimento
+from app.recepcion.models import Recepcion, StockLote
+
+
+class Command(BaseCommand):
+    help = (
+        "Crea los StockLote del stock existente a partir de las recepciones más "
+        "recientes de cada alimento, hasta cubrir su stock_actual."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--centro', type=int, help="Limitar a un centro (id)")
+
+    def handle(self, *args, **options):
+        alimentos = Alimento.objects.filter(stock_actual__gt=0).exclude(stock_lotes__isnull=False)
+        if options['centro']:
+            alimentos = alimentos.filter(centro_id=options['centro'])
+
+        creados = 0
+        for alimento in alimentos.iterator():
+            restante = alimento.stock_actual
+            nuevos = []
+            recepciones = Recepcion.objects.filter(alimento=alimento).order_by('-fecha_recepcion')
+            for recepcion in recepciones:
+                if restante <= 0:
+                    break
+                cantidad = recepcion.cantidad
+                if alimento.unidad_compra_id != alimento.unidad_uso_id and alimento.peso_unitario:
+                    cantidad *= alimento.peso_unitario
+                disponible = min(Decimal(cantidad), restante)
+                nuevos.append(StockLote(
+                    centro_id=recepcion.centro_id,
+                    alimento=alimento,
+                    recepcion=recepcion,
+                    lote=recepcion.lote,
+                    fecha_caducidad=recepcion.fecha_caducidad,
+                    cantidad_inicial=cantidad,
+                    cantidad_disponible=disponible,
+                    fecha_entrada=recepcion.fecha_recepcion,
+                ))
+                restante -= disponible
+
+            with transaction.atomic():
+                StockLote.objects.bulk_create(nuevos)
+            creados += len(nuevos)
+
+        self.stdout.write(self.style.SUCCESS(f"Lotes creados: {creados}"))
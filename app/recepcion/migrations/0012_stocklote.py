@@ -0,0 +1,37 @@
+# Generated by Django 5.2.6 on 2026-10-19 18:58
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashuser', '0021_alimento_stock_util'),
+        ('recepcion', '0011_alter_recepcion_proveedor'),
+        ('super', '0003_permiso'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockLote',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('lote', models.CharField(max_length=50)),
+                ('fecha_caducidad', models.DateField()),
+                ('cantidad_inicial', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('cantidad_disponible', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('fecha_entrada', models.DateTimeField(default=django.utils.timezone.now)),
+                ('alimento', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_lotes', to='dashuser.alimento')),
+                ('centro', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='super.centros')),
+                ('recepcion', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='stock_lote', to='recepcion.recepcion')),
+            ],
+            options={
+                'verbose_name': 'Lote en stock',
+                'verbose_name_plural': 'Lotes en stock',
+                'ordering': ['fecha_caducidad', 'fecha_entrada'],
+                'indexes': [models.Index(condition=models.Q(('cantidad_disponible__gt', 0)), fields=['centro', 'fecha_caducidad'], name='stocklote_centro_cad_idx'), models.Index(condition=models.Q(('cantidad_disponible__gt', 0)), fields=['alimento', 'fecha_caducidad', 'fecha_entrada'], name='stocklote_fefo_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.6 on 2026-10-19 19:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashuser', '0021_alimento_stock_util'),
+        ('recepcion', '0012_stocklote'),
+        ('super', '0003_permiso'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='stocklote',
+            index=models.Index(fields=['centro', 'lote'], name='stocklote_centro_lote_idx'),
+        ),
+    ]
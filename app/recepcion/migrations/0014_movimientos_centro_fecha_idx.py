@@ -0,0 +1,27 @@
+# Generated by Django 5.2.6 on 2026-10-19 19:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashuser', '0021_alimento_stock_util'),
+        ('recepcion', '0013_stocklote_centro_lote_idx'),
+        ('super', '0003_permiso'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='ajusteinventario',
+            index=models.Index(fields=['centro', '-fecha', '-id'], name='ajuste_centro_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='merma',
+            index=models.Index(fields=['centro', '-fecha', '-id'], name='merma_centro_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recepcion',
+            index=models.Index(fields=['centro', '-fecha_recepcion', '-id'], name='recepcion_centro_fecha_idx'),
+        ),
+    ]
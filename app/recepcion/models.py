@@ -2,8 +2,9 @@ from django.db import models
 from django.utils import timezone
 from django.db import transaction
 from django.db.models import F
+from datetime import timedelta
 from app.dashuser.models import Alimento, UnidadDeMedida
-from app.super.models import ModeloBaseCentro, UserProfile
+from app.super.models import ModeloBaseCentro, CentroScopedQuerySet, UserProfile
 
 
 class Proveedor(ModeloBaseCentro):
@@ -48,6 +49,10 @@ class Recepcion(ModeloBaseCentro):
         ordering = ['-fecha_recepcion']
         verbose_name = "Recepción"
         verbose_name_plural = "Recepciones"
+        indexes = [
+            # Listado de movimientos del centro (paginación por fecha, id)
+            models.Index(fields=['centro', '-fecha_recepcion', '-id'], name='recepcion_centro_fecha_idx'),
+        ]
 
     def __str__(self):
         return f"{self.alimento.nombre} - {self.lote} ({self.proveedor.nombre})"
@@ -89,6 +94,92 @@ class Recepcion(ModeloBaseCentro):
             # Guardamos cambios finales
             alimento.save(update_fields=['stock_util', 'precio_medio'])
 
+            # 4️⃣ Alta del lote para el consumo FEFO
+            StockLote.objects.update_or_create(
+                recepcion=self,
+                defaults={
+                    'centro_id': self.centro_id,
+                    'alimento': alimento,
+                    'lote': self.lote,
+                    'fecha_caducidad': self.fecha_caducidad,
+                    'cantidad_inicial': cantidad_entrada,
+                    'cantidad_disponible': cantidad_entrada,
+                },
+            )
+
+            # 5️⃣ Reevaluar su alerta de reposición
+            from app.pedidos.alertas import programar_evaluacion
+            programar_evaluacion([alimento.pk])
+
+
+
+class StockLoteQuerySet(CentroScopedQuerySet):
+
+    def disponibles(self):
+        """Lotes con cantidad pendiente de consumir."""
+        return self.filter(cantidad_disponible__gt=0)
+
+    def orden_fefo(self):
+        """Primero el que antes caduca; a igualdad, el que antes entró."""
+        return self.order_by('fecha_caducidad', 'fecha_entrada', 'id')
+
+    def proximos_a_caducar(self, centro, horas=48):
+        """
+        Lotes con stock del centro que caducan en las próximas `horas`
+        (incluye los ya caducados). Usa el índice (centro, fecha_caducidad).
+        """
+        limite = (timezone.now() + timedelta(hours=horas)).date()
+        return (
+            self.filter(centro=centro, fecha_caducidad__lte=limite)
+            .disponibles()
+            .select_related('alimento')
+            .orden_fefo()
+        )
+
+
+class StockLote(ModeloBaseCentro):
+    """
+    Existencias de un alimento por lote de proveedor. Se alimenta de las
+    recepciones y se consume FEFO (first-expired-first-out) desde la
+    producción y las mermas. La suma de cantidad_disponible de un alimento
+    acompaña a Alimento.stock_actual, en la misma unidad (unidad de uso).
+    """
+    alimento = models.ForeignKey(Alimento, on_delete=models.CASCADE, related_name='stock_lotes')
+    recepcion = models.OneToOneField(Recepcion, on_delete=models.SET_NULL, null=True, blank=True, related_name='stock_lote')
+    lote = models.CharField(max_length=50)
+    fecha_caducidad = models.DateField()
+    cantidad_inicial = models.DecimalField(max_digits=10, decimal_places=2)
+    cantidad_disponible = models.DecimalField(max_digits=10, decimal_places=2)
+    fecha_entrada = models.DateTimeField(default=timezone.now)
+
+    objects = StockLoteQuerySet.as_manager()
+
+    class Meta:
+        ordering = ['fecha_caducidad', 'fecha_entrada']
+        verbose_name = "Lote en stock"
+        verbose_name_plural = "Lotes en stock"
+        indexes = [
+            models.Index(
+                fields=['centro', 'fecha_caducidad'],
+                condition=models.Q(cantidad_disponible__gt=0),
+                name='stocklote_centro_cad_idx',
+            ),
+            models.Index(
+                fields=['alimento', 'fecha_caducidad', 'fecha_entrada'],
+                condition=models.Q(cantidad_disponible__gt=0),
+                name='stocklote_fefo_idx',
+            ),
+            # Búsqueda por lote de proveedor en las retiradas (trazabilidad)
+            models.Index(fields=['centro', 'lote'], name='stocklote_centro_lote_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.alimento.nombre} - {self.lote} ({self.cantidad_disponible})"
+
+    @property
+    def caducado(self):
+        return self.fecha_caducidad < timezone.localdate()
+
     
     
 class TipoDeMerma(ModeloBaseCentro):
@@ -119,6 +210,9 @@ class Merma(ModeloBaseCentro):
         verbose_name = "Merma"
         verbose_name_plural = "Mermas"
         ordering = ["-fecha"]
+        indexes = [
+            models.Index(fields=['centro', '-fecha', '-id'], name='merma_centro_fecha_idx'),
+        ]
 
     def __str__(self):
         return f"{self.alimento.nombre} - {self.cantidad} {self.unidad_medida} ({self.tipo_merma})"
@@ -133,13 +227,21 @@ class Merma(ModeloBaseCentro):
 
         super().save(*args, **kwargs)
 
+        from .fefo import consumir_fefo, devolver_stock
+
         # Actualizar stock en base a diferencia
         if diferencia > 0:  # se perdió más cantidad
             self.alimento.stock_actual = max(self.alimento.stock_actual - diferencia, 0)
+            # Las mermas también dan salida a lotes caducados
+            consumir_fefo(self.alimento, diferencia, incluir_caducados=True)
         elif diferencia < 0:  # se corrigió a menos pérdida → devolvemos stock
             self.alimento.stock_actual += abs(diferencia)
+            devolver_stock(self.alimento, abs(diferencia))
 
-        self.alimento.save()   
+        self.alimento.save()
+
+        from app.pedidos.alertas import programar_evaluacion
+        programar_evaluacion([self.alimento_id])
         
         
     def eliminar_y_devolver_stock(self):
@@ -147,13 +249,19 @@ class Merma(ModeloBaseCentro):
         Devuelve la cantidad de la merma al stock del alimento
         y elimina la merma de la base de datos.
         """
+        from .fefo import devolver_stock
+
         with transaction.atomic():
             # actualizar stock atómicamente
             self.alimento.__class__.objects.filter(pk=self.alimento.pk).update(
                 stock_actual=F('stock_actual') + self.cantidad
             )
+            devolver_stock(self.alimento, self.cantidad)
             # borrar la merma
-            self.delete()    
+            self.delete()
+
+            from app.pedidos.alertas import programar_evaluacion
+            programar_evaluacion([self.alimento_id])
             
             
             
@@ -170,6 +278,9 @@ class AjusteInventario(ModeloBaseCentro):
         ordering = ['-fecha']
         verbose_name = 'Ajuste de Inventario'
         verbose_name_plural = 'Ajustes de Inventario'
+        indexes = [
+            models.Index(fields=['centro', '-fecha', '-id'], name='ajuste_centro_fecha_idx'),
+        ]
 
     def __str__(self):
         return f"{self.alimento.nombre} ({self.fecha.date()} - {self.centro})"
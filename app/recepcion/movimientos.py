@@ -0,0 +1,92 @@
+from django.db import connection
+from django.db.models import F, Value, CharField
+from .models import Recepcion, Merma, AjusteInventario
+
+
+TIPOS_MOVIMIENTO = {
+    'recepcion': 'Recepción',
+    'merma': 'Merma',
+    'ajuste': 'Ajuste de Inventario',
+}
+
+# Columnas comunes del UNION, en el mismo orden en las tres consultas
+COLUMNAS = (
+    'fecha_movimiento', 'tipo_movimiento', 'movimiento_id',
+    'alimento_nombre', 'cantidad_movimiento', 'unidad', 'detalle',
+)
+
+# Orden de la lista (y clave de la paginación): el id solo es único dentro de cada tipo
+CLAVE = ('fecha_movimiento', 'tipo_movimiento', 'movimiento_id')
+
+
+def _columnas(tipo, fecha, cantidad, unidad, detalle):
+    """Anotaciones tipadas de una rama del UNION."""
+    return {
+        'fecha_movimiento': F(fecha),
+        'tipo_movimiento': Value(tipo, output_field=CharField()),
+        'movimiento_id': F('id'),
+        'alimento_nombre': F('alimento__nombre'),
+        'cantidad_movimiento': F(cantidad),
+        'unidad': F(unidad) if unidad else Value(None, output_field=CharField()),
+        'detalle': F(detalle) if detalle else Value(None, output_field=CharField()),
+    }
+
+
+def consultas_movimientos(centro, desde=None, hasta=None, alimento=None, tipo=None):
+    """
+    Una consulta por tipo de movimiento con las mismas columnas (COLUMNAS),
+    ya filtrada por centro, fechas [desde, hasta) y alimento. Con `tipo` solo
+    se devuelve esa rama. Devuelve {tipo: queryset}.
+    """
+    ramas = {
+        'recepcion': (
+            Recepcion.objects.filter(centro=centro),
+            'fecha_recepcion', 'cantidad', 'unidad_compra__abreviatura', 'proveedor__nombre',
+        ),
+        'merma': (
+            Merma.objects.filter(centro=centro),
+            'fecha', 'cantidad', 'unidad_medida__abreviatura', 'tipo_merma__nombre',
+        ),
+        'ajuste': (
+            AjusteInventario.objects.filter(centro=centro),
+            'fecha', 'diferencia', None, None,
+        ),
+    }
+
+    consultas = {}
+    for nombre, (queryset, fecha, cantidad, unidad, detalle) in ramas.items():
+        if tipo and nombre != tipo:
+            continue
+        # Las fechas se filtran sobre la columna para aprovechar el índice (centro, fecha, id)
+        if desde:
+            queryset = queryset.filter(**{f'{fecha}__gte': desde})
+        if hasta:
+            queryset = queryset.filter(**{f'{fecha}__lt': hasta})
+        if alimento:
+            queryset = queryset.filter(alimento=alimento)
+        consultas[nombre] = queryset.annotate(**_columnas(nombre, fecha, cantidad, unidad, detalle))
+    return consultas
+
+
+def pagina_movimientos(consultas, filtro, orden, limite):
+    """
+    UNION ALL de las consultas con el filtro de página aplicado en cada rama,
+    ordenado y limitado en la BD. Si la BD lo permite cada rama se ordena y
+    corta también a `limite`, así que cada una lee como mucho `limite` filas
+    de su índice sea cual sea el volumen de la tabla.
+    """
+    if not consultas:
+        return []
+
+    recortar = connection.features.supports_slicing_ordering_in_compound
+    ramas = []
+    for queryset in consultas.values():
+        rama = queryset.filter(filtro).values(*COLUMNAS)
+        rama = rama.order_by(*orden)[:limite] if recortar else rama.order_by()
+        ramas.append(rama)
+
+    primera, *resto = ramas
+    filas = list(primera.union(*resto, all=True).order_by(*orden)[:limite])
+    for fila in filas:
+        fila['tipo_nombre'] = TIPOS_MOVIMIENTO[fila['tipo_movimiento']]
+    return filas
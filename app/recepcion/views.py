@@ -1,8 +1,9 @@
 from django.shortcuts import render, get_object_or_404, redirect
 from django.urls import reverse_lazy
 from django.contrib import messages
-from datetime import datetime
-from django.db.models import Q
+from datetime import datetime, time, timedelta
+from django.db.models import Q, F, Value
+from django.db.models.functions import Greatest
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.core.exceptions import ObjectDoesNotExist
 from django.views.generic.edit import CreateView, UpdateView, DeleteView
@@ -10,11 +11,16 @@ from django.views.generic import DetailView, TemplateView, FormView
 from django.views.generic.list import ListView
 from django.views import View
 from app.super.models import UserProfile
-from app.core.mixins import PaginationMixin, PermisoMixin
-from .models import Proveedor, Recepcion, TipoDeMerma, Merma, AjusteInventario
+from app.core.middleware.centro import perfil_o_404, perfil_de_request
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.timezone import make_aware
+from app.core.mixins import PaginationMixin, PermisoMixin, KeysetPaginationMixin
+from .models import Proveedor, Recepcion, TipoDeMerma, Merma, AjusteInventario, StockLote
 from .forms import ProveedorForm, RecepcionForm, TipoDeMermaForm, MermaForm, RecepcionFormSet, RecepcionEliminarForm, AjusteStockForm
 from app.dashuser.views import datos_centro
 from app.dashuser.models import Alimento
+from app.pedidos.alertas import programar_evaluacion
+from .movimientos import TIPOS_MOVIMIENTO, CLAVE, consultas_movimientos, pagina_movimientos
 import re
 
 
@@ -33,7 +39,7 @@ class ProveedorList(PermisoMixin, PaginationMixin, LoginRequiredMixin, ListView)
 
     def get_queryset(self):
         try:
-            user_profile = UserProfile.objects.filter(user=self.request.user).first()
+            user_profile = perfil_de_request(self.request)
             if user_profile and user_profile.centro:
                 centro = user_profile.centro
                 queryset = Proveedor.objects.filter(centro=centro).order_by('id')
@@ -72,7 +78,7 @@ class ProveedorCreate(PermisoMixin, LoginRequiredMixin, CreateView):
     success_url = reverse_lazy('recepcion:ProveedorList')
 
     def form_valid(self, form):
-        user_profile = get_object_or_404(UserProfile, user=self.request.user)
+        user_profile = perfil_o_404(self.request)
         if user_profile.centro:
             form.instance.centro = user_profile.centro
             messages.success(self.request, 'Proveedor creado correctamente.')
@@ -98,7 +104,7 @@ class ProveedorUpdate(PermisoMixin,LoginRequiredMixin, UpdateView):
     context_object_name = 'proveedor'
 
     def get_queryset(self):
-        user_profile = get_object_or_404(UserProfile, user=self.request.user)
+        user_profile = perfil_o_404(self.request)
         if user_profile.centro:
             return Proveedor.objects.filter(centro_id=user_profile.centro_id)
         else:
@@ -124,11 +130,7 @@ class ProveedorDelete(PermisoMixin, LoginRequiredMixin, DeleteView):
     context_object_name = 'proveedor'
 
     def get_queryset(self):
-        user_profile = get_object_or_404(UserProfile, user=self.request.user)
-        if user_profile.centro:
-            return Proveedor.objects.filter(centro=user_profile.centro)
-        else:
-            return Proveedor.objects.none()
+        return Proveedor.objects.for_request(self.request)
 
     def post(self, request, *args, **kwargs):
         obj = self.get_object()
@@ -146,6 +148,8 @@ class ProveedorDetailView(PermisoMixin, LoginRequiredMixin, DetailView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context.update(datos_centro(self.request))  # Añadimos datos del centro (usuario)
+        from app.core.historial import historial_para
+        context['historial'] = historial_para(self.request, self.object)
         return context
         
         
@@ -164,7 +168,7 @@ class RecepcionManualList(PermisoMixin, PaginationMixin, LoginRequiredMixin, Lis
 
     def get_queryset(self):
         try:
-            user_profile = UserProfile.objects.filter(user=self.request.user).first()
+            user_profile = perfil_de_request(self.request)
             if user_profile and user_profile.centro:
                 centro = user_profile.centro
                 queryset = Recepcion.objects.filter(centro=centro).order_by('id')
@@ -201,7 +205,7 @@ class RecepcionManualCreate(LoginRequiredMixin, View):
     success_url = 'recepcion:RecepcionManualList'
 
     def get(self, request, *args, **kwargs):
-        user_profile = get_object_or_404(UserProfile, user=request.user)
+        user_profile = perfil_o_404(request)
         formset = RecepcionFormSet(
             queryset=Recepcion.objects.none(),
             form_kwargs={"centro": user_profile.centro}
@@ -209,7 +213,7 @@ class RecepcionManualCreate(LoginRequiredMixin, View):
         return render(request, self.template_name, {'formset': formset})
 
     def post(self, request, *args, **kwargs):
-        user_profile = get_object_or_404(UserProfile, user=request.user)
+        user_profile = perfil_o_404(request)
         formset = RecepcionFormSet(
             request.POST,
             queryset=Recepcion.objects.none(),
@@ -255,11 +259,7 @@ class RecepcionManualUpdate(LoginRequiredMixin, UpdateView):
     success_url = reverse_lazy('recepcion:RecepcionManualList')
 
     def get_queryset(self):
-        user_profile = get_object_or_404(UserProfile, user=self.request.user)
-        if user_profile.centro:
-            return Recepcion.objects.filter(centro=user_profile.centro)
-        else:
-            return Recepcion.objects.none()
+        return Recepcion.objects.for_request(self.request)
 
     def form_valid(self, form):
         old_recepcion = form.instance.__class__.objects.get(pk=form.instance.pk)
@@ -269,6 +269,15 @@ class RecepcionManualUpdate(LoginRequiredMixin, UpdateView):
         form.instance.alimento.stock_actual += diferencia
         form.instance.alimento.save()
 
+        # Mantener el lote FEFO alineado con la recepción
+        StockLote.objects.filter(recepcion=form.instance).update(
+            lote=form.instance.lote,
+            fecha_caducidad=form.instance.fecha_caducidad,
+            cantidad_inicial=F('cantidad_inicial') + diferencia,
+            cantidad_disponible=Greatest(F('cantidad_disponible') + diferencia, Value(0)),
+        )
+        programar_evaluacion([form.instance.alimento_id])
+
         return super().form_valid(form)
     
     def form_invalid(self, form):
@@ -310,7 +319,7 @@ class RecepcionManualDeleteFormView(PermisoMixin, LoginRequiredMixin, FormView):
         recepcion_id = form.cleaned_data['recepcion_id']
         recepcion = get_object_or_404(Recepcion, pk=recepcion_id)
 
-        user_profile = get_object_or_404(UserProfile, user=self.request.user)
+        user_profile = perfil_o_404(self.request)
         if recepcion.centro != user_profile.centro:
             messages.error(self.request, "No puedes eliminar recepciones de otro centro.")
             return super().form_invalid(form)
@@ -319,6 +328,10 @@ class RecepcionManualDeleteFormView(PermisoMixin, LoginRequiredMixin, FormView):
         recepcion.alimento.stock_actual -= recepcion.cantidad
         recepcion.alimento.save()
 
+        # El lote queda sin existencias (se conserva para la trazabilidad)
+        StockLote.objects.filter(recepcion=recepcion).update(cantidad_disponible=0)
+        programar_evaluacion([recepcion.alimento_id])
+
         # Eliminar la recepción
         recepcion.delete()
 
@@ -395,7 +408,7 @@ class TipoDeMermaList(PermisoMixin, PaginationMixin, LoginRequiredMixin, ListVie
 
     def get_queryset(self):
         try:
-            user_profile = UserProfile.objects.filter(user=self.request.user).first()
+            user_profile = perfil_de_request(self.request)
             if user_profile and user_profile.centro:
                 centro = user_profile.centro
                 queryset = TipoDeMerma.objects.filter(centro=centro).order_by('id')
@@ -432,7 +445,7 @@ class TipoDeMermaCreate(PermisoMixin, LoginRequiredMixin, CreateView):
     success_url = reverse_lazy('recepcion:TipoDeMermaList')
 
     def form_valid(self, form):
-        user_profile = get_object_or_404(UserProfile, user=self.request.user)
+        user_profile = perfil_o_404(self.request)
         if user_profile.centro:
             form.instance.centro = user_profile.centro
             messages.success(self.request, 'Tipo de merma creada correctamente.')
@@ -457,7 +470,7 @@ class TipoDeMermaUpdate(PermisoMixin, LoginRequiredMixin, UpdateView):
     context_object_name = 'tipodemerma'
 
     def get_queryset(self):
-        user_profile = get_object_or_404(UserProfile, user=self.request.user)
+        user_profile = perfil_o_404(self.request)
         if user_profile.centro:
             return TipoDeMerma.objects.filter(centro_id=user_profile.centro_id)
         else:
@@ -483,11 +496,7 @@ class TipoDeMermaDelete(PermisoMixin, LoginRequiredMixin, DeleteView):
     context_object_name = 'tiposdemerma'
 
     def get_queryset(self):
-        user_profile = get_object_or_404(UserProfile, user=self.request.user)
-        if user_profile.centro:
-            return TipoDeMerma.objects.filter(centro=user_profile.centro)
-        else:
-            return TipoDeMerma.objects.none()
+        return TipoDeMerma.objects.for_request(self.request)
 
     def post(self, request, *args, **kwargs):
         obj = self.get_object()
@@ -510,7 +519,7 @@ class MermasList(PermisoMixin, PaginationMixin, LoginRequiredMixin, ListView):
 
     def get_queryset(self):
         try:
-            user_profile = UserProfile.objects.filter(user=self.request.user).first()
+            user_profile = perfil_de_request(self.request)
             if user_profile and user_profile.centro:
                 centro = user_profile.centro
                 queryset = Merma.objects.filter(centro=centro).order_by('id')
@@ -554,7 +563,7 @@ class MermasCreate(PermisoMixin, LoginRequiredMixin, CreateView):
         return kwargs
 
     def form_valid(self, form):
-        user_profile = get_object_or_404(UserProfile, user=self.request.user)
+        user_profile = perfil_o_404(self.request)
         if not user_profile.centro:
             messages.error(self.request, 'No está asociado a ningún centro.')
             return self.form_invalid(form)
@@ -590,7 +599,7 @@ class MermasUpdate(PermisoMixin, LoginRequiredMixin, UpdateView):
         kwargs['user'] = self.request.user  # pasamos el usuario al formulario
         return kwargs
     def get_queryset(self):
-        user_profile = get_object_or_404(UserProfile, user=self.request.user)
+        user_profile = perfil_o_404(self.request)
         if user_profile.centro:
             return Merma.objects.filter(centro_id=user_profile.centro_id)
         else:
@@ -598,7 +607,7 @@ class MermasUpdate(PermisoMixin, LoginRequiredMixin, UpdateView):
             return Merma.objects.none()
 
     def form_valid(self, form):
-        user_profile = get_object_or_404(UserProfile, user=self.request.user)
+        user_profile = perfil_o_404(self.request)
         form.instance.registrado_por = user_profile
         messages.success(self.request, 'Merma actualizada correctamente.')
         return super().form_valid(form)
@@ -618,11 +627,7 @@ class MermasDelete(PermisoMixin, LoginRequiredMixin, DeleteView):
     context_object_name = 'merma'
 
     def get_queryset(self):
-        user_profile = get_object_or_404(UserProfile, user=self.request.user)
-        if user_profile.centro:
-            return Merma.objects.filter(centro=user_profile.centro)
-        else:
-            return Merma.objects.none()
+        return Merma.objects.for_request(self.request)
 
     def post(self, request, *args, **kwargs):
         obj = self.get_object()
@@ -647,52 +652,62 @@ class MermasDetailView(PermisoMixin, LoginRequiredMixin, DetailView):
     
     
     
-class AuditoriaList(PermisoMixin, PaginationMixin, LoginRequiredMixin, TemplateView):
+class AuditoriaList(PermisoMixin, KeysetPaginationMixin, LoginRequiredMixin, ListView):
+    """
+    Movimientos de inventario (recepciones, mermas y ajustes) en una sola
+    lista. Se leen con un UNION ALL ordenado y paginado por clave en la BD,
+    así que cada página cuesta lo mismo sea cual sea el histórico.
+    """
     permiso_modulo = "Recepcion"
     template_name = 'recepcion/listar_auditoria.html'
-    paginate_by = 10  # Número de registros por página
+    context_object_name = 'movimientos'
+    keyset_campos = CLAVE
+    keyset_por_pagina = 10
+
+    def get_queryset(self):
+        """Consultas por tipo, ya filtradas; el UNION se monta al paginar."""
+        user_profile = perfil_de_request(self.request)
+        if not (user_profile and user_profile.centro):
+            return {}
+
+        params = self.request.GET
+        desde, hasta = self._fecha('desde'), self._fecha('hasta')
+        return consultas_movimientos(
+            user_profile.centro,
+            desde=make_aware(datetime.combine(desde, time.min)) if desde else None,
+            hasta=make_aware(datetime.combine(hasta + timedelta(days=1), time.min)) if hasta else None,
+            alimento=int(params['alimento']) if params.get('alimento', '').isdigit() else None,
+            tipo=params.get('tipo') if params.get('tipo') in TIPOS_MOVIMIENTO else None,
+        )
+
+    def _fecha(self, parametro):
+        """Fecha AAAA-MM-DD del GET; None (sin filtro) si falta o no existe, p. ej. 2025-02-30."""
+        try:
+            return parse_date(self.request.GET.get(parametro, ''))
+        except ValueError:
+            return None
+
+    def filas_keyset(self, consultas, filtro, orden, limite):
+        return pagina_movimientos(consultas, filtro, orden, limite)
+
+    def leer_cursor(self, cursor):
+        partes = cursor.split('|')
+        if len(partes) != 3 or not partes[2].isdigit():
+            return None
+        try:
+            fecha = parse_datetime(partes[0])
+        except ValueError:  # Fecha bien formada pero inexistente
+            return None
+        return [fecha, partes[1], int(partes[2])] if fecha else None
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context.update(datos_centro(self.request)) 
-        user_profile = UserProfile.objects.filter(user=self.request.user).first()
-
-        if user_profile and user_profile.centro:
-            centro = user_profile.centro
-            recepciones = Recepcion.objects.filter(centro=centro)
-            mermas = Merma.objects.filter(centro=centro)
-            ajustes = AjusteInventario.objects.filter(centro=centro)
-
-            movimientos = []
-
-            # Normalizar Recepciones
-            for r in recepciones:
-                r.fecha_movimiento = r.fecha_recepcion
-                r.tipo_movimiento = "Recepción"
-                movimientos.append(r)
-
-            # Normalizar Mermas
-            for m in mermas:
-                m.fecha_movimiento = m.fecha
-                m.tipo_movimiento = "Merma"
-                movimientos.append(m)
-
-            # Normalizar Ajustes
-            for a in ajustes:
-                a.fecha_movimiento = a.fecha
-                a.tipo_movimiento = "Ajuste de Inventario"
-                # Para que el template funcione
-                a.cantidad = a.diferencia  # o a.stock_real si prefieres
-                a.proveedor = None  # así entra en el bloque de ajustes, no en Recepción
-                movimientos.append(a)
-
-            # Ordenar por fecha descendente
-            movimientos.sort(key=lambda x: x.fecha_movimiento, reverse=True)
-
-            context['movimientos'] = movimientos
-        else:
-            context['movimientos'] = []
-
+        user_profile = perfil_de_request(self.request)
+        centro = user_profile.centro if user_profile else None
+        context['alimentos'] = Alimento.objects.filter(centro=centro).order_by('nombre').values('id', 'nombre') if centro else []
+        context['tipos'] = TIPOS_MOVIMIENTO
+        context['filtro'] = self.request.GET
         return context
 
     
@@ -711,7 +726,7 @@ class AjusteInventarioList(PermisoMixin, PaginationMixin, LoginRequiredMixin, Li
 
     def get_queryset(self):
         try:
-            user_profile = UserProfile.objects.filter(user=self.request.user).first()
+            user_profile = perfil_de_request(self.request)
             if user_profile and user_profile.centro:
                 centro = user_profile.centro
                 queryset = AjusteInventario.objects.filter(centro=centro).order_by('id')
@@ -748,7 +763,7 @@ class AjusteInventarioCreate(PermisoMixin, LoginRequiredMixin, CreateView):
     success_url = reverse_lazy('recepcion:AjusteInventarioList')
 
     def form_valid(self, form):
-        user_profile = get_object_or_404(UserProfile, user=self.request.user)
+        user_profile = perfil_o_404(self.request)
         if not user_profile.centro:
             messages.error(self.request, "No estás asociado a ningún centro.")
             return self.form_invalid(form)
@@ -762,6 +777,7 @@ class AjusteInventarioCreate(PermisoMixin, LoginRequiredMixin, CreateView):
 
         # 🔹 Actualizamos el stock del alimento sin tocar AjusteInventario
         Alimento.objects.filter(pk=ajuste.alimento.pk).update(stock_actual=ajuste.stock_real)
+        programar_evaluacion([ajuste.alimento_id])
 
         messages.success(self.request, "Ajuste de inventario creado correctamente.")
         return redirect(self.success_url)
@@ -779,7 +795,7 @@ class AjusteInventarioUpdate(PermisoMixin, LoginRequiredMixin, UpdateView):
     context_object_name = 'ajuste'
 
     def get_queryset(self):
-        user_profile = get_object_or_404(UserProfile, user=self.request.user)
+        user_profile = perfil_o_404(self.request)
         if user_profile.centro:
             return AjusteInventario.objects.filter(centro_id=user_profile.centro_id)
         else:
@@ -803,6 +819,7 @@ class AjusteInventarioUpdate(PermisoMixin, LoginRequiredMixin, UpdateView):
 
         # Guardamos el ajuste actualizado
         ajuste.save()
+        programar_evaluacion([ajuste.alimento_id])
 
         messages.success(self.request, 'Ajuste de inventario actualizado correctamente.')
         return redirect(self.success_url)
@@ -825,11 +842,7 @@ class AjusteInventarioDelete(PermisoMixin, LoginRequiredMixin, DeleteView):
     context_object_name = 'ajuste'
 
     def get_queryset(self):
-        user_profile = get_object_or_404(UserProfile, user=self.request.user)
-        if user_profile.centro:
-            return AjusteInventario.objects.filter(centro=user_profile.centro)
-        else:
-            return AjusteInventario.objects.none()
+        return AjusteInventario.objects.for_request(self.request)
 
     def post(self, request, *args, **kwargs):
         ajuste = self.get_object()
@@ -837,6 +850,7 @@ class AjusteInventarioDelete(PermisoMixin, LoginRequiredMixin, DeleteView):
 
         # 🔹 Revertir el efecto del ajuste antes de eliminarlo
         alimento.actualizar_stock(-ajuste.diferencia)
+        programar_evaluacion([alimento.pk])
 
         messages.success(self.request, 'Ajuste de inventario eliminado y stock revertido correctamente.')
         return super().post(request, *args, **kwargs)    
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import UserProfile, Centros
+from .models import UserProfile, Centros, PlantillaPermisos
 # Register your models here.
 
 admin.site.register(Centros)
@@ -8,4 +8,10 @@ admin.site.register(Centros)
 class UserProfileAdmin(admin.ModelAdmin):
     list_display = ('username', 'nombre', 'centro', 'estado')
     list_filter = ('centro', 'estado')
-    search_fields = ('username', 'nombre', 'apellidos')
\ No newline at end of file
+    search_fields = ('username', 'nombre', 'apellidos')
+
+
+@admin.register(PlantillaPermisos)
+class PlantillaPermisosAdmin(admin.ModelAdmin):
+    list_display = ('nombre', 'descripcion')
+    search_fields = ('nombre',)
@@ -0,0 +1,220 @@
+from datetime import date, datetime, time
+from decimal import Decimal
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, DateField, DecimalField, F, Max, Q, Sum, Value
+from django.db.models.functions import Coalesce, TruncMonth
+from django.utils import timezone
+from .models import Centros, MetricaMensualCentro
+
+
+# Analítica del grupo: el comando calcular_analitica agrega cada noche la
+# actividad de todos los centros por (centro, mes) en MetricaMensualCentro con
+# una consulta agrupada por indicador. La página solo lee esa tabla (dos
+# consultas agrupadas) y guarda el resultado en caché hasta el próximo cálculo.
+
+MESES_TENDENCIA = 12
+INDICADORES = ('raciones', 'valor_mermas', 'gasto_compras', 'valor_stock')
+CLAVE_ANALITICA = 'analitica:grupo:{}'
+
+_DECIMAL = DecimalField(max_digits=20, decimal_places=2)
+_CERO = Value(Decimal('0'), output_field=_DECIMAL)
+
+
+def _timeout():
+    return getattr(settings, 'ANALITICA_CACHE_TIMEOUT', 60 * 60)
+
+
+def inicio_mes(dia):
+    return dia.replace(day=1)
+
+
+def sumar_meses(mes, n):
+    """Primer día del mes que está n meses después (o antes) de `mes`."""
+    indice = mes.year * 12 + mes.month - 1 + n
+    return date(indice // 12, indice % 12 + 1, 1)
+
+
+def meses_hasta(ultimo, n):
+    """Los n meses que terminan en `ultimo`, del más antiguo al más reciente."""
+    return [sumar_meses(ultimo, -k) for k in range(n - 1, -1, -1)]
+
+
+def _por_mes(queryset, campo_fecha, desde, **agregados):
+    """{(centro_id, mes): {agregado: valor}} agrupando por centro y mes en la BD."""
+    filas = (
+        queryset
+        .filter(**{f'{campo_fecha}__gte': desde})
+        .annotate(mes=TruncMonth(campo_fecha, output_field=DateField()))
+        .values('centro_id', 'mes')
+        .annotate(**agregados)
+        .order_by()
+    )
+    return {
+        (fila.pop('centro_id'), fila.pop('mes')): fila
+        for fila in filas
+    }
+
+
+######################################################################################
+###############################   CÁLCULO NOCTURNO    ################################
+######################################################################################
+
+
+def calcular_metricas(meses=2, hoy=None):
+    """
+    Recalcula MetricaMensualCentro de los últimos `meses` meses (el actual
+    incluido) para todos los centros: una consulta agrupada por indicador y
+    un único upsert. El valor de stock es una foto del momento, así que solo
+    se escribe en el mes actual; los meses cerrados conservan el suyo.
+    Devuelve el número de filas escritas.
+    """
+    from app.dashuser.models import Alimento
+    from app.platos.models import EtiquetaPlato
+    from app.recepcion.models import Merma, Recepcion
+
+    hoy = hoy or timezone.localdate()
+    actual = inicio_mes(hoy)
+    lista_meses = meses_hasta(actual, meses)
+    desde = timezone.make_aware(datetime.combine(lista_meses[0], time.min))
+
+    raciones = _por_mes(EtiquetaPlato.objects.all(), 'fecha', desde, raciones=Count('id'))
+    mermas = _por_mes(
+        Merma.objects.all(), 'fecha', desde,
+        valor_mermas=Sum(
+            F('cantidad') * Coalesce(F('alimento__precio_medio'), _CERO), output_field=_DECIMAL
+        ),
+    )
+    compras = _por_mes(
+        Recepcion.objects.all(), 'fecha_recepcion', desde,
+        gasto_compras=Sum(F('cantidad') * F('precio_compra'), output_field=_DECIMAL),
+    )
+    stock = dict(
+        Alimento.objects
+        .values('centro_id')
+        .annotate(valor=Sum(
+            Coalesce(F('stock_actual'), _CERO) * Coalesce(F('precio_medio'), _CERO), output_field=_DECIMAL
+        ))
+        .order_by()
+        .values_list('centro_id', 'valor')
+    )
+
+    # Una fila por centro y mes, también sin actividad: así un mes que se queda
+    # a cero (p. ej. al borrar mermas) no conserva el valor anterior.
+    cerrados, en_curso = [], []
+    for centro_id in Centros.objects.values_list('pk', flat=True):
+        for mes in lista_meses:
+            clave = (centro_id, mes)
+            fila = MetricaMensualCentro(
+                centro_id=centro_id,
+                mes=mes,
+                raciones=raciones.get(clave, {}).get('raciones', 0),
+                valor_mermas=mermas.get(clave, {}).get('valor_mermas') or 0,
+                gasto_compras=compras.get(clave, {}).get('gasto_compras') or 0,
+            )
+            if mes == actual:
+                fila.valor_stock = stock.get(centro_id) or 0
+                en_curso.append(fila)
+            else:
+                cerrados.append(fila)
+
+    campos = ['raciones', 'valor_mermas', 'gasto_compras', 'actualizado']
+    with transaction.atomic():
+        for filas, actualizar in ((cerrados, campos), (en_curso, campos + ['valor_stock'])):
+            if filas:
+                MetricaMensualCentro.objects.bulk_create(
+                    filas, batch_size=1000,
+                    update_conflicts=True, unique_fields=['centro', 'mes'], update_fields=actualizar,
+                )
+        transaction.on_commit(invalidar_analitica)
+
+    return len(cerrados) + len(en_curso)
+
+
+def invalidar_analitica():
+    cache.delete(CLAVE_ANALITICA.format(MESES_TENDENCIA))
+
+
+######################################################################################
+###############################   LECTURA (PÁGINA)    ################################
+######################################################################################
+
+
+def _sumas():
+    return {indicador: Sum(indicador) for indicador in INDICADORES}
+
+
+def analitica_grupo(meses=MESES_TENDENCIA, hoy=None):
+    """
+    Tendencia mensual del grupo y comparativa por centro de los últimos
+    `meses` meses, leídas de MetricaMensualCentro en dos consultas agrupadas
+    y guardadas en caché hasta el próximo cálculo (o ANALITICA_CACHE_TIMEOUT).
+    En la comparativa el stock es el del último mes, no una suma.
+    """
+    clave = CLAVE_ANALITICA.format(meses)
+    datos = cache.get(clave) if hoy is None else None
+    if datos is not None:
+        return datos
+
+    lista_meses = meses_hasta(inicio_mes(hoy or timezone.localdate()), meses)
+    ultimo = lista_meses[-1]
+    metricas = MetricaMensualCentro.objects.filter(mes__gte=lista_meses[0], mes__lte=ultimo)
+
+    por_mes = {
+        fila['mes']: fila
+        for fila in metricas.values('mes').annotate(**_sumas(), actualizado_max=Max('actualizado')).order_by()
+    }
+    tendencia = {
+        indicador: [por_mes.get(mes, {}).get(indicador) or 0 for mes in lista_meses]
+        for indicador in INDICADORES
+    }
+
+    centros = list(
+        metricas
+        .values('centro_id', 'centro__nombre')
+        .annotate(
+            raciones=Sum('raciones'),
+            valor_mermas=Sum('valor_mermas'),
+            gasto_compras=Sum('gasto_compras'),
+            valor_stock=Sum('valor_stock', filter=Q(mes=ultimo)),
+        )
+        .order_by('centro__nombre')
+    )
+    for fila in centros:
+        fila['valor_stock'] = fila['valor_stock'] or 0
+        fila['pct_mermas'] = (
+            round(fila['valor_mermas'] * 100 / fila['gasto_compras'], 1) if fila['gasto_compras'] else None
+        )
+
+    fechas = [fila['actualizado_max'] for fila in por_mes.values() if fila['actualizado_max']]
+    datos = {
+        'meses': lista_meses,
+        'tendencia': tendencia,
+        'centros': centros,
+        'totales': {
+            indicador: (
+                tendencia[indicador][-1] if indicador == 'valor_stock' else sum(tendencia[indicador])
+            )
+            for indicador in INDICADORES
+        },
+        'actualizado': max(fechas) if fechas else None,
+    }
+    if hoy is None:
+        cache.set(clave, datos, _timeout())
+    return datos
+
+
+def tendencia_centro(centro_id, meses=MESES_TENDENCIA, hoy=None):
+    """Serie mensual de un centro ({indicador: [valores]}), en una consulta."""
+    lista_meses = meses_hasta(inicio_mes(hoy or timezone.localdate()), meses)
+    filas = {
+        fila['mes']: fila
+        for fila in MetricaMensualCentro.objects
+        .filter(centro_id=centro_id, mes__gte=lista_meses[0], mes__lte=lista_meses[-1])
+        .values('mes', *INDICADORES)
+    }
+    return {
+        indicador: [filas.get(mes, {}).get(indicador) or 0 for mes in lista_meses]
+        for indicador in INDICADORES
+    }
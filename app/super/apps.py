@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class SuperConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'app.super'
+
+    def ready(self):
+        import app.super.signals  # invalidación de la caché de permisos
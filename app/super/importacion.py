@@ -0,0 +1,286 @@
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+import pandas as pd
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import F
+from django.utils import timezone
+from app.core.auditoria import auditoria_en_lote, buffer_auditoria
+from app.core.middleware.usuario_actual import contexto_desde, contexto_serializable, enviar_con_contexto
+from .models import TrabajoImportacion
+
+logger = logging.getLogger(__name__)
+
+
+# Importaciones de archivos grandes en segundo plano. El archivo nunca se
+# carga entero: se lee por bloques (chunksize de pandas para CSV, openpyxl en
+# modo solo lectura para Excel) y cada bloque se importa y se confirma junto
+# con el avance del TrabajoImportacion. Si el proceso cae, el trabajo se
+# reanuda saltando las filas ya confirmadas.
+
+EXTENSIONES = ('csv', 'xls', 'xlsx')
+# Trabajos en curso a la vez dentro de un proceso web
+_executor = ThreadPoolExecutor(max_workers=getattr(settings, 'IMPORTACION_HILOS', 2), thread_name_prefix='importacion')
+
+
+class TrabajoPerdido(Exception):
+    """El trabajo ya no es de esta ejecución (se dio por interrumpido y otra lo reclamó)."""
+
+
+def _latido():
+    """Segundos entre latidos de un trabajo en curso; muy por debajo del límite de trabajos_interrumpidos()."""
+    return getattr(settings, 'IMPORTACION_LATIDO', 60)
+
+
+def tamano_directo():
+    """Archivos mayores que esto (bytes) se importan siempre en segundo plano."""
+    return getattr(settings, 'IMPORTACION_TAMANO_DIRECTO', 2 * 1024 * 1024)
+
+
+def _extension(nombre):
+    extension = nombre.rsplit('.', 1)[-1].lower()
+    if extension not in EXTENSIONES:
+        raise ValueError("Formato no soportado. Usa CSV o Excel (.xls/.xlsx).")
+    return extension
+
+
+######################################################################################
+#############################   LECTURA POR BLOQUES    ###############################
+######################################################################################
+
+
+def _con_indice(df, inicio):
+    """Encabezados normalizados e índice = posición de la fila en el archivo (sin cabecera)."""
+    df.columns = [str(c).strip() for c in df.columns]
+    df.index = pd.RangeIndex(inicio, inicio + len(df))
+    return df
+
+
+def leer_bloques(archivo, nombre, tamano, saltar=0):
+    """
+    Genera DataFrames de hasta `tamano` filas, empezando tras las `saltar`
+    primeras filas de datos. El índice de cada bloque es la posición de la
+    fila en el archivo, así que los errores se reportan con su fila real.
+    """
+    extension = _extension(nombre)
+    if extension == 'csv':
+        # Se salta por registros ya leídos, no con skiprows (que cuenta líneas
+        # físicas): un campo entre comillas con saltos de línea movería el punto
+        # de reanudación.
+        inicio = 0
+        for df in pd.read_csv(archivo, chunksize=tamano):
+            if inicio + len(df) > saltar:
+                desde = max(saltar - inicio, 0)
+                yield _con_indice(df.iloc[desde:].copy(), inicio + desde)
+            inicio += len(df)
+    elif extension == 'xlsx':
+        from openpyxl import load_workbook
+        libro = load_workbook(archivo, read_only=True, data_only=True)
+        try:
+            filas = libro.worksheets[0].iter_rows(values_only=True)
+            cabecera = next(filas, None)
+            if cabecera is None:
+                return
+            inicio, bloque = saltar, []
+            for numero, fila in enumerate(filas):
+                if numero < saltar:
+                    continue
+                bloque.append(fila)
+                if len(bloque) == tamano:
+                    yield _con_indice(pd.DataFrame(bloque, columns=cabecera), inicio)
+                    inicio += len(bloque)
+                    bloque = []
+            if bloque:
+                yield _con_indice(pd.DataFrame(bloque, columns=cabecera), inicio)
+        finally:
+            libro.close()
+    else:
+        # .xls antiguo: sin lector en streaming, se lee entero y se trocea
+        df = pd.read_excel(archivo)
+        for inicio in range(saltar, len(df), tamano):
+            yield _con_indice(df.iloc[inicio:inicio + tamano].copy(), inicio)
+
+
+def contar_filas(archivo, nombre):
+    """Filas de datos del archivo (para el porcentaje), sin cargarlo en memoria. None si no se sabe."""
+    extension = _extension(nombre)
+    if extension == 'csv':
+        lineas = sum(trozo.count(b'\n') for trozo in iter(lambda: archivo.read(1024 * 1024), b''))
+        return max(lineas - 1, 0)
+    if extension == 'xlsx':
+        from openpyxl import load_workbook
+        libro = load_workbook(archivo, read_only=True)
+        try:
+            maximo = libro.worksheets[0].max_row
+            return max(maximo - 1, 0) if maximo else None
+        finally:
+            libro.close()
+    return None
+
+
+######################################################################################
+#############################   TRABAJOS EN SEGUNDO PLANO    #########################
+######################################################################################
+
+
+def crear_trabajo(centro, tipo, archivo, modelo='', usuario=None):
+    """Guarda el archivo y un TrabajoImportacion pendiente con el contexto del usuario actual."""
+    _extension(archivo.name)
+    trabajo = TrabajoImportacion(
+        centro=centro,
+        tipo=tipo,
+        modelo=modelo,
+        nombre_archivo=archivo.name,
+        usuario=usuario,
+        contexto=contexto_serializable(),
+        tamano_bloque=getattr(settings, 'IMPORTACION_TAMANO_BLOQUE', 1000),
+    )
+    trabajo.archivo.save(archivo.name, archivo, save=False)
+    trabajo.save()
+    return trabajo
+
+
+def lanzar_trabajo(trabajo):
+    """Ejecuta el trabajo en un hilo del proceso en cuanto se confirma la transacción actual."""
+    transaction.on_commit(lambda: enviar_con_contexto(_executor, _ejecutar_en_hilo, trabajo.pk))
+
+
+def _ejecutar_en_hilo(trabajo_id):
+    try:
+        ejecutar_trabajo(trabajo_id)
+    finally:
+        # El hilo abrió su propia conexión: no se deja colgada en el pool
+        connections.close_all()
+
+
+def _importador(trabajo):
+    from app.super.views import ImportadorAlimentos, ImportadorBaseCentro, MAPAS_CAMPOS, MODELOS_IMPORTABLES
+    if trabajo.tipo == 'alimentos':
+        return ImportadorAlimentos(trabajo.centro)
+    modelo = MODELOS_IMPORTABLES.get(trabajo.modelo)
+    if modelo is None:
+        raise ValueError(f"Modelo no válido: {trabajo.modelo}")
+    return ImportadorBaseCentro(trabajo.centro, modelo, MAPAS_CAMPOS.get(trabajo.modelo, {}))
+
+
+def _registrar_bloque(trabajo, filas, resultado, segundos):
+    """
+    Suma el resultado de un bloque al trabajo (dentro de la transacción del
+    bloque). Solo si el trabajo sigue siendo de esta ejecución y nadie ha
+    avanzado filas_procesadas; si no, lanza TrabajoPerdido y el bloque se
+    deshace en vez de importarse dos veces.
+    """
+    errores = resultado['errores']
+    hueco = TrabajoImportacion.MAX_ERRORES - len(trabajo.errores)
+    anotados = trabajo.errores + errores[:hueco] if hueco > 0 else trabajo.errores
+    actualizado = TrabajoImportacion.objects.filter(
+        pk=trabajo.pk, estado='en_curso', propietario=trabajo.propietario,
+        filas_procesadas=trabajo.filas_procesadas,
+    ).update(
+        filas_procesadas=F('filas_procesadas') + filas,
+        bloques_procesados=F('bloques_procesados') + 1,
+        segundos=F('segundos') + segundos,
+        creados=F('creados') + resultado['creados'],
+        actualizados=F('actualizados') + resultado['actualizados'],
+        sin_cambios=F('sin_cambios') + resultado['sin_cambios'],
+        descartadas=F('descartadas') + resultado['descartadas'],
+        total_errores=F('total_errores') + len(errores),
+        errores=anotados,
+        actualizado=timezone.now(),
+    )
+    if not actualizado:
+        raise TrabajoPerdido(f"La importación {trabajo.pk} la procesa otra ejecución")
+    trabajo.errores = anotados
+    trabajo.filas_procesadas += filas
+
+
+def _latir(trabajo_id, propietario, parar):
+    """Mientras el trabajo es nuestro, renueva `actualizado` aunque un bloque tarde."""
+    try:
+        while not parar.wait(_latido()):
+            vivo = TrabajoImportacion.objects.filter(
+                pk=trabajo_id, estado='en_curso', propietario=propietario,
+            ).update(actualizado=timezone.now())
+            if not vivo:
+                return
+    except Exception:
+        logger.exception("Latido de la importación %s", trabajo_id)
+    finally:
+        connections.close_all()
+
+
+def ejecutar_trabajo(trabajo_id):
+    """
+    Procesa un trabajo pendiente (o uno fallido, para reanudarlo) desde su
+    última fila confirmada. Cada bloque se importa y se anota en el trabajo
+    en la misma transacción. Con el contexto del usuario que lo lanzó y un
+    único registro de auditoría para todo el archivo.
+    Mientras tanto un hilo de latido mantiene `actualizado` al día, y cada
+    bloque se anota solo si el trabajo sigue siendo de esta ejecución
+    (`propietario`). Devuelve False si el trabajo ya lo estaba procesando
+    otro hilo.
+    """
+    propietario = uuid.uuid4().hex
+    reclamado = TrabajoImportacion.objects.filter(pk=trabajo_id, estado__in=('pendiente', 'error')).update(
+        estado='en_curso', mensaje_error='', propietario=propietario,
+        fecha_inicio=timezone.now(), actualizado=timezone.now(),
+    )
+    if not reclamado:
+        return False
+
+    trabajo = TrabajoImportacion.objects.select_related('centro').get(pk=trabajo_id)
+    propio = TrabajoImportacion.objects.filter(pk=trabajo_id, estado='en_curso', propietario=propietario)
+    parar = threading.Event()
+    latido = threading.Thread(target=_latir, args=(trabajo_id, propietario, parar), daemon=True)
+    latido.start()
+    try:
+        with contexto_desde(trabajo.contexto), buffer_auditoria():
+            importador = _importador(trabajo)
+            if trabajo.total_filas is None:
+                with trabajo.archivo.open('rb') as archivo:
+                    total = contar_filas(archivo, trabajo.nombre_archivo)
+                propio.update(total_filas=total)
+
+            descripcion = f"Importación de {trabajo.nombre_archivo}"
+            with auditoria_en_lote(descripcion, modelo=trabajo.modelo or 'Alimento', objeto_id=trabajo.pk, centro=trabajo.centro):
+                with trabajo.archivo.open('rb') as archivo:
+                    bloques = leer_bloques(archivo, trabajo.nombre_archivo, trabajo.tamano_bloque, trabajo.filas_procesadas)
+                    for df in bloques:
+                        inicio = time.monotonic()
+                        importador.preparar(df)  # Ficheros (imágenes) fuera de la transacción
+                        with transaction.atomic():
+                            resultado = importador.importar_dataframe(df)
+                            _registrar_bloque(trabajo, len(df), resultado, time.monotonic() - inicio)
+    except TrabajoPerdido:
+        logger.warning("Importación %s reclamada por otra ejecución; se abandona", trabajo_id)
+        return True
+    except Exception as e:
+        logger.exception("Importación %s interrumpida", trabajo_id)
+        propio.update(estado='error', mensaje_error=str(e), propietario='', actualizado=timezone.now())
+        return True
+    finally:
+        parar.set()
+        latido.join()
+
+    propio.update(estado='completado', propietario='', fecha_fin=timezone.now(), actualizado=timezone.now())
+    return True
+
+
+def trabajos_interrumpidos(minutos=10):
+    """
+    Trabajos 'en_curso' sin latido en los últimos `minutos` (el proceso que
+    los ejecutaba se reinició o cayó). Se marcan como error, sin propietario,
+    para reanudarlos; si la ejecución antigua siguiera viva, su siguiente
+    bloque ya no se anota.
+    """
+    limite = timezone.now() - timedelta(minutes=minutos)
+    trabajos = TrabajoImportacion.objects.filter(estado='en_curso', actualizado__lt=limite)
+    ids = list(trabajos.values_list('pk', flat=True))
+    TrabajoImportacion.objects.filter(pk__in=ids, estado='en_curso', actualizado__lt=limite).update(
+        estado='error', mensaje_error="Interrumpido: sin avance", propietario='', actualizado=timezone.now(),
+    )
+    return ids
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from app.super.analitica import calcular_metricas
+
+
+class Command(BaseCommand):
+    help = (
+        "Precalcula los indicadores mensuales de todos los centros para la "
+        "analítica del grupo. Pensado para ejecutarse cada noche (cron); con "
+        "--meses 12 rellena el histórico la primera vez."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--meses', type=int, default=2,
+            help="Meses a recalcular contando el actual (por defecto 2: el actual y el anterior)",
+        )
+
+    def handle(self, *args, **options):
+        filas = calcular_metricas(meses=max(options['meses'], 1))
+        self.stdout.write(self.style.SUCCESS(f"{filas} métricas mensuales actualizadas."))
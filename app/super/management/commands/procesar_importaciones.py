@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from app.super.importacion import ejecutar_trabajo, trabajos_interrumpidos
+from app.super.models import TrabajoImportacion
+
+
+class Command(BaseCommand):
+    help = (
+        "Procesa las importaciones en segundo plano pendientes o fallidas, "
+        "reanudándolas desde su último bloque confirmado. Sirve tras reiniciar "
+        "el servidor web o para ejecutarlas fuera de él (cron)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--trabajo', type=int, help="Procesar solo este trabajo (id)")
+        parser.add_argument('--fallidos', action='store_true', help="Reintentar también los trabajos con error")
+        parser.add_argument(
+            '--interrumpidos', type=int, default=10, metavar='MINUTOS',
+            help="Reanudar también los 'en curso' sin avance en los últimos MINUTOS (por defecto 10)",
+        )
+
+    def handle(self, *args, **options):
+        interrumpidos = trabajos_interrumpidos(options['interrumpidos'])
+        if interrumpidos:
+            self.stdout.write(f"{len(interrumpidos)} trabajos interrumpidos se reanudarán.")
+
+        if options['trabajo']:
+            trabajos = TrabajoImportacion.objects.filter(pk=options['trabajo'])
+        elif options['fallidos']:
+            trabajos = TrabajoImportacion.objects.filter(estado__in=('pendiente', 'error'))
+        else:
+            trabajos = TrabajoImportacion.objects.filter(Q(estado='pendiente') | Q(pk__in=interrumpidos))
+
+        for trabajo_id in trabajos.order_by('fecha_creacion').values_list('pk', flat=True):
+            ejecutar_trabajo(trabajo_id)
+            trabajo = TrabajoImportacion.objects.get(pk=trabajo_id)
+            self.stdout.write(
+                f"{trabajo}: {trabajo.filas_procesadas} filas, {trabajo.filas_por_segundo or 0} filas/s"
+            )
+        self.stdout.write(self.style.SUCCESS("Importaciones procesadas."))
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.6 on 2026-10-19 19:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('super', '0003_permiso'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlantillaPermisos',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nombre', models.CharField(max_length=100, unique=True)),
+                ('descripcion', models.CharField(blank=True, max_length=255, null=True)),
+                ('permisos', models.JSONField(default=list)),
+            ],
+            options={
+                'verbose_name': 'Plantilla de permisos',
+                'verbose_name_plural': 'Plantillas de permisos',
+                'ordering': ['nombre'],
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.6 on 2026-10-19 19:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('super', '0004_plantillapermisos'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MetricaMensualCentro',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('mes', models.DateField(help_text='Primer día del mes')),
+                ('raciones', models.PositiveIntegerField(default=0)),
+                ('valor_mermas', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('gasto_compras', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('valor_stock', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('actualizado', models.DateTimeField(auto_now=True)),
+                ('centro', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='super.centros')),
+            ],
+            options={
+                'verbose_name': 'Métrica mensual de centro',
+                'verbose_name_plural': 'Métricas mensuales de centros',
+                'indexes': [models.Index(fields=['mes', 'centro'], name='metrica_mes_centro_idx')],
+                'constraints': [models.UniqueConstraint(fields=('centro', 'mes'), name='metrica_centro_mes_unica')],
+            },
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.2.6 on 2026-10-19 19:49
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('super', '0005_metricamensualcentro'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrabajoImportacion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(choices=[('base', 'Datos maestros'), ('alimentos', 'Alimentos')], max_length=20)),
+                ('modelo', models.CharField(blank=True, help_text='Modelo destino en las importaciones de datos maestros', max_length=50)),
+                ('archivo', models.FileField(upload_to='importaciones/')),
+                ('nombre_archivo', models.CharField(max_length=255)),
+                ('contexto', models.JSONField(blank=True, default=dict)),
+                ('estado', models.CharField(choices=[('pendiente', 'Pendiente'), ('en_curso', 'En curso'), ('completado', 'Completado'), ('error', 'Error')], default='pendiente', max_length=20)),
+                ('tamano_bloque', models.PositiveIntegerField(default=1000)),
+                ('total_filas', models.PositiveIntegerField(blank=True, null=True)),
+                ('filas_procesadas', models.PositiveIntegerField(default=0)),
+                ('bloques_procesados', models.PositiveIntegerField(default=0)),
+                ('segundos', models.FloatField(default=0)),
+                ('creados', models.PositiveIntegerField(default=0)),
+                ('actualizados', models.PositiveIntegerField(default=0)),
+                ('sin_cambios', models.PositiveIntegerField(default=0)),
+                ('descartadas', models.PositiveIntegerField(default=0)),
+                ('total_errores', models.PositiveIntegerField(default=0)),
+                ('errores', models.JSONField(blank=True, default=list)),
+                ('mensaje_error', models.TextField(blank=True)),
+                ('fecha_creacion', models.DateTimeField(auto_now_add=True)),
+                ('fecha_inicio', models.DateTimeField(blank=True, null=True)),
+                ('fecha_fin', models.DateTimeField(blank=True, null=True)),
+                ('actualizado', models.DateTimeField(auto_now=True)),
+                ('centro', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='super.centros')),
+                ('usuario', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='super.userprofile')),
+            ],
+            options={
+                'verbose_name': 'Trabajo de importación',
+                'verbose_name_plural': 'Trabajos de importación',
+                'ordering': ['-fecha_creacion'],
+                'indexes': [models.Index(fields=['estado', 'actualizado'], name='trabajo_importacion_estado_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-19 20:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('super', '0006_trabajoimportacion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trabajoimportacion',
+            name='propietario',
+            field=models.CharField(blank=True, help_text='Token de la ejecución que lo procesa', max_length=32),
+        ),
+    ]
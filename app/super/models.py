@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import User
         
 
@@ -23,9 +23,26 @@ class Centros(models.Model):
         return str(self.nombre)
     
 
+class CentroScopedQuerySet(models.QuerySet):
+    """
+    QuerySet base de los modelos de un centro. for_request(request) filtra
+    por el centro del usuario de la petición (ya resuelto por el middleware,
+    sin consultar el perfil otra vez) y devuelve none() si no tiene centro.
+    """
+
+    def del_centro(self, centro):
+        return self.filter(centro=centro) if centro else self.none()
+
+    def for_request(self, request):
+        from app.core.middleware.centro import centro_de_request
+        return self.del_centro(centro_de_request(request))
+
+
 class ModeloBaseCentro(models.Model):
     centro = models.ForeignKey(Centros, on_delete=models.CASCADE)
 
+    objects = CentroScopedQuerySet.as_manager()
+
     class Meta:
         abstract = True
 
@@ -48,6 +65,9 @@ class UserProfile(models.Model):
         super().save(*args, **kwargs)
         if not self.estado:
             Permiso.objects.filter(usuario=self).delete()
+            from app.super.permissions import invalidar_permisos
+            pk = self.pk
+            transaction.on_commit(lambda: invalidar_permisos(pk))
             
             
 class Permiso(models.Model):
@@ -69,4 +89,121 @@ class Permiso(models.Model):
         verbose_name_plural = 'Permisos'
 
     def __str__(self):
-        return f"{self.usuario.nombre} {self.usuario.apellidos} → {self.modulo} [{self.accion}]"    
\ No newline at end of file
+        return f"{self.usuario.nombre} {self.usuario.apellidos} → {self.modulo} [{self.accion}]"    
+
+
+class PlantillaPermisos(models.Model):
+    """
+    Rol reutilizable (cocinero, jefe de cocina...): lista de pares
+    [modulo, accion] que se aplica de una vez a uno o varios usuarios.
+    """
+    nombre = models.CharField(max_length=100, unique=True)
+    descripcion = models.CharField(max_length=255, blank=True, null=True)
+    permisos = models.JSONField(default=list)
+
+    class Meta:
+        ordering = ['nombre']
+        verbose_name = 'Plantilla de permisos'
+        verbose_name_plural = 'Plantillas de permisos'
+
+    def __str__(self):
+        return self.nombre
+
+    def pares(self):
+        return {(modulo, accion) for modulo, accion in self.permisos}
+
+
+class MetricaMensualCentro(ModeloBaseCentro):
+    """
+    Indicadores de un centro en un mes, precalculados cada noche por el
+    comando calcular_analitica. La analítica del grupo lee solo esta tabla.
+    El valor de stock es el del último cálculo del mes (cierre de mes).
+    """
+    mes = models.DateField(help_text="Primer día del mes")
+    raciones = models.PositiveIntegerField(default=0)
+    valor_mermas = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    gasto_compras = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    valor_stock = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    actualizado = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'Métrica mensual de centro'
+        verbose_name_plural = 'Métricas mensuales de centros'
+        constraints = [
+            models.UniqueConstraint(fields=['centro', 'mes'], name='metrica_centro_mes_unica'),
+        ]
+        indexes = [
+            # Tendencia del grupo y comparativa de los últimos meses
+            models.Index(fields=['mes', 'centro'], name='metrica_mes_centro_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.centro} {self.mes:%Y-%m}"
+
+
+class TrabajoImportacion(ModeloBaseCentro):
+    """
+    Importación de un archivo grande en segundo plano. El archivo se lee por
+    bloques y cada bloque se confirma junto con el avance (filas_procesadas),
+    así que tras un fallo se reanuda desde el último bloque confirmado.
+    """
+    TIPOS = [
+        ('base', 'Datos maestros'),
+        ('alimentos', 'Alimentos'),
+    ]
+    ESTADOS = [
+        ('pendiente', 'Pendiente'),
+        ('en_curso', 'En curso'),
+        ('completado', 'Completado'),
+        ('error', 'Error'),
+    ]
+    MAX_ERRORES = 500  # Errores por fila que se guardan; el resto solo se cuentan
+
+    tipo = models.CharField(max_length=20, choices=TIPOS)
+    modelo = models.CharField(max_length=50, blank=True, help_text="Modelo destino en las importaciones de datos maestros")
+    archivo = models.FileField(upload_to='importaciones/')
+    nombre_archivo = models.CharField(max_length=255)
+    usuario = models.ForeignKey(UserProfile, on_delete=models.SET_NULL, null=True, blank=True)
+    contexto = models.JSONField(default=dict, blank=True)
+    estado = models.CharField(max_length=20, choices=ESTADOS, default='pendiente')
+    tamano_bloque = models.PositiveIntegerField(default=1000)
+
+    total_filas = models.PositiveIntegerField(null=True, blank=True)
+    filas_procesadas = models.PositiveIntegerField(default=0)
+    bloques_procesados = models.PositiveIntegerField(default=0)
+    segundos = models.FloatField(default=0)
+    creados = models.PositiveIntegerField(default=0)
+    actualizados = models.PositiveIntegerField(default=0)
+    sin_cambios = models.PositiveIntegerField(default=0)
+    descartadas = models.PositiveIntegerField(default=0)
+    total_errores = models.PositiveIntegerField(default=0)
+    errores = models.JSONField(default=list, blank=True)
+    mensaje_error = models.TextField(blank=True)
+
+    fecha_creacion = models.DateTimeField(auto_now_add=True)
+    fecha_inicio = models.DateTimeField(null=True, blank=True)
+    fecha_fin = models.DateTimeField(null=True, blank=True)
+    actualizado = models.DateTimeField(auto_now=True)  # Latido mientras se procesa
+    propietario = models.CharField(max_length=32, blank=True, help_text="Token de la ejecución que lo procesa")
+
+    class Meta:
+        ordering = ['-fecha_creacion']
+        verbose_name = 'Trabajo de importación'
+        verbose_name_plural = 'Trabajos de importación'
+        indexes = [
+            models.Index(fields=['estado', 'actualizado'], name='trabajo_importacion_estado_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.nombre_archivo} ({self.get_estado_display()})"
+
+    @property
+    def progreso(self):
+        """Porcentaje leído del archivo (None si no se conoce el total)."""
+        if not self.total_filas:
+            return 100 if self.estado == 'completado' else None
+        return min(100, round(self.filas_procesadas * 100 / self.total_filas))
+
+    @property
+    def filas_por_segundo(self):
+        return round(self.filas_procesadas / self.segundos) if self.segundos else None
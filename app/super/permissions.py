@@ -1,6 +1,63 @@
+import uuid
+from django.conf import settings
+from django.db import transaction
+from django.core.cache import cache
 from app.super.models import Permiso
 
 
+# Los permisos de cada usuario se guardan en caché como frozenset de
+# (modulo, accion). La clave incluye una versión por usuario que cambia cada
+# vez que se tocan sus filas de Permiso (ver invalidar_permisos), así que
+# nunca se sirve un conjunto viejo: basta con dejar de apuntar a él.
+CLAVE_VERSION = "permisos:version:{}"
+CLAVE_PERMISOS = "permisos:{}:{}"
+
+
+def _timeout():
+    return getattr(settings, "PERMISOS_CACHE_TIMEOUT", 300)
+
+
+def version_permisos(perfil_id):
+    version = cache.get(CLAVE_VERSION.format(perfil_id))
+    if version is None:
+        version = uuid.uuid4().hex
+        cache.add(CLAVE_VERSION.format(perfil_id), version, None)
+        version = cache.get(CLAVE_VERSION.format(perfil_id), version)
+    return version
+
+
+def invalidar_permisos(*perfil_ids):
+    """Nueva versión para cada usuario: la próxima lectura vuelve a la BD."""
+    cache.set_many({CLAVE_VERSION.format(pk): uuid.uuid4().hex for pk in perfil_ids}, None)
+
+
+def permisos_usuario(user_profile):
+    """
+    frozenset de (modulo, accion) del usuario. Se calcula con una sola
+    consulta, se guarda en caché entre peticiones y se memoriza en la propia
+    instancia, así que en una petición solo se resuelve una vez.
+    """
+    if user_profile is None:
+        return frozenset()
+
+    permisos = getattr(user_profile, "_permisos", None)
+    if permisos is None:
+        clave = CLAVE_PERMISOS.format(user_profile.pk, version_permisos(user_profile.pk))
+        permisos = cache.get(clave)
+        if permisos is None:
+            permisos = frozenset(Permiso.objects.filter(usuario=user_profile).values_list("modulo", "accion"))
+            cache.set(clave, permisos, _timeout())
+        user_profile._permisos = permisos
+    return permisos
+
+
+def permisos_request(request):
+    """Perfil del usuario de la petición y sus permisos, resueltos una vez por petición."""
+    if not hasattr(request, "_permisos"):
+        user_profile = getattr(request.user, "userprofile", None) if request.user.is_authenticated else None
+        request._permisos = (user_profile, permisos_usuario(user_profile))
+    return request._permisos
+
 
 def tiene_permiso(user_profile, modulo, accion):
     """
@@ -19,9 +76,64 @@ def tiene_permiso(user_profile, modulo, accion):
     except AttributeError:
         return False
 
-    # Consulta en la tabla de permisos
-    return Permiso.objects.filter(
-        usuario=user_profile,
-        modulo=modulo,
-        accion=accion
-    ).exists()
+    return (modulo, accion) in permisos_usuario(user_profile)
+
+
+def matriz_permisos(user_profile, modulos, acciones):
+    """{modulo: {accion: bool}} para las plantillas, sin consultas extra."""
+    return {
+        modulo: {accion: tiene_permiso(user_profile, modulo, accion) for accion in acciones}
+        for modulo in modulos
+    }
+
+
+######################################################################################
+#############################   ASIGNACIÓN DE PERMISOS   #############################
+######################################################################################
+
+
+def asignar_permisos_en_lote(perfiles, nuevos):
+    """
+    Deja a cada perfil exactamente con los pares (modulo, accion) de
+    `nuevos`. Lee los permisos actuales de todos en una consulta y escribe
+    solo la diferencia: un bulk_create para las altas y un delete para las
+    bajas, en una transacción. Devuelve (altas, bajas).
+    """
+    perfiles = list(perfiles)
+    nuevos = frozenset(nuevos)
+    if not perfiles:
+        return 0, 0
+
+    actuales = {}
+    for pk, usuario_id, modulo, accion in Permiso.objects.filter(usuario__in=perfiles).values_list(
+        "id", "usuario_id", "modulo", "accion"
+    ):
+        actuales.setdefault(usuario_id, {})[(modulo, accion)] = pk
+
+    altas, bajas = [], []
+    for perfil in perfiles:
+        tiene = actuales.get(perfil.pk, {})
+        altas += [Permiso(usuario=perfil, modulo=m, accion=a) for m, a in nuevos - tiene.keys()]
+        bajas += [pk for par, pk in tiene.items() if par not in nuevos]
+
+    with transaction.atomic():
+        if altas:
+            Permiso.objects.bulk_create(altas, ignore_conflicts=True)
+        if bajas:
+            Permiso.objects.filter(pk__in=bajas).delete()
+        # bulk_create no lanza post_save: se invalida a mano al confirmar
+        transaction.on_commit(lambda: invalidar_permisos(*[perfil.pk for perfil in perfiles]))
+
+    for perfil in perfiles:
+        perfil.__dict__.pop("_permisos", None)
+    return len(altas), len(bajas)
+
+
+def asignar_permisos(user_profile, nuevos):
+    """asignar_permisos_en_lote() para un solo usuario."""
+    return asignar_permisos_en_lote([user_profile], nuevos)
+
+
+def aplicar_plantilla(plantilla, perfiles):
+    """Aplica una PlantillaPermisos a varios usuarios en una sola transacción."""
+    return asignar_permisos_en_lote(perfiles, plantilla.pares())
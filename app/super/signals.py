@@ -0,0 +1,18 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from app.super.models import Permiso
+from app.super.permissions import invalidar_permisos
+
+
+# También post_delete: así cualquier baja (admin, shell, cascada al borrar el
+# usuario o su perfil) invalida la caché, no solo las de asignar_permisos_en_lote.
+@receiver([post_save, post_delete], sender=Permiso, dispatch_uid="permisos_invalidar_cache")
+def invalidar_cache_permisos(sender, instance, **kwargs):
+    """
+    Cualquier alta o baja de un Permiso deja obsoleta la caché de su usuario.
+    Se invalida al confirmar: si se hiciera dentro de la transacción, otra
+    petición podría volver a cachear los permisos antiguos antes del COMMIT.
+    """
+    usuario_id = instance.usuario_id
+    transaction.on_commit(lambda: invalidar_permisos(usuario_id))
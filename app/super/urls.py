@@ -7,6 +7,7 @@ app_name = 'super'
 urlpatterns = [
     path('home/', views.home, name='home'),
     path('dashboard/', dashboard, name='dashboard'),
+    path('analitica/', AnaliticaGrupoView.as_view(), name='analitica_grupo'),
     
     path("crear_usuario/", UserCreate.as_view(), name="UserCreate"),
     path("listado_usuarios/", UserList.as_view(), name="UserList"),
@@ -21,10 +22,12 @@ urlpatterns = [
     path('centros/<int:pk>/usuarios/', UsuariosCentroListView.as_view(), name='UsuariosCentro'),
     
     path('usuarios/<int:pk>/permisos/', views.UserPermisosView.as_view(), name='user_permisos'),
+    path('permisos/plantillas/aplicar/', views.AplicarPlantillaPermisosView.as_view(), name='aplicar_plantilla_permisos'),
     
     path('importar/', ImportadorBaseCentro, name='ImportadorBaseCentro'),
     path('importar/alimentos/', ImportadorAlimentos, name='ImportadorAlimentos'),
     path('importar_datos/', views.importar_datos, name='importar_datos'),
     path('importar_datos_alimentos/', views.importar_datos_alimentos, name='importar_datos_alimentos'),
+    path('importar/trabajos/<int:pk>/', views.TrabajoImportacionView.as_view(), name='trabajo_importacion'),
 
 ]
\ No newline at end of file
@@ -2,7 +2,7 @@ from django.shortcuts import render
 from django.contrib.auth.decorators import login_required
 from django.urls import reverse_lazy
 from django.contrib import messages
-from django.http import HttpResponseRedirect
+from django.http import HttpResponseRedirect, JsonResponse
 from django.db import transaction, IntegrityError
 from django.shortcuts import get_object_or_404, redirect
 from django.db import transaction
@@ -11,6 +11,7 @@ from django.contrib.auth.models import User
 from django.utils.timezone import localtime
 from django.db.models import Q
 from django.conf import settings
+from django.core.exceptions import ValidationError
 from django.core.files import File
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.core.paginator import Paginator
@@ -18,8 +19,11 @@ from django.views.generic.list import ListView
 from django.views.generic.edit import CreateView, UpdateView, DeleteView
 from django.views.generic import DetailView, TemplateView
 from .forms import CentroForm, CentroUpdateForm
-from .models import UserProfile, Centros, Permiso
+from .models import UserProfile, Centros, Permiso, PlantillaPermisos, TrabajoImportacion
+from .permissions import permisos_usuario, asignar_permisos, aplicar_plantilla
+from .importacion import crear_trabajo, lanzar_trabajo, tamano_directo
 from app.core.mixins import PaginationMixin
+from app.core.auditoria import auditoria_en_lote, contar_en_lote
 from app.dashuser.models import Alergenos, Trazas, UnidadDeMedida, TipoAlimento, Alimento, InformacionNutricional
 from app.platos.models import TextoModo, TipoPlato
 from app.recepcion.models import TipoDeMerma
@@ -27,6 +31,7 @@ import re
 import unicodedata
 import logging
 import pandas as pd
+from decimal import Decimal
 import os
 
 
@@ -45,7 +50,7 @@ def datos_super(request):
     else:
         saludo = "Buenas noches"
 # obtenemos el perfil del usuario logueado
-    user_profile = UserProfile.objects.get(user=request.user)
+    user_profile = request.user.userprofile
     
     # obtenemos los datos asociados al perfil
     imagen = user_profile.imagen
@@ -84,6 +89,48 @@ def dashboard(request):
     }
     return render(request, 'super/dashboard.html', context)
 
+
+class AnaliticaGrupoView(UserPassesTestMixin, TemplateView):
+    """
+    Comparativa entre centros y tendencia de 12 meses (raciones, mermas,
+    compras y stock). Lee la tabla precalculada por calcular_analitica.
+    """
+    template_name = "super/analitica_grupo.html"
+    ORDENES = ("centro__nombre", "raciones", "valor_mermas", "gasto_compras", "valor_stock", "pct_mermas")
+
+    def test_func(self):
+        return self.request.user.is_superuser
+
+    def get_context_data(self, **kwargs):
+        from app.super.analitica import analitica_grupo, tendencia_centro
+        context = super().get_context_data(**kwargs)
+        datos = analitica_grupo()
+
+        centros = datos["centros"]
+        orden = self.request.GET.get("orden", "centro__nombre")
+        if orden.lstrip("-") in self.ORDENES:
+            campo = orden.lstrip("-")
+            centros = sorted(
+                centros,
+                key=lambda fila: (fila[campo] is None, fila[campo] if fila[campo] is not None else 0),
+                reverse=orden.startswith("-"),
+            )
+
+        # Tendencia del grupo o, si se elige, de un centro concreto
+        centro_id = self.request.GET.get("centro", "")
+        centro_id = int(centro_id) if centro_id.isdigit() else None
+        tendencia = tendencia_centro(centro_id) if centro_id else datos["tendencia"]
+
+        context["centros"] = centros
+        context["orden"] = orden
+        context["centro_id"] = centro_id
+        context["totales"] = datos["totales"]
+        context["actualizado"] = datos["actualizado"]
+        # Preparar datos para Chart.js
+        context["meses_labels"] = [mes.strftime("%Y-%m") for mes in datos["meses"]]
+        context["tendencia"] = {indicador: [float(v) for v in valores] for indicador, valores in tendencia.items()}
+        return context
+
 ######################################################################################
 #############################   USUARISOS SUPER    ###################################
 ######################################################################################
@@ -358,44 +405,91 @@ class UserPermisosView(UserPassesTestMixin, TemplateView):
         context = super().get_context_data(**kwargs)
         user_profile = self.get_userprofile()
 
-        permisos_dict = {}
-        for modulo in MODULOS:
-            permisos_dict[modulo] = {}
-            for accion in ACCIONES:
-                existe = Permiso.objects.filter(
-                    usuario=user_profile,
-                    modulo=modulo,
-                    accion=accion
-                ).exists()
-                permisos_dict[modulo][accion] = existe
+        # Los permisos guardados, no los efectivos: un superusuario los tiene todos
+        permisos = permisos_usuario(user_profile)
+        permisos_dict = {
+            modulo: {accion: (modulo, accion) in permisos for accion in ACCIONES}
+            for modulo in MODULOS
+        }
 
         context["user_profile"] = user_profile
         context["modulos"] = MODULOS
         context["acciones"] = ACCIONES
         context["permisos_dict"] = permisos_dict
+        context["plantillas"] = PlantillaPermisos.objects.all()
         return context
 
     def post(self, request, *args, **kwargs):
         user_profile = self.get_userprofile()
-        for modulo in MODULOS:
-            for accion in ACCIONES:
-                campo = f"{modulo}_{accion}"
-                checked = request.POST.get(campo) == "on"
-
-                permiso, created = Permiso.objects.get_or_create(
-                    usuario=user_profile,
-                    modulo=modulo,
-                    accion=accion
-                )
-                if checked:
-                    permiso.save()
-                else:
-                    permiso.delete()
 
-        messages.success(request, f"Permisos actualizados para {user_profile}")
+        plantilla_id = request.POST.get("plantilla", "")
+        if plantilla_id:
+            # Aplicar un rol guardado en lugar de las casillas
+            if not plantilla_id.isdigit():
+                messages.error(request, "Plantilla no válida.")
+                return redirect(request.path)
+            plantilla = get_object_or_404(PlantillaPermisos, pk=plantilla_id)
+            nuevos = plantilla.pares()
+        else:
+            nuevos = {
+                (modulo, accion)
+                for modulo in MODULOS
+                for accion in ACCIONES
+                if request.POST.get(f"{modulo}_{accion}") == "on"
+            }
+
+        altas, bajas = asignar_permisos(user_profile, nuevos)
+
+        nombre_plantilla = request.POST.get("guardar_plantilla", "").strip()
+        if nombre_plantilla:
+            PlantillaPermisos.objects.update_or_create(
+                nombre=nombre_plantilla, defaults={"permisos": sorted(nuevos)}
+            )
+            messages.info(request, f"Plantilla «{nombre_plantilla}» guardada")
+
+        messages.success(request, f"Permisos actualizados para {user_profile} (+{altas} / -{bajas})")
         return redirect(
             reverse_lazy("super:UserList")
         )
+
+
+class AplicarPlantillaPermisosView(UserPassesTestMixin, TemplateView):
+    """Aplica una plantilla de permisos a varios usuarios de un centro a la vez."""
+    template_name = "super/aplicar_plantilla_permisos.html"
+
+    def test_func(self):
+        return self.request.user.is_superuser
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        centro_id = self.request.GET.get("centro", "")
+        context["centros"] = Centros.objects.order_by("nombre")
+        context["centro_id"] = int(centro_id) if centro_id.isdigit() else None
+        context["usuarios"] = (
+            UserProfile.objects.filter(centro_id=context["centro_id"], estado=True).order_by("nombre", "apellidos")
+            if context["centro_id"] else []
+        )
+        context["plantillas"] = PlantillaPermisos.objects.all()
+        return context
+
+    def post(self, request, *args, **kwargs):
+        centro_id = request.POST.get("centro", "")
+        volver = reverse_lazy("super:aplicar_plantilla_permisos")
+        plantilla_id = request.POST.get("plantilla", "")
+        if not plantilla_id.isdigit() or not centro_id.isdigit():
+            messages.error(request, "Selecciona un centro y una plantilla válidos.")
+            return redirect(f"{volver}?centro={centro_id}" if centro_id.isdigit() else volver)
+        plantilla = get_object_or_404(PlantillaPermisos, pk=plantilla_id)
+
+        # Solo los usuarios activos del centro elegido, como en el formulario
+        ids = [int(pk) for pk in request.POST.getlist("perfiles") if pk.isdigit()]
+        perfiles = list(UserProfile.objects.filter(pk__in=ids, centro_id=centro_id, estado=True))
+
+        altas, bajas = aplicar_plantilla(plantilla, perfiles)
+        messages.success(
+            request, f"Plantilla «{plantilla}» aplicada a {len(perfiles)} usuarios (+{altas} / -{bajas} permisos)"
+        )
+        return redirect(f"{volver}?centro={centro_id}")
    
    
    
@@ -405,17 +499,32 @@ class UserPermisosView(UserPassesTestMixin, TemplateView):
 ##########################   IMPORTAR BASES DE DATOS    ##############################
 ######################################################################################
 
+# Textos que se leen como verdadero / falso en las columnas Estado o Activo
+VALORES_SI = ('sí', 'si', 's', 'true', '1')
+VALORES_NO = ('no', 'n', 'false', '0')
+
+
 class ImportadorBaseCentro:
     """
     Clase genérica para importar datos en modelos basados en centros.
     Compatible con CSV y Excel.
+
+    El archivo se normaliza por columnas con pandas, los registros del centro
+    se leen en una sola consulta y las filas se escriben en bloques con
+    bulk_create / bulk_update. En auditoría queda un único registro resumen.
     """
+    TAMANO_BLOQUE = 500
 
     def __init__(self, centro, modelo, mapa_campos=None):
         self.centro = centro
         self.modelo = modelo
         self.mapa_campos = mapa_campos or {}
 
+        # Campos del modelo, calculados una vez y no en cada fila
+        self.campos = {f.name: f for f in modelo._meta.concrete_fields}
+        self.campo_booleano = next((c for c in ('estado', 'activo') if c in self.campos), None)
+        self.con_centro = 'centro' in self.campos
+
     def importar_archivo(self, archivo):
         extension = archivo.name.split('.')[-1].lower()
 
@@ -430,89 +539,185 @@ class ImportadorBaseCentro:
         # Normalizar nombres de columnas (quitar espacios)
         df.columns = [str(c).strip() for c in df.columns]
 
-        # Validar columnas requeridas
-        columnas_requeridas = ['Nombre'] + list(self.mapa_campos.keys()) + ['Estado', 'Activo']
-        faltantes = [c for c in columnas_requeridas if c not in df.columns and c in ['Nombre'] + list(self.mapa_campos.keys())]
+        return self.importar_dataframe(df)
+
+    def validar_columnas(self, columnas):
+        faltantes = [c for c in ['Nombre'] + list(self.mapa_campos.keys()) if c not in columnas]
         if faltantes:
             raise ValueError(f"El archivo no contiene las columnas necesarias: {faltantes}")
 
-        self._importar_dataframe(df)
+    def preparar(self, df):
+        """Trabajo previo fuera de la transacción del bloque (ver ImportadorAlimentos)."""
+
+    def importar_dataframe(self, df):
+        """Importa un DataFrame ya leído: el archivo entero o un bloque (ver app.super.importacion)."""
+        self.validar_columnas(df.columns)
+        return self._importar_dataframe(df)
+
+    def _normalizar(self, df):
+        """
+        Una columna por campo del modelo (nombre, booleano y mapa_campos) con
+        los vacíos como None, más 'fila' (número de fila en el archivo).
+        Descarta las filas sin nombre y, si un nombre se repite, se queda con
+        la última aparición. Devuelve (datos, filas descartadas).
+        """
+        datos = pd.DataFrame({'fila': df.index + 2}, index=df.index)  # cabecera + base 1
+        datos['nombre'] = df['Nombre'].astype('string').str.strip()
+
+        if self.campo_booleano:
+            columna = next((c for c in ('Estado', 'Activo') if c in df.columns), None)
+            if columna:
+                texto = df[columna].astype('string').str.strip().str.lower()
+                # Activo salvo que el archivo diga explícitamente que no
+                datos[self.campo_booleano] = ~texto.isin(VALORES_NO).fillna(False)
+            else:
+                datos[self.campo_booleano] = True
+
+        for col_csv, campo_modelo in self.mapa_campos.items():
+            datos[campo_modelo] = df[col_csv]
+
+        validas = (datos['nombre'].fillna('') != '') & ~datos['nombre'].duplicated(keep='last')
+        descartadas = int((~validas).sum())
+        datos = datos[validas]
+        return datos.astype(object).where(datos.notna(), None), descartadas
+
+    def _valores(self, registro):
+        """Valores de una fila convertidos al tipo de cada campo; ValidationError si alguno no es válido."""
+        valores = {}
+        for campo, valor in registro.items():
+            field = self.campos[campo]
+            if valor is None:
+                continue  # Celda vacía: se queda el valor actual (o el default al crear)
+            if isinstance(valor, float) and valor.is_integer():
+                valor = int(valor)  # Códigos numéricos leídos como float por pandas
+            try:
+                valor = field.to_python(valor)
+            except ValidationError as e:
+                raise ValidationError([f"{campo}: {m}" for m in e.messages])
+            if field.max_length and len(str(valor)) > field.max_length:
+                raise ValidationError(f"{campo}: más de {field.max_length} caracteres")
+            valores[campo] = valor
+        return valores
+
+    def _existentes(self, campos):
+        queryset = self.modelo.objects.filter(centro=self.centro) if self.con_centro else self.modelo.objects.all()
+        return {obj.nombre: obj for obj in queryset.only('pk', 'nombre', *campos)}
+
+    def _guardar(self, pares, campos=None):
+        """
+        Escribe (fila, objeto) en bloques: bulk_create si `campos` es None y
+        bulk_update de esos campos si no. Si un bloque choca con una
+        restricción se repite fila a fila para señalar solo las erróneas.
+        Devuelve (escritos, errores).
+        """
+        def escribir(objetos):
+            with transaction.atomic():
+                if campos is None:
+                    self.modelo.objects.bulk_create(objetos)
+                else:
+                    self.modelo.objects.bulk_update(objetos, campos)
+
+        escritos, errores = 0, []
+        for inicio in range(0, len(pares), self.TAMANO_BLOQUE):
+            bloque = pares[inicio:inicio + self.TAMANO_BLOQUE]
+            try:
+                escribir([obj for _, obj in bloque])
+                escritos += len(bloque)
+            except IntegrityError:
+                for fila, obj in bloque:
+                    try:
+                        escribir([obj])
+                        escritos += 1
+                    except IntegrityError:
+                        errores.append({'fila': fila, 'nombre': obj.nombre, 'error': "Conflicto con registro existente"})
+        return escritos, errores
 
     @transaction.atomic
     def _importar_dataframe(self, df):
-        total_creados = 0
-        total_actualizados = 0
-        errores = 0
-
-        for _, fila in df.iterrows():
-            nombre = fila.get('Nombre')
-            if not nombre:
+        """
+        Importa el DataFrame y devuelve el resultado:
+        {'modelo', 'filas', 'creados', 'actualizados', 'sin_cambios',
+        'descartadas', 'errores': [{'fila', 'nombre', 'error'}]}.
+        """
+        datos, descartadas = self._normalizar(df)
+        campos = [c for c in datos.columns if c not in ('fila', 'nombre')]
+        existentes = self._existentes(campos)
+
+        nuevos, modificados, errores = [], [], []
+        sin_cambios = 0
+        for registro in datos.to_dict('records'):
+            fila, nombre = registro.pop('fila'), registro.pop('nombre')
+            try:
+                valores = self._valores({'nombre': nombre, **registro})
+            except ValidationError as e:
+                errores.append({'fila': fila, 'nombre': nombre, 'error': '; '.join(e.messages)})
                 continue
 
-            # Detectar campo booleano
-            campo_booleano = 'estado' if 'estado' in [f.name for f in self.modelo._meta.fields] else 'activo'
+            obj = existentes.get(nombre)
+            if obj is None:
+                obj = self.modelo(**valores)
+                if self.con_centro:
+                    obj.centro = self.centro
+                nuevos.append((fila, obj))
+            elif any(getattr(obj, campo) != valor for campo, valor in valores.items()):
+                for campo, valor in valores.items():
+                    setattr(obj, campo, valor)
+                modificados.append((fila, obj))
+            else:
+                sin_cambios += 1
+
+        nombre_modelo = self.modelo.__name__
+        with auditoria_en_lote(
+            f"Importación de {nombre_modelo}: {len(df)} filas", modelo=nombre_modelo, centro=self.centro
+        ):
+            creados, errores_alta = self._guardar(nuevos)
+            actualizados, errores_cambio = self._guardar(modificados, campos) if campos else (0, [])
+            # bulk_create/bulk_update no lanzan señales: el resumen se cuenta a mano
+            contar_en_lote(nombre_modelo, 'crear', creados)
+            contar_en_lote(nombre_modelo, 'modificar', actualizados)
+
+        errores = sorted(errores + errores_alta + errores_cambio, key=lambda e: e['fila'])
+        logger.info(
+            "%s - Creados: %s, Actualizados: %s, Sin cambios: %s, Errores: %s",
+            nombre_modelo, creados, actualizados, sin_cambios, len(errores),
+        )
+        return {
+            'modelo': nombre_modelo,
+            'filas': len(df),
+            'creados': creados,
+            'actualizados': actualizados,
+            'sin_cambios': sin_cambios,
+            'descartadas': descartadas,
+            'errores': errores,
+        }
 
-            # Obtener valor booleano desde CSV
-            valor_texto = None
-            if 'Estado' in df.columns:
-                valor_texto = fila.get('Estado')
-            elif 'Activo' in df.columns:
-                valor_texto = fila.get('Activo')
 
-            valor_bool = True  # Por defecto activo
-            if valor_texto is not None:
-                valor_str = str(valor_texto).strip().lower()
-                if valor_str in ['sí', 'si', 's', 'true', '1']:
-                    valor_bool = True
-                elif valor_str in ['no', 'n', 'false', '0']:
-                    valor_bool = False
 
-            defaults = {campo_booleano: valor_bool}
+# Modelos que se pueden importar con ImportadorBaseCentro y columnas extra de cada uno
+MODELOS_IMPORTABLES = {
+    'Alergenos': Alergenos,
+    'Trazas': Trazas,
+    'UnidadDeMedida': UnidadDeMedida,
+    'TipoAlimento': TipoAlimento,
+    'TipoPlato': TipoPlato,
+    'TipoDeMerma': TipoDeMerma,
+    'TextoModo': TextoModo,
+}
 
-            # Mapear columnas adicionales
-            for col_csv, campo_modelo in self.mapa_campos.items():
-                if col_csv in fila:
-                    defaults[campo_modelo] = fila.get(col_csv)
+MAPAS_CAMPOS = {
+    'Alergenos': {'Código': 'codigo', 'Imagen': 'imagen'},
+    'Trazas': {'Código': 'codigo', 'Imagen': 'imagen'},
+    'UnidadDeMedida': {'Abreviatura': 'abreviatura'},
+    'TipoAlimento': {},
+    'TipoPlato': {},
+    'TipoDeMerma': {'Descripción': 'descripcion'},
+    'TextoModo': {'Texto': 'texto'},
+}
 
-            # Filtro para update_or_create
-            filtro = {'nombre': nombre}
-            if hasattr(self.modelo, 'centro'):
-                filtro['centro'] = self.centro
 
-            try:
-                _, creado = self.modelo.objects.update_or_create(defaults=defaults, **filtro)
-                if creado:
-                    total_creados += 1
-                else:
-                    total_actualizados += 1
-            except IntegrityError:
-                errores += 1
-                print(f"❌ Conflicto con registro existente: {nombre}")
-
-        print(f"✅ {self.modelo.__name__} - Creados: {total_creados}, Actualizados: {total_actualizados}, Errores: {errores}")
-
-            
-                   
 def importar_datos(request):
-    modelos_map = {
-        'Alergenos': Alergenos,
-        'Trazas': Trazas,
-        'UnidadDeMedida': UnidadDeMedida,
-        'TipoAlimento': TipoAlimento,
-        'TipoPlato': TipoPlato,
-        'TipoDeMerma': TipoDeMerma,
-        'TextoModo': TextoModo,
-    }
-
-    mapas_campos = {
-        'Alergenos': {'Código': 'codigo', 'Imagen': 'imagen'},
-        'Trazas': {'Código': 'codigo', 'Imagen': 'imagen'},
-        'UnidadDeMedida': {'Abreviatura': 'abreviatura'},
-        'TipoAlimento': {},
-        'TipoPlato': {},
-        'TipoDeMerma': {'Descripción': 'descripcion'},
-        'TextoModo': {'Texto': 'texto'},
-    }
+    modelos_map = MODELOS_IMPORTABLES
+    mapas_campos = MAPAS_CAMPOS
 
     if request.method == 'POST':
         modelo_str = request.POST.get('modelo')
@@ -531,10 +736,22 @@ def importar_datos(request):
         centro = get_object_or_404(Centros, id=centro_id)
         mapa_campos = mapas_campos.get(modelo_str, {})
 
+        if request.POST.get('segundo_plano') or archivo.size > tamano_directo():
+            return _importar_en_segundo_plano(request, centro, 'base', archivo, modelo_str, 'super:importar_datos')
+
         try:
             importador = ImportadorBaseCentro(centro, modelo, mapa_campos)
-            importador.importar_archivo(archivo)
-            messages.success(request, f"Importación completada para {modelo_str}.")
+            resultado = importador.importar_archivo(archivo)
+            messages.success(
+                request,
+                f"Importación completada para {modelo_str}: {resultado['creados']} creados, "
+                f"{resultado['actualizados']} actualizados, {resultado['sin_cambios']} sin cambios."
+            )
+            errores = resultado['errores']
+            for error in errores[:10]:
+                messages.warning(request, f"Fila {error['fila']} ({error['nombre']}): {error['error']}")
+            if len(errores) > 10:
+                messages.warning(request, f"... y {len(errores) - 10} filas más con errores.")
         except Exception as e:
             messages.error(request, f"Error al importar: {str(e)}")
 
@@ -545,20 +762,97 @@ def importar_datos(request):
 
     return render(request, 'super/importar_datos.html', {
         'centros': centros,
-        'modelos': modelos
+        'modelos': modelos,
+        'trabajos': TrabajoImportacion.objects.filter(tipo='base').select_related('centro')[:10],
+        'tamano_directo': tamano_directo(),
     })
 
 
+def _importar_en_segundo_plano(request, centro, tipo, archivo, modelo, url_error):
+    """Guarda el archivo como TrabajoImportacion, lo lanza y lleva a su página de progreso."""
+    from app.core.middleware.centro import perfil_de_request
+    try:
+        trabajo = crear_trabajo(centro, tipo, archivo, modelo=modelo, usuario=perfil_de_request(request))
+    except ValueError as e:
+        messages.error(request, f"Error al importar: {e}")
+        return redirect(url_error)
+    lanzar_trabajo(trabajo)
+    messages.info(request, f"La importación de {archivo.name} continúa en segundo plano.")
+    return redirect('super:trabajo_importacion', pk=trabajo.pk)
+
+
+class TrabajoImportacionView(UserPassesTestMixin, DetailView):
+    """
+    Progreso de una importación en segundo plano. Con ?formato=json devuelve
+    el avance para refrescar la página; por POST reanuda un trabajo fallido
+    desde el último bloque confirmado.
+    """
+    model = TrabajoImportacion
+    template_name = 'super/trabajo_importacion.html'
+    context_object_name = 'trabajo'
+
+    def test_func(self):
+        return self.request.user.is_superuser
+
+    def get(self, request, *args, **kwargs):
+        if request.GET.get('formato') == 'json':
+            trabajo = self.get_object()
+            return JsonResponse({
+                'estado': trabajo.estado,
+                'estado_display': trabajo.get_estado_display(),
+                'progreso': trabajo.progreso,
+                'filas_procesadas': trabajo.filas_procesadas,
+                'total_filas': trabajo.total_filas,
+                'filas_por_segundo': trabajo.filas_por_segundo,
+                'creados': trabajo.creados,
+                'actualizados': trabajo.actualizados,
+                'sin_cambios': trabajo.sin_cambios,
+                'total_errores': trabajo.total_errores,
+                'mensaje_error': trabajo.mensaje_error,
+            })
+        return super().get(request, *args, **kwargs)
+
+    def post(self, request, *args, **kwargs):
+        trabajo = self.get_object()
+        if trabajo.estado == 'error':
+            lanzar_trabajo(trabajo)
+            messages.info(request, f"Reanudando la importación desde la fila {trabajo.filas_procesadas + 1}.")
+        return redirect('super:trabajo_importacion', pk=trabajo.pk)
+
+
+
+# Columnas de información nutricional del archivo → campo de InformacionNutricional
+COLUMNAS_NUTRICION = {
+    'Energía (kcal)': 'energia',
+    'Hidratos (g)': 'hidratosdecarbono',
+    'Azúcares (g)': 'azucares',
+    'Proteínas (g)': 'proteinas',
+    'Grasas (g)': 'grasas_totales',
+    'Grasas Saturadas (g)': 'grasas_saturadas',
+    'Sal (g)': 'sal',
+}
+
 
 class ImportadorAlimentos:
     """
     Importador para Alimento + InformacionNutricional + Alergenos + Trazas
-    Usa columna 'Imagen' en el Excel/CSV con ruta relativa desde MEDIA_ROOT
+    Usa columna 'Imagen' en el Excel/CSV con ruta relativa desde MEDIA_ROOT;
+    cada imagen se copia a alimentos/ con el hash de su contenido como nombre
+    (una sola copia aunque la usen mil filas) y con sus miniaturas.
+
+    Tipos, unidades, alérgenos y trazas del centro se cargan una vez y el
+    archivo se normaliza por columnas con pandas. Las filas se escriben en
+    bloques: por bloque se leen los alimentos existentes en una consulta, se
+    guardan alimentos y nutrición con bulk_create / bulk_update y las tablas
+    intermedias de alérgenos y trazas se reescriben con un delete y un
+    bulk_create.
     """
+    TAMANO_BLOQUE = 500
 
     def __init__(self, centro, usuario=None):
         self.centro = centro
         self.usuario = usuario
+        self.imagenes = {}  # ruta en el archivo -> nombre en el storage (None = no válida)
 
     def importar_archivo(self, archivo):
         ext = archivo.name.split('.')[-1].lower()
@@ -572,103 +866,258 @@ class ImportadorAlimentos:
         # Normalizar encabezados
         df.columns = [str(c).strip() for c in df.columns]
 
+        return self.importar_dataframe(df)
+
+    def validar_columnas(self, columnas):
+        if 'Nombre' not in columnas:
+            raise ValueError("El archivo no contiene la columna 'Nombre'.")
+
+    def preparar(self, df):
+        """
+        Copia en paralelo (app.core.imagenes) las imágenes de la columna
+        'Imagen' que aún no se han visto. Es trabajo de disco: se hace antes
+        de abrir la transacción del bloque para no alargarla.
+        """
+        if 'Imagen' not in df.columns:
+            return
+        from app.core.imagenes import ingerir_imagenes
+        rutas = df['Imagen'].dropna().astype(str).str.strip()
+        nuevas = [ruta for ruta in rutas.unique() if ruta and ruta not in self.imagenes]
+        if nuevas:
+            self.imagenes.update(ingerir_imagenes(nuevas, 'alimentos'))
+
+    def importar_dataframe(self, df):
+        """Importa un DataFrame ya leído: el archivo entero o un bloque (ver app.super.importacion)."""
+        self.validar_columnas(df.columns)
+        self.preparar(df)
         return self._procesar_dataframe(df)
 
-    def _procesar_dataframe(self, df):
-        columnas_alergenos = [
-            c for c in df.columns if Alergenos.objects.filter(nombre__iexact=c, centro=self.centro).exists()
-        ]
-        columnas_trazas = [
-            c for c in df.columns if Trazas.objects.filter(nombre__iexact=c, centro=self.centro).exists()
-        ]
+    def _cargar_mapas(self):
+        """{texto en minúsculas: id} de los maestros del centro, una consulta por modelo."""
+        def mapa(modelo, *campos):
+            resultado = {}
+            for pk, *textos in modelo.objects.filter(centro=self.centro).values_list('pk', *campos):
+                for texto in textos:
+                    if texto:
+                        resultado.setdefault(str(texto).strip().lower(), pk)
+            return resultado
+
+        self.tipos = mapa(TipoAlimento, 'nombre')
+        self.unidades = mapa(UnidadDeMedida, 'abreviatura', 'nombre')
+        self.alergenos = mapa(Alergenos, 'nombre')
+        self.trazas = mapa(Trazas, 'nombre')
+
+    @staticmethod
+    def _texto(serie):
+        return serie.astype('string').str.strip().str.lower()
+
+    def _marcas(self, df, mapa, valores):
+        """Por fila, lista de ids de las columnas de `mapa` cuyo valor está en `valores`."""
+        columnas = {col: mapa[col.lower()] for col in df.columns if col.lower() in mapa}
+        if not columnas:
+            return [[] for _ in range(len(df))]
+        marcas = pd.DataFrame({col: self._texto(df[col]).isin(valores) for col in columnas})
+        ids = list(columnas.values())
+        return [[pk for pk, marcado in zip(ids, fila) if marcado] for fila in marcas.itertuples(index=False)]
+
+    def _normalizar(self, df):
+        """
+        DataFrame con una fila por alimento y una columna por campo (ids de
+        tipo y unidades, imagen, nutrición y listas de ids de alérgenos y
+        trazas), validado con operaciones por columna.
+        Devuelve (datos, errores, descartadas, imagenes_no_encontradas).
+        """
+        datos = pd.DataFrame({'fila': df.index + 2}, index=df.index)  # cabecera + base 1
+        datos['nombre'] = df['Nombre'].astype('string').str.strip()
+        error = pd.Series(pd.NA, index=df.index, dtype='string')
 
-        total_creados = total_actualizados = errores = 0
-        imagenes_no_encontradas = []
+        def marcar(condicion, mensaje):
+            nonlocal error
+            error = error.mask(condicion.fillna(False).astype(bool) & error.isna(), mensaje)
+
+        marcar(datos['nombre'].str.len() > Alimento._meta.get_field('nombre').max_length, "Nombre demasiado largo")
+
+        if 'Tipo' in df.columns:
+            # Como hasta ahora, un tipo que no existe en el centro deja el alimento sin tipo
+            datos['tipo_alimento_id'] = self._texto(df['Tipo']).map(self.tipos)
+
+        for columna, campo in (('Unidad compra', 'unidad_compra_id'), ('Unidad uso', 'unidad_uso_id')):
+            if columna in df.columns:
+                texto = self._texto(df[columna])
+                datos[campo] = texto.map(self.unidades)
+                marcar(texto.fillna('').ne('') & datos[campo].isna(), f"{columna}: unidad desconocida")
+        if 'unidad_compra_id' in datos and 'unidad_uso_id' not in datos:
+            datos['unidad_uso_id'] = datos['unidad_compra_id']
 
-        for _, fila in df.iterrows():
-            nombre = fila.get('Nombre')
-            tipo_raw = fila.get('Tipo')
-            ruta_imagen_rel = fila.get('Imagen')
+        imagenes_no_encontradas = []
+        if 'Imagen' in df.columns:
+            rutas = df['Imagen'].astype('string').str.strip()
+            # Copias hechas en preparar(); None = no existe o no es una imagen
+            datos['imagen'] = rutas.map(self.imagenes, na_action='ignore')
+            imagenes_no_encontradas = rutas[rutas.fillna('').ne('') & datos['imagen'].isna()].tolist()
+
+        for columna, campo in COLUMNAS_NUTRICION.items():
+            if columna not in df.columns:
+                datos[campo] = 0.0
+                continue
+            numero = pd.to_numeric(df[columna], errors='coerce')
+            vacio = df[columna].astype('string').str.strip().fillna('').eq('')
+            marcar(numero.isna() & ~vacio, f"{columna}: no es un número")
+            marcar(numero.abs() >= 10 ** 4, f"{columna}: fuera de rango")
+            datos[campo] = numero.fillna(0).round(2)
+
+        datos['alergenos'] = self._marcas(df, self.alergenos, VALORES_SI)
+        datos['trazas'] = self._marcas(df, self.trazas, ('posible',))
+
+        validas = (datos['nombre'].fillna('') != '') & ~datos['nombre'].duplicated(keep='last')
+        descartadas = int((~validas).sum())
+        erroneas = validas & error.notna()
+        errores = [
+            {'fila': fila, 'nombre': nombre, 'error': mensaje}
+            for fila, nombre, mensaje in zip(datos['fila'][erroneas], datos['nombre'][erroneas], error[erroneas])
+        ]
+        datos = datos[validas & error.isna()]
+        return datos.astype(object).where(datos.notna(), None), errores, descartadas, imagenes_no_encontradas
+
+    def _importar_bloque(self, filas, campos, errores):
+        """Escribe un bloque de filas normalizadas. Devuelve los recuentos del bloque."""
+        nombres = [fila['nombre'] for fila in filas]
+        existentes = {
+            alimento.nombre: alimento
+            for alimento in Alimento.objects.filter(centro=self.centro, nombre__in=nombres).only('pk', 'nombre', *campos)
+        }
+        # El nombre del alimento es único en toda la BD, no solo en el centro
+        en_otro_centro = set(
+            Alimento.objects.filter(nombre__in=nombres).exclude(centro=self.centro).values_list('nombre', flat=True)
+        )
 
-            if not nombre:
+        nuevos, modificados, alimentos = [], [], []
+        for fila in filas:
+            nombre = fila['nombre']
+            if nombre in en_otro_centro:
+                errores.append({'fila': fila['fila'], 'nombre': nombre, 'error': "Ya existe un alimento con ese nombre en otro centro"})
                 continue
+            # Tipo siempre (vacío = sin tipo); unidades e imagen solo si vienen
+            valores = {
+                campo: fila[campo] for campo in campos
+                if campo == 'tipo_alimento_id' or fila[campo] is not None
+            }
+
+            alimento = existentes.get(nombre)
+            if alimento is None:
+                if valores.get('unidad_compra_id') is None:
+                    errores.append({'fila': fila['fila'], 'nombre': nombre, 'error': "Falta la unidad de compra"})
+                    continue
+                alimento = Alimento(centro=self.centro, nombre=nombre, **valores)
+                nuevos.append(alimento)
+            elif any(getattr(alimento, campo) != valor for campo, valor in valores.items()):
+                for campo, valor in valores.items():
+                    setattr(alimento, campo, valor)
+                modificados.append(alimento)
+            alimentos.append((alimento, fila))
+
+        Alimento.objects.bulk_create(nuevos)
+        if any(alimento.pk is None for alimento in nuevos):
+            # BD sin RETURNING en inserciones masivas: ids por nombre
+            ids = dict(
+                Alimento.objects.filter(centro=self.centro, nombre__in=[a.nombre for a in nuevos]).values_list('nombre', 'pk')
+            )
+            for alimento in nuevos:
+                alimento.pk = ids[alimento.nombre]
+        if modificados:
+            Alimento.objects.bulk_update(modificados, campos)
+
+        # Información nutricional
+        campos_nutricion = list(COLUMNAS_NUTRICION.values())
+        ids = [alimento.pk for alimento, _ in alimentos]
+        nutricion = {info.alimento_id: info for info in InformacionNutricional.objects.filter(alimento_id__in=ids)}
+        nuevas_info, modificadas_info = [], []
+        for alimento, fila in alimentos:
+            valores = {campo: Decimal(str(fila[campo])) for campo in campos_nutricion}
+            info = nutricion.get(alimento.pk)
+            if info is None:
+                nuevas_info.append(InformacionNutricional(alimento_id=alimento.pk, **valores))
+            elif any(getattr(info, campo) != valor for campo, valor in valores.items()):
+                for campo, valor in valores.items():
+                    setattr(info, campo, valor)
+                modificadas_info.append(info)
+        InformacionNutricional.objects.bulk_create(nuevas_info)
+        if modificadas_info:
+            InformacionNutricional.objects.bulk_update(modificadas_info, campos_nutricion)
+
+        # Alérgenos y trazas: se reescriben las filas de la tabla intermedia del bloque
+        for relacion in ('alergenos', 'trazas'):
+            campo_m2m = Alimento._meta.get_field(relacion)
+            through = campo_m2m.remote_field.through
+            origen, destino = campo_m2m.m2m_field_name(), campo_m2m.m2m_reverse_field_name()
+            through.objects.filter(**{f'{origen}_id__in': ids}).delete()
+            through.objects.bulk_create([
+                through(**{f'{origen}_id': alimento.pk, f'{destino}_id': pk})
+                for alimento, fila in alimentos
+                for pk in fila[relacion]
+            ])
 
-            try:
-                with transaction.atomic():
-                    # Buscar tipo de alimento
-                    tipo_obj = None
-                    if tipo_raw:
-                        tipo_obj = TipoAlimento.objects.filter(
-                            nombre__iexact=str(tipo_raw).strip(), centro=self.centro
-                        ).first()
-
-                    # Crear/actualizar Alimento
-                    filtro = {'nombre': nombre, 'centro': self.centro}
-                    defaults = {'tipo_alimento': tipo_obj}
-                    alimento_obj, creado = Alimento.objects.update_or_create(defaults=defaults, **filtro)
-
-                    if creado:
-                        total_creados += 1
-                    else:
-                        total_actualizados += 1
-
-                    # Asignar imagen si existe la ruta
-                    if ruta_imagen_rel:
-                        ruta_absoluta = os.path.join(settings.MEDIA_ROOT, ruta_imagen_rel)
-                        if os.path.exists(ruta_absoluta):
-                            with open(ruta_absoluta, 'rb') as f:
-                                alimento_obj.imagen.save(os.path.basename(ruta_absoluta), File(f), save=True)
-                            print(f"🖼️ Imagen asignada a {nombre}: {ruta_imagen_rel}")
-                        else:
-                            imagenes_no_encontradas.append(ruta_imagen_rel)
-                            print(f"⚠️ Imagen no encontrada: {ruta_imagen_rel}")
-
-                    # Información Nutricional
-                    info_defaults = {
-                        'energia': fila.get('Energía (kcal)', 0) or 0,
-                        'hidratosdecarbono': fila.get('Hidratos (g)', 0) or 0,
-                        'azucares': fila.get('Azúcares (g)', 0) or 0,
-                        'proteinas': fila.get('Proteínas (g)', 0) or 0,
-                        'grasas_totales': fila.get('Grasas (g)', 0) or 0,
-                        'grasas_saturadas': fila.get('Grasas Saturadas (g)', 0) or 0,
-                        'sal': fila.get('Sal (g)', 0) or 0,
-                    }
-                    InformacionNutricional.objects.update_or_create(alimento=alimento_obj, defaults=info_defaults)
-
-                    # Alergenos
-                    alimento_obj.alergenos.clear()
-                    for col in columnas_alergenos:
-                        valor = str(fila.get(col, 'No')).strip().lower()
-                        if valor in ('sí', 'si', 's', 'true', '1'):
-                            alergeno = Alergenos.objects.get(nombre__iexact=col, centro=self.centro)
-                            alimento_obj.alergenos.add(alergeno)
-
-                    # Trazas
-                    alimento_obj.trazas.clear()
-                    for col in columnas_trazas:
-                        valor = str(fila.get(col, 'No')).strip().lower()
-                        if valor == 'posible':
-                            traza = Trazas.objects.get(nombre__iexact=col, centro=self.centro)
-                            alimento_obj.trazas.add(traza)
-
-            except Exception as e:
-                errores += 1
-                print(f"❌ Error al procesar {nombre}: {e}")
-
-        print(f"✅ Alimentos - Creados: {total_creados}, Actualizados: {total_actualizados}, Errores: {errores}")
-        if imagenes_no_encontradas:
-            print(f"⚠️ {len(imagenes_no_encontradas)} imágenes no encontradas")
+        return {
+            'creados': len(nuevos),
+            'actualizados': len(modificados),
+            'sin_cambios': len(alimentos) - len(nuevos) - len(modificados),
+            'nutricion_creada': len(nuevas_info),
+            'nutricion_actualizada': len(modificadas_info),
+        }
 
+    def _procesar_dataframe(self, df):
+        """
+        Importa el DataFrame por bloques (cada uno en su transacción) y
+        devuelve {'filas', 'creados', 'actualizados', 'sin_cambios',
+        'descartadas', 'errores': [{'fila', 'nombre', 'error'}],
+        'imagenes_no_encontradas'}.
+        """
+        if not hasattr(self, 'tipos'):
+            self._cargar_mapas()  # Una vez por importador, no por bloque
+        datos, errores, descartadas, imagenes_no_encontradas = self._normalizar(df)
+        campos = [c for c in ('tipo_alimento_id', 'unidad_compra_id', 'unidad_uso_id', 'imagen') if c in datos.columns]
+        filas = datos.to_dict('records')
+
+        totales = dict.fromkeys(('creados', 'actualizados', 'sin_cambios', 'nutricion_creada', 'nutricion_actualizada'), 0)
+        with auditoria_en_lote(f"Importación de alimentos: {len(df)} filas", modelo='Alimento', centro=self.centro):
+            for inicio in range(0, len(filas), self.TAMANO_BLOQUE):
+                bloque = filas[inicio:inicio + self.TAMANO_BLOQUE]
+                errores_bloque = []
+                try:
+                    with transaction.atomic():
+                        cuentas = self._importar_bloque(bloque, campos, errores_bloque)
+                except IntegrityError as e:
+                    errores += [{'fila': fila['fila'], 'nombre': fila['nombre'], 'error': f"Bloque no importado: {e}"} for fila in bloque]
+                    continue
+                errores += errores_bloque
+                for clave, valor in cuentas.items():
+                    totales[clave] += valor
+                # bulk_create/bulk_update no lanzan señales: el resumen se cuenta a mano
+                contar_en_lote('Alimento', 'crear', cuentas['creados'])
+                contar_en_lote('Alimento', 'modificar', cuentas['actualizados'])
+                contar_en_lote('InformacionNutricional', 'crear', cuentas['nutricion_creada'])
+                contar_en_lote('InformacionNutricional', 'modificar', cuentas['nutricion_actualizada'])
+
+        from app.dashuser.estadisticas import invalidar_dashboard
+        invalidar_dashboard(self.centro.pk)
+
+        errores.sort(key=lambda e: e['fila'])
+        logger.info(
+            "Alimentos - Creados: %s, Actualizados: %s, Errores: %s, Imágenes no encontradas: %s",
+            totales['creados'], totales['actualizados'], len(errores), len(imagenes_no_encontradas),
+        )
         return {
-            'creados': total_creados,
-            'actualizados': total_actualizados,
+            'filas': len(df),
+            'creados': totales['creados'],
+            'actualizados': totales['actualizados'],
+            'sin_cambios': totales['sin_cambios'],
+            'descartadas': descartadas,
             'errores': errores,
             'imagenes_no_encontradas': imagenes_no_encontradas,
         }
 
-        
-        
-        
+
+
 def importar_datos_alimentos(request):
     if request.method == 'POST':
         centro_id = request.POST.get('centro')
@@ -680,14 +1129,32 @@ def importar_datos_alimentos(request):
 
         centro = get_object_or_404(Centros, id=centro_id)
 
+        if request.POST.get('segundo_plano') or archivo.size > tamano_directo():
+            return _importar_en_segundo_plano(request, centro, 'alimentos', archivo, '', 'super:importar_datos_alimentos')
+
         try:
             importador = ImportadorAlimentos(centro)
-            importador.importar_archivo(archivo)
-            messages.success(request, "Importación de alimentos completada correctamente.")
+            resultado = importador.importar_archivo(archivo)
+            messages.success(
+                request,
+                f"Importación de alimentos completada: {resultado['creados']} creados, "
+                f"{resultado['actualizados']} actualizados, {resultado['sin_cambios']} sin cambios."
+            )
+            errores = resultado['errores']
+            for error in errores[:10]:
+                messages.warning(request, f"Fila {error['fila']} ({error['nombre']}): {error['error']}")
+            if len(errores) > 10:
+                messages.warning(request, f"... y {len(errores) - 10} filas más con errores.")
+            if resultado['imagenes_no_encontradas']:
+                messages.warning(request, f"{len(resultado['imagenes_no_encontradas'])} imágenes no encontradas.")
         except Exception as e:
             messages.error(request, f"Error al importar: {e}")
 
         return redirect('super:importar_datos_alimentos')
 
     centros = Centros.objects.all()
-    return render(request, 'super/importar_alimentos.html', {'centros': centros})        
\ No newline at end of file
+    return render(request, 'super/importar_alimentos.html', {
+        'centros': centros,
+        'trabajos': TrabajoImportacion.objects.filter(tipo='alimentos').select_related('centro')[:10],
+        'tamano_directo': tamano_directo(),
+    })        
\ No newline at end of file